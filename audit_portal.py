@@ -0,0 +1,163 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import argparse
+import ckanapi
+import csv
+import logging
+
+from collections import Counter
+from datetime import datetime
+from db_schema import close_session, connect_to_database
+from geogratis_dataset_factory import MetadataDatasetModelGeogratisFactory
+from harvest_logging import ProgressReporter, add_logging_arguments, setup_logging
+from harvest_sources import get_source
+from harvester_config import add_config_argument, get_config, load_config
+from metadata_model import MetadataDatasetModel
+from multiprocessing import Pool, cpu_count
+from profiling import add_profile_arguments, profiled
+
+argparser = argparse.ArgumentParser(
+    description='Compare the harvested datasets of a source with their versions on the CKAN portal'
+)
+argparser.add_argument('-t', '--type', action='store', dest='scan_type', default='gr',
+                       help='Type of harvest data to audit: e.g. ec or gr')
+argparser.add_argument('-o', '--output', action='store', default='', dest='report',
+                       help='CSV report file (default: audit_<type>_<date>.csv)')
+argparser.add_argument('-p', '--portal', action='store', default='', dest='portal',
+                       help='URL of the CKAN portal (default: ckan.remote_portal)')
+argparser.add_argument('-w', '--workers', action='store', type=int, default=cpu_count(), dest='workers',
+                       help='Number of worker processes (default: one per CPU)')
+argparser.add_argument('--ignore', action='append', default=[], dest='ignore',
+                       help='Field left out of the comparison, e.g. url. May be repeated.')
+add_config_argument(argparser)
+add_logging_arguments(argparser)
+add_profile_arguments(argparser)
+
+# Number of records sent to a worker at a time
+CHUNK_SIZE = 50
+
+# State of each worker process, set up once by _init_worker()
+_worker = {}
+
+
+def _init_worker(scan_type, portal_url, ignore):
+    source = get_source(scan_type)
+    _worker['factory'] = source.create_factory()
+    _worker['record_class'] = source.record_class
+    # convert_ckan_json() reads any CKAN dataset, whatever its source
+    _worker['portal_factory'] = MetadataDatasetModelGeogratisFactory()
+    _worker['portal'] = ckanapi.RemoteCKAN(portal_url)
+    _worker['ignore'] = set(ignore)
+
+
+def _audit_ids(ids):
+    """Audit the harvested records with these ids. Returns a list of (uuid, status, differing fields)."""
+    record_class = _worker['record_class']
+    session = connect_to_database()
+    try:
+        records = session.query(record_class).filter(record_class.id.in_(ids)).all()
+        return [_audit_record(record) for record in records]
+    finally:
+        close_session()
+
+
+def _audit_record(record):
+    if record.state != 'active':
+        return record.uuid, 'inactive', []
+    try:
+        harvested = _worker['factory'].create_model_from_record(record)
+    except Exception:
+        logging.exception('{0} failed to convert'.format(record.uuid))
+        return record.uuid, 'error', []
+    if harvested is None:
+        return record.uuid, 'invalid', []
+    try:
+        package = _worker['portal'].action.package_show(id=record.uuid)
+        portal = _worker['portal_factory'].convert_ckan_json(package)
+    except ckanapi.NotFound:
+        return record.uuid, 'not_on_portal', []
+    except Exception, e:
+        logging.error('{0} could not be read from the portal: {1}'.format(record.uuid, e))
+        return record.uuid, 'error', []
+    fields = [f for f in harvested.diff_fields(portal) if f not in _worker['ignore']]
+    return record.uuid, 'different' if fields else 'same', fields
+
+
+def _id_chunks(record_class):
+    """Generate the ids of every harvested record in chunks of CHUNK_SIZE, reading them a page at a time"""
+    session = connect_to_database()
+    last_id = 0
+    while True:
+        ids = [row[0] for row in session.query(record_class.id).filter(record_class.id > last_id).
+               order_by(record_class.id).limit(1000)]
+        if len(ids) == 0:
+            break
+        for i in range(0, len(ids), CHUNK_SIZE):
+            yield ids[i:i + CHUNK_SIZE]
+        last_id = ids[-1]
+    close_session()
+
+
+def summary_file(report):
+    if report.endswith('.csv'):
+        report = report[:-len('.csv')]
+    return report + '_summary.csv'
+
+
+def main(scan_type, report, portal_url='', workers=None, ignore=()):
+    """Write a CSV report with one row per harvested record: its status (same, different, not_on_portal,
+    inactive, invalid or error), the number of differing fields and a 0/1 column per compared field, and a
+    summary CSV with the number of records of each status and of records that differ in each field"""
+    if not portal_url:
+        portal_url = get_config().get('ckan', 'ckan.remote_portal')
+    fields = [f for f in MetadataDatasetModel.compared_fields if f not in ignore]
+    statuses = Counter()
+    mismatches = Counter()
+    progress = ProgressReporter('{0} audit'.format(scan_type))
+
+    # Start the workers before the first database connection, so that they do not inherit it
+    pool = Pool(workers or cpu_count(), _init_worker, (scan_type, portal_url, list(ignore)))
+    try:
+        record_class = get_source(scan_type).record_class
+        with open(report, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['uuid', 'status', 'differences'] + fields)
+            for rows in pool.imap_unordered(_audit_ids, _id_chunks(record_class)):
+                for uuid, status, differing in rows:
+                    statuses[status] += 1
+                    mismatches.update(differing)
+                    differing = set(differing)
+                    writer.writerow([uuid, status, len(differing)] + [int(f in differing) for f in fields])
+                progress.advance(len(rows))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    progress.finish()
+
+    with open(summary_file(report), 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['kind', 'name', 'records'])
+        for status, count in statuses.most_common():
+            writer.writerow(['status', status, count])
+        for field in fields:
+            writer.writerow(['field', field, mismatches[field]])
+    logging.info('{0} records audited: {1}'.format(sum(statuses.values()), ', '.join(
+        '{0} {1}'.format(count, status) for status, count in statuses.most_common())))
+    for field, count in mismatches.most_common():
+        logging.info('{0}: {1} records differ'.format(field, count))
+    return statuses, mismatches
+
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    setup_logging(args)
+    report = args.report
+    if report == '':
+        report = 'audit_{0}_{1}.csv'.format(args.scan_type, datetime.now().strftime('%Y-%m-%d-%H%M%S'))
+    with profiled(args):
+        main(args.scan_type, report, portal_url=args.portal, workers=args.workers, ignore=args.ignore)
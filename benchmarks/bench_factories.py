@@ -0,0 +1,175 @@
+"""Benchmark of the conversion factories.
+
+Converts a synthetic corpus (see corpus.py) with the Geogratis and EC factories, without a database, and
+reports the records per second, the median and 99th percentile time per record and the peak memory of each
+run. As in converter.py, the time per record runs from the harvested text, the JSON of a GeogratisRecord or
+the XML of an EC record, to the JSON serialization of the converted record.
+
+Each source and corpus size runs in a process of its own, so that the peak memory is that of the run.
+Results can be saved as a baseline with --save; later runs are compared with the saved baseline and the
+script exits with an error if the throughput, p99 or peak memory of a run is worse than the baseline by more
+than the tolerance. Baselines depend on the machine, so they are not shared.
+
+"""
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import argparse
+import gc
+import multiprocessing
+import os
+import resource
+import simplejson as json
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import corpus
+
+from harvester_config import add_config_argument, load_config
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(_HERE, 'baselines', 'factories.json')
+
+argparser = argparse.ArgumentParser(description='Benchmark the Geogratis and EC conversion factories')
+argparser.add_argument('-t', '--type', action='append', default=[], dest='sources',
+                       help='Factory to benchmark: gr or ec (default: both). May be repeated.')
+argparser.add_argument('-s', '--sizes', action='store', default='100,1000,5000', dest='sizes',
+                       help='Comma separated corpus sizes (default: 100,1000,5000)')
+argparser.add_argument('-d', '--corpus', action='store', default='', dest='corpus',
+                       help='Read the corpus from the files written by corpus.py to this directory '
+                            'instead of generating it')
+argparser.add_argument('-b', '--baseline', action='store', default=BASELINE_FILE, dest='baseline',
+                       help='Baseline file (default: benchmarks/baselines/factories.json)')
+argparser.add_argument('--save', action='store_true', default=False, dest='save',
+                       help='Save the results as the new baseline')
+argparser.add_argument('--tolerance', action='store', type=float, default=0.25, dest='tolerance',
+                       help='Allowed regression from the baseline, as a fraction (default: 0.25)')
+add_config_argument(argparser)
+
+
+def percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on OS X
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return peak / 1024.0
+
+
+def load_records(source, size, corpus_dir):
+    """Return (uuid, record) pairs: a GeogratisRecord holding the harvested JSON text for 'gr', the XML for 'ec'"""
+    if corpus_dir:
+        records = corpus.read_corpus(corpus_dir, source, size)
+    elif source == 'gr':
+        records = corpus.geogratis_corpus(size)
+    else:
+        records = corpus.nap_corpus(size)
+    if source == 'gr':
+        from db_schema import GeogratisRecord
+        records = [(en['id'], GeogratisRecord(uuid=en['id'], json_record_en=unicode(json.dumps(en)),
+                                              json_record_fr=unicode(json.dumps(fr)))) for en, fr in records]
+    return records
+
+
+def run_factory(source, records):
+    """Convert every record and return the sorted conversion times in seconds"""
+    if source == 'gr':
+        from geogratis_dataset_factory import MetadataDatasetModelGeogratisFactory
+        factory = MetadataDatasetModelGeogratisFactory()
+        convert = lambda record: factory.create_model_from_record(record[1])
+    else:
+        from ec_dataset_factory import MetadataDatasetModelECFactory
+        factory = MetadataDatasetModelECFactory()
+        convert = lambda record: factory.convert_nap_xml(record[1])
+
+    timings = []
+    for record in records:
+        start = time.time()
+        ds = convert(record)
+        if ds is None:
+            raise ValueError('Record {0} was not converted'.format(record[0]))
+        json.dumps(ds.as_dict())
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings
+
+
+def run_scenario(source, size, corpus_dir, results):
+    records = load_records(source, size, corpus_dir)
+    gc.collect()
+    timings = run_factory(source, records)
+    results.put({
+        'records': len(timings),
+        'records_per_sec': len(timings) / sum(timings),
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+    })
+
+
+def run_isolated(source, size, corpus_dir):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_scenario, args=(source, size, corpus_dir, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def regressions(result, baseline, tolerance):
+    """Return a description of every measure of `result` that is worse than `baseline` beyond the tolerance"""
+    found = []
+    if result['records_per_sec'] < baseline['records_per_sec'] * (1 - tolerance):
+        found.append('records/sec {0:.1f} < {1:.1f}'.format(result['records_per_sec'], baseline['records_per_sec']))
+    for measure in ('p99_ms', 'peak_rss_mb'):
+        if result[measure] > baseline[measure] * (1 + tolerance):
+            found.append('{0} {1:.2f} > {2:.2f}'.format(measure, result[measure], baseline[measure]))
+    return found
+
+
+def main(sources, sizes, corpus_dir, baseline_file, save, tolerance):
+    baselines = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baselines = json.load(f)
+
+    print '{0:<10} {1:>12} {2:>10} {3:>10} {4:>12}  {5}'.format('scenario', 'records/sec', 'p50 ms', 'p99 ms',
+                                                                 'peak RSS MB', 'baseline')
+    results = {}
+    failed = False
+    for source in sources:
+        for size in sizes:
+            name = '{0}/{1}'.format(source, size)
+            result = run_isolated(source, size, corpus_dir)
+            results[name] = result
+            if save:
+                status = 'saved'
+            elif name not in baselines:
+                status = 'none'
+            else:
+                found = regressions(result, baselines[name], tolerance)
+                status = 'REGRESSION: ' + '; '.join(found) if found else 'ok'
+                failed = failed or len(found) > 0
+            print '{0:<10} {1:12.1f} {2:10.2f} {3:10.2f} {4:12.1f}  {5}'.format(
+                name, result['records_per_sec'], result['p50_ms'], result['p99_ms'], result['peak_rss_mb'], status)
+
+    if save:
+        baselines.update(results)
+        if not os.path.isdir(os.path.dirname(baseline_file)):
+            os.makedirs(os.path.dirname(baseline_file))
+        with open(baseline_file, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    sys.exit(main(args.sources or ['gr', 'ec'], [int(s) for s in args.sizes.split(',')], args.corpus,
+                  args.baseline, args.save, args.tolerance))
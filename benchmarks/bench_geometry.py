@@ -0,0 +1,101 @@
+"""Benchmark of the conversion of Geogratis records with large footprints.
+
+Converts the same record, with footprints of an increasing number of vertices, in two ways and reports the
+milliseconds per record of each:
+
+  decoded - both JSON documents are decoded in full and the geometry is encoded again for the spatial field,
+            as the factory did before the geometry was read lazily
+  lazy    - the converter's path: the geometry is left undecoded and its JSON text is copied to the spatial
+            field
+
+Both include the JSON serialization of the converted record, as in converter.py. Geometry settings of the
+[geometry] section that reduce geometries force the lazy path to decode them too.
+
+"""
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import argparse
+import logging
+import math
+import os
+import random
+import simplejson as json
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import corpus
+
+from harvester_config import add_config_argument, load_config
+
+argparser = argparse.ArgumentParser(description='Benchmark the conversion of Geogratis records with large footprints')
+argparser.add_argument('-v', '--vertices', action='store', default='4,250,3000,20000,100000', dest='vertices',
+                       help='Comma separated numbers of footprint vertices (default: 4,250,3000,20000,100000)')
+argparser.add_argument('-r', '--repeat', action='store', type=int, default=0, dest='repeat',
+                       help='Conversions per size (default: enough for about a second of each path)')
+add_config_argument(argparser)
+
+
+class HarvestedRecord(object):
+    """The fields of a GeogratisRecord that the factory reads"""
+
+    def __init__(self, en, fr):
+        self.json_record_en = json.dumps(en)
+        self.json_record_fr = json.dumps(fr)
+
+
+def large_record(vertices):
+    """A harvested record whose English and French documents share a footprint of `vertices` vertices"""
+    rnd = random.Random(vertices)
+    en, fr = corpus.geogratis_pair(rnd, vertices)
+    ring = []
+    for i in xrange(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = rnd.uniform(4.0, 5.0)
+        ring.append([round(-100.0 + r * math.cos(angle), 6), round(60.0 + r * math.sin(angle), 6)])
+    ring.append(list(ring[0]))
+    en['geometry'] = fr['geometry'] = {'type': 'Polygon', 'coordinates': [ring]}
+    return HarvestedRecord(en, fr)
+
+
+def convert_decoded(factory, record):
+    ds = factory.convert_geogratis_json(json.loads(record.json_record_en), json.loads(record.json_record_fr))
+    return json.dumps(ds.as_dict())
+
+
+def convert_lazy(factory, record):
+    return json.dumps(factory.create_model_from_record(record).as_dict())
+
+
+def time_per_record(convert, factory, record, repeat):
+    if repeat <= 0:
+        # Calibrate on one conversion, for about a second of conversions
+        start = time.time()
+        convert(factory, record)
+        repeat = max(3, min(1000, int(1.0 / max(time.time() - start, 1e-4))))
+    start = time.time()
+    for i in xrange(repeat):
+        convert(factory, record)
+    return (time.time() - start) / repeat * 1000
+
+
+def main(vertex_counts, repeat):
+    from geogratis_dataset_factory import MetadataDatasetModelGeogratisFactory
+    factory = MetadataDatasetModelGeogratisFactory()
+    print '{0:>9} {1:>10} {2:>12} {3:>12} {4:>8}'.format('vertices', 'record kB', 'decoded ms', 'lazy ms',
+                                                        'speedup')
+    for vertices in vertex_counts:
+        record = large_record(vertices)
+        decoded = time_per_record(convert_decoded, factory, record, repeat)
+        lazy = time_per_record(convert_lazy, factory, record, repeat)
+        size = (len(record.json_record_en) + len(record.json_record_fr)) / 1024.0
+        print '{0:9} {1:10.1f} {2:12.3f} {3:12.3f} {4:7.1f}x'.format(vertices, size, decoded, lazy, decoded / lazy)
+
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    logging.getLogger().setLevel(logging.ERROR)
+    main([int(v) for v in args.vertices.split(',')], args.repeat)
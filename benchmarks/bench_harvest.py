@@ -0,0 +1,248 @@
+"""End to end benchmark of a harvest against local stub servers.
+
+Serves a synthetic corpus (see corpus.py) from two stub HTTP servers: a Geogratis feed, with its paged
+product lists, next and monitor links and the English and French JSON of every product, and a CSW server
+answering GetRecords and GetRecordById. The Geogratis and EC scanners, the converter and dump_packages then
+run against them and a scratch SQLite database, or the database given with --db, and the time and records
+per second of every stage are reported.
+
+The stub servers answer every request after --latency milliseconds, to approach the response times of the
+real servers. The HTTP cache and the delay between Geogratis requests are switched off for the run.
+
+"""
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import argparse
+import logging
+import os
+import shutil
+import simplejson as json
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import corpus
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from lxml import etree
+from profiling import add_profile_arguments, profiled
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs, urlparse
+
+argparser = argparse.ArgumentParser(description='Benchmark a harvest against local Geogratis and CSW stubs')
+argparser.add_argument('-n', '--records', action='store', type=int, default=200, dest='records',
+                       help='Number of records of each source (default: 200)')
+argparser.add_argument('-l', '--latency', action='store', type=float, default=0, dest='latency',
+                       help='Response time of the stub servers, in milliseconds (default: 0)')
+argparser.add_argument('-p', '--page-size', action='store', type=int, default=100, dest='page_size',
+                       help='Products per Geogratis feed page (default: 100)')
+argparser.add_argument('--db', action='store', default='', dest='db_url',
+                       help='SQLAlchemy URL of the database to use instead of a scratch SQLite database. '
+                            'It must be empty, with the tables of db.sql.')
+argparser.add_argument('-t', '--type', action='append', default=[], dest='sources',
+                       help='Source to harvest: gr or ec (default: both). May be repeated.')
+argparser.add_argument('-v', '--verbose', action='store_true', default=False, dest='verbose',
+                       help='Show the output and warnings of the harvester scripts')
+add_profile_arguments(argparser)
+
+CSW_NS = 'http://www.opengis.net/cat/csw/2.0.2'
+FEED_PATH = '/api/en/nrcan-rncan/ess-sst'
+
+SEARCH_RESULTS = u'''<csw:GetRecordsResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <csw:SearchResults numberOfRecordsMatched="{0}" numberOfRecordsReturned="{1}" nextRecord="{2}" elementSet="brief">
+{3}
+  </csw:SearchResults>
+</csw:GetRecordsResponse>'''
+
+BRIEF_RECORD = u'<csw:BriefRecord><dc:identifier>{0}</dc:identifier><dc:title>{1}</dc:title></csw:BriefRecord>'
+
+RECORD_BY_ID = u'''<csw:GetRecordByIdResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2">
+{0}
+</csw:GetRecordByIdResponse>'''
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def _reply(self, status, body, content_type):
+        time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GeogratisStub(StubHandler):
+    """Serves the feed pages and the product records of the Geogratis corpus"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') == FEED_PATH:
+            self._reply(200, json.dumps(self.feed_page(parse_qs(url.query))), 'application/json')
+            return
+        lang = url.path.split('/')[2]
+        record_id = url.path.rsplit('/', 1)[-1][:-len('.json')]
+        if record_id in self.server.records:
+            self._reply(200, json.dumps(self.server.records[record_id][lang == 'fr']), 'application/json')
+        else:
+            self._reply(404, '{}', 'application/json')
+
+    def feed_page(self, query):
+        ids = self.server.ids
+        start = int(query.get('start-index', ['1'])[0])
+        page_size = int(query.get('max-results', [self.server.page_size])[0])
+        links = [{'rel': 'monitor', 'href': self.server.base_url + FEED_PATH + '?edited-min=2015-01-01&alt=json'}]
+        if start - 1 + page_size < len(ids):
+            links.append({'rel': 'next', 'href': '{0}{1}?start-index={2}&alt=json&max-results={3}'.format(
+                self.server.base_url, FEED_PATH, start + page_size, page_size)})
+        return {'count': len(ids), 'links': links,
+                'products': [{'id': record_id} for record_id in ids[start - 1:start - 1 + page_size]]}
+
+
+class CswStub(StubHandler):
+    """Serves the NAP documents of the EC corpus, in GetRecords pages and by id"""
+
+    def do_POST(self):
+        request = etree.fromstring(self.rfile.read(int(self.headers['Content-Length'])))
+        if request.tag == '{{{0}}}GetRecords'.format(CSW_NS):
+            ids = self.server.ids
+            start = max(int(request.get('startPosition', 1) or 1), 1)
+            page = ids[start - 1:start - 1 + int(request.get('maxRecords', 10))]
+            next_record = start + len(page)
+            if next_record > len(ids):
+                next_record = 0
+            body = SEARCH_RESULTS.format(len(ids), len(page), next_record, u'\n'.join(
+                BRIEF_RECORD.format(record_id, record_id) for record_id in page))
+        else:
+            record_id = request.findtext('{{{0}}}Id'.format(CSW_NS))
+            document = self.server.records.get(record_id, '')
+            # The XML declaration of the document cannot be embedded in the response
+            if document.startswith('<?xml'):
+                document = document[document.index('?>') + 2:]
+            body = RECORD_BY_ID.format(document.decode('utf-8'))
+        self._reply(200, body.encode('utf-8'), 'application/xml')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_server(handler, ids, records, latency, page_size=None):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.ids = ids
+    server.records = records
+    server.latency = latency
+    server.page_size = page_size
+    server.base_url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class Stage(object):
+    """Times a stage of the harvest, with the output of the harvester scripts hidden unless `verbose`"""
+
+    def __init__(self, verbose):
+        self.verbose = verbose
+        self.results = []
+
+    def run(self, name, f, count):
+        stdout = sys.stdout
+        if not self.verbose:
+            sys.stdout = open(os.devnull, 'w')
+        start = time.time()
+        try:
+            f()
+        finally:
+            elapsed = time.time() - start
+            if not self.verbose:
+                sys.stdout.close()
+                sys.stdout = stdout
+        records = count()
+        self.results.append((name, records, elapsed))
+        print '{0:<12} {1:>8} {2:10.2f} {3:12.1f}'.format(name, records, elapsed,
+                                                         records / elapsed if elapsed > 0 else 0)
+
+
+def count_rows(query_class, source=None):
+    from db_schema import close_session, connect_to_database
+    session = connect_to_database()
+    query = session.query(query_class)
+    if source is not None:
+        query = query.filter(query_class.source == source)
+    count = query.count()
+    close_session()
+    return count
+
+
+def count_lines(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return sum(1 for line in f)
+
+
+def main(args):
+    scratch = tempfile.mkdtemp(prefix='bench_harvest')
+    latency = args.latency / 1000.0
+    sources = args.sources or ['gr', 'ec']
+    servers = []
+    try:
+        gr_records = dict((en['id'], (en, fr)) for en, fr in corpus.geogratis_corpus(args.records))
+        gr_server = start_server(GeogratisStub, sorted(gr_records), gr_records, latency, args.page_size)
+        ec_records = dict(corpus.nap_corpus(args.records))
+        ec_server = start_server(CswStub, sorted(ec_records), ec_records, latency)
+        servers = [gr_server, ec_server]
+
+        # Options are read from the environment before harvester.ini, so the scripts need no other setup
+        os.environ['HARVESTER_SQLALCHEMY_URL'] = args.db_url or 'sqlite:///' + os.path.join(scratch, 'harvest.db')
+        os.environ['HARVESTER_GEOGRATIS_URL'] = gr_server.base_url + '/api'
+        os.environ['HARVESTER_GEOGRATIS_REQUEST_DELAY'] = '0'
+        os.environ['HARVESTER_CSW_URL'] = ec_server.base_url + '/csw'
+        os.environ['HARVESTER_CACHE_ENABLED'] = 'false'
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.ERROR)
+
+        import converter
+        import csw_scanner
+        import dump_packages
+        import gr_scanner
+        from db_schema import ECRecord, GeogratisRecord, Packages
+        from harvester_config import load_config
+        load_config()
+
+        print '{0} records per source, {1:.0f} ms latency'.format(args.records, args.latency)
+        print '{0:<12} {1:>8} {2:>10} {3:>12}'.format('stage', 'records', 'seconds', 'records/sec')
+        stage = Stage(args.verbose)
+        total = time.time()
+        if 'gr' in sources:
+            stage.run('scan gr', lambda: gr_scanner.main(), lambda: count_rows(GeogratisRecord))
+        if 'ec' in sources:
+            stage.run('scan ec', lambda: csw_scanner.main(), lambda: count_rows(ECRecord))
+        for source in sources:
+            stage.run('convert ' + source, lambda: converter.main('', source),
+                      lambda: count_rows(Packages, source))
+        for source in sources:
+            dump_file = os.path.join(scratch, 'dump_{0}.jsonl'.format(source))
+            stage.run('dump ' + source, lambda: dump_packages.main('', dump_file, source),
+                      lambda: count_lines(dump_file))
+        print '{0:<12} {1:>8} {2:10.2f}'.format('total', '', time.time() - total)
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    with profiled(args):
+        main(args)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the Geogratis keyword normalization.
+
+Compares KeywordNormalizer with the per-keyword string replacements that the Geogratis factory used before,
+checks that both produce the same keywords for every record and reports the time per record.
+
+The keyword lists are read from harvested Geogratis records: a JSON Lines file of records (-f) or the
+geogratis_records table of the harvester database (-d). Without either, a synthetic corpus with the
+structure of the Geogratis keywords is generated.
+
+"""
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import argparse
+import os
+import random
+import simplejson as json
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harvester_config import add_config_argument, load_config
+from keyword_normalizer import KeywordNormalizer
+
+argparser = argparse.ArgumentParser(description='Benchmark the Geogratis keyword normalization')
+argparser.add_argument('-f', '--file', action='store', default='', dest='records_file',
+                       help='JSON Lines file of Geogratis records')
+argparser.add_argument('-d', '--database', action='store_true', default=False, dest='database',
+                       help='Read the records from the geogratis_records table')
+argparser.add_argument('-n', '--records', action='store', type=int, default=5000, dest='records',
+                       help='Number of synthetic records (default: 5000)')
+argparser.add_argument('-r', '--repeat', action='store', type=int, default=5, dest='repeat',
+                       help='Number of timed runs; the best one is reported (default: 5)')
+add_config_argument(argparser)
+
+
+def legacy_clean_keyword(keyword):
+    keyword = keyword.strip().replace("/", " - ")
+    keyword = keyword.replace("(", "- ").replace(")", "")
+    keyword = keyword.replace("[", "- ").replace("]", "")
+    keyword = keyword.replace("+", "")
+    keyword = keyword.lower().strip()
+    return keyword
+
+
+def legacy_record_keywords(subjects, keywords):
+    base_keywords = [legacy_clean_keyword(s) for s in subjects]
+    for keyword in keywords:
+        words = keyword.split('>')
+        if len(words) > 0:
+            last_word = words.pop()
+            last_word = legacy_clean_keyword(last_word)
+            base_keywords.append(last_word.strip())
+    base_keywords = list(set(base_keywords))
+    base_keywords.sort()
+    return base_keywords
+
+
+def record_terms(geo_rec):
+    subjects = []
+    for cat in geo_rec.get('categories', []):
+        if cat['type'] == 'urn:gc:subject':
+            subjects = [term['label'] for term in cat['terms']]
+            break
+    return subjects, geo_rec.get('keywords', [])
+
+
+def load_file(path):
+    corpus = []
+    with open(path) as records:
+        for line in records:
+            if line.strip():
+                corpus.append(record_terms(json.loads(line)))
+    return corpus
+
+
+def load_database():
+    from db_schema import GeogratisRecord, close_session, connect_to_database
+    corpus = []
+    session = connect_to_database()
+    for json_en, json_fr in session.query(GeogratisRecord.json_record_en, GeogratisRecord.json_record_fr):
+        for json_record in (json_en, json_fr):
+            if json_record:
+                geo_rec = json.loads(json_record)
+                if geo_rec:
+                    corpus.append(record_terms(geo_rec))
+    close_session()
+    return corpus
+
+
+def synthetic_corpus(count):
+    rnd = random.Random(42)
+    subjects = [u'Geology (rocks)', u'Mapping/Maps', u'Oceans', u'Soils', u'Earth Sciences',
+                u'Hydrography', u'Sciences de la Terre', u'Géologie [roches]', u'Cartes + Plans']
+    levels = [u'Earth Sciences', u'Geology', u'Bedrock', u'Surficial Geology', u'Geophysics', u'Gravity',
+              u'Magnetism', u'Seismology', u'Geochemistry (Till)', u'Lakes/Rivers', u'Glaciers [Ice]',
+              u'Mines + Minerals', u'Topographic maps', u'NTS 031G', u'Permafrost', u'Coastal zones']
+    corpus = []
+    for i in range(count):
+        record_subjects = rnd.sample(subjects, rnd.randint(1, 3))
+        keywords = []
+        for j in range(rnd.randint(3, 15)):
+            keywords.append(u' > '.join(rnd.sample(levels, rnd.randint(1, 4))))
+        # A few keywords are unique to their record
+        keywords.append(u'Project {0} (phase {1})'.format(i, i % 7))
+        corpus.append((record_subjects, keywords))
+    return corpus
+
+
+def best_time(repeat, run):
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        run()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main(corpus, repeat):
+    expected = [legacy_record_keywords(s, k) for s, k in corpus]
+    normalizer = KeywordNormalizer()
+    actual = normalizer.page_keywords(corpus)
+    mismatches = [i for i in range(len(corpus)) if expected[i] != actual[i]]
+    if mismatches:
+        print 'Output differs for {0} records, e.g. {1}'.format(len(mismatches), corpus[mismatches[0]])
+        return 1
+
+    terms = sum(len(s) + len(k) for s, k in corpus)
+    print '{0} records, {1} keywords'.format(len(corpus), terms)
+    legacy = best_time(repeat, lambda: [legacy_record_keywords(s, k) for s, k in corpus])
+    # A new normalizer for every run, so that the time includes filling the memo
+    batch = best_time(repeat, lambda: KeywordNormalizer().page_keywords(corpus))
+    for name, elapsed in (('legacy', legacy), ('normalizer', batch)):
+        print '{0:<12} {1:8.3f} s {2:10.1f} us/record'.format(name, elapsed, elapsed * 1e6 / len(corpus))
+    print 'speedup      {0:8.2f}x'.format(legacy / batch)
+    return 0
+
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    if args.records_file != '':
+        corpus = load_file(args.records_file)
+    elif args.database:
+        corpus = load_database()
+    else:
+        corpus = synthetic_corpus(args.records)
+    sys.exit(main(corpus, args.repeat))
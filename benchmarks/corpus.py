@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Synthetic harvest records for the benchmarks.
+
+Generates Geogratis EN/FR JSON record pairs and EC NAP (ISO 19115) XML documents with the structure of the
+harvested records: bilingual titles and summaries, gc:subject and place categories, keyword hierarchies, ISO
+topic categories, files of the usual formats and footprints from a few vertices to a few thousand. The same
+seed always gives the same corpus.
+
+Run as a script to write a corpus to JSON Lines files, so that a fixed corpus can be kept next to its
+baselines; one file of {"en": ..., "fr": ...} pairs and one of {"uuid": ..., "xml": ...} documents per size.
+
+"""
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import argparse
+import math
+import os
+import random
+import simplejson as json
+import uuid as uuid_module
+
+from xml.sax.saxutils import escape
+
+argparser = argparse.ArgumentParser(description='Write a synthetic Geogratis and EC record corpus')
+argparser.add_argument('-o', '--output', action='store', default='corpus', dest='output',
+                       help='Directory of the corpus files (default: corpus)')
+argparser.add_argument('-s', '--sizes', action='store', default='100,1000,5000', dest='sizes',
+                       help='Comma separated numbers of records (default: 100,1000,5000)')
+argparser.add_argument('--seed', action='store', type=int, default=42, dest='seed',
+                       help='Random seed (default: 42)')
+
+SUBJECTS = [(u'Geology (rocks)', u'Géologie (roches)'), (u'Mapping/Maps', u'Cartographie/Cartes'),
+            (u'Oceans', u'Océans'), (u'Soils', u'Sols'), (u'Earth Sciences', u'Sciences de la Terre'),
+            (u'Hydrography', u'Hydrographie'), (u'Mines + Minerals', u'Mines + Minéraux')]
+LEVELS = [(u'Earth Sciences', u'Sciences de la Terre'), (u'Geology', u'Géologie'), (u'Bedrock', u'Socle'),
+          (u'Surficial Geology', u'Géologie des dépôts meubles'), (u'Geophysics', u'Géophysique'),
+          (u'Gravity', u'Gravité'), (u'Magnetism', u'Magnétisme'), (u'Geochemistry (Till)', u'Géochimie (till)'),
+          (u'Lakes/Rivers', u'Lacs/Rivières'), (u'Glaciers [Ice]', u'Glaciers [glace]'),
+          (u'Topographic maps', u'Cartes topographiques'), (u'Permafrost', u'Pergélisol')]
+PLACES = [u'Canada', u'Ontario', u'Quebec', u'British Columbia', u'Alberta', u'Nunavut', u'Yukon',
+          u'Northwest Territories', u'Nova Scotia', u'Somewhere Else']
+GEOGRATIS_TOPICS = [u'geoscientificInformation', u'inlandWaters', u'imageryBaseMapsEarthCover', u'elevation',
+                    u'farming; agriculture', u'society; société', u'climatologyMeteorologyAtmosphere',
+                    u'planningCadastre', u'oceans', u'environment']
+EC_TOPICS = [u'climatologyMeteorologyAtmosphere', u'inlandWaters', u'environment', u'biota', u'oceans',
+             u'geoscientificInformation', u'utilitiesCommunication']
+FILE_TYPES = [(u'ESRI Shapefile', u'zip'), (u'Adobe PDF', u'pdf'), (u'GeoTIFF', u'tif'), (u'CSV', u'csv'),
+              (u'KML', u'kmz'), (u'gzip (GNU zip)', u'gz'), (u'GML (Geography Markup Language)', u'gml'),
+              (u'Unknown Format', u'dat')]
+FREQUENCIES = ['asNeeded', 'continual', 'daily', 'monthly', 'annually', 'irregular', 'notPlanned']
+
+
+def _footprint(rnd):
+    """A closed ring around a point of Canada; most are boxes, a few are detailed outlines"""
+    lon = rnd.uniform(-140.0, -55.0)
+    lat = rnd.uniform(42.0, 78.0)
+    radius = rnd.uniform(0.1, 5.0)
+    vertices = rnd.choice([4, 4, 4, 4, 16, 64, 250, 1000, 3000])
+    ring = []
+    for i in xrange(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * rnd.uniform(0.8, 1.0)
+        ring.append([round(lon + r * math.cos(angle), 6), round(lat + r * math.sin(angle), 6)])
+    ring.append(list(ring[0]))
+    return {'type': 'Polygon', 'coordinates': [ring]}
+
+
+def geogratis_pair(rnd, index):
+    """Return the English and French Geogratis records of one dataset"""
+    record_id = str(uuid_module.UUID(int=rnd.getrandbits(128)))
+    subjects = rnd.sample(SUBJECTS, rnd.randint(1, 3))
+    keywords = []
+    for i in xrange(rnd.randint(3, 15)):
+        keywords.append(rnd.sample(LEVELS, rnd.randint(1, 4)))
+    # Every record also has a keyword of its own
+    keywords.append([(u'Project {0} (phase {1})'.format(index, index % 7),
+                      u'Projet {0} (phase {1})'.format(index, index % 7))])
+    places = rnd.sample(PLACES, rnd.randint(0, 3))
+    topics = rnd.sample(GEOGRATIS_TOPICS, rnd.randint(1, 3))
+    files = []
+    for i in xrange(rnd.randint(1, 6)):
+        file_type, extension = rnd.choice(FILE_TYPES)
+        files.append((file_type, extension, u'{0:.1f} {1}'.format(rnd.uniform(1, 999), rnd.choice(['KB', 'MB', 'GB']))))
+    geometry = _footprint(rnd)
+    published = u'{0}-{1:02d}-{2:02d}'.format(rnd.randint(1990, 2015), rnd.randint(1, 12), rnd.randint(1, 28))
+
+    def record(lang):
+        fr = lang == 'fr'
+        return {
+            'id': record_id,
+            'title': u'{0} {1}'.format(u'Carte géologique' if fr else u'Geological map', index),
+            'summary': (u'Résumé du jeu de données {0}. ' if fr else u'Summary of dataset {0}. ').format(index) * 20,
+            'deleted': 'false',
+            'publishedDate': published,
+            'updatedDate': published,
+            'editedDate': published,
+            'citation': {'series': u'Série {0}'.format(index % 50) if fr else u'Series {0}'.format(index % 50),
+                         'seriesIssue': str(index % 12), 'presentationForm': 'mapDigital; documentDigital'},
+            'categories': [{'type': 'urn:gc:subject', 'terms': [{'label': s[fr]} for s in subjects]},
+                           {'type': 'urn:iso:place', 'terms': [{'label': p} for p in places]}],
+            'keywords': [u' > '.join(level[fr] for level in k) for k in keywords],
+            'geometry': geometry,
+            'topicCategories': topics,
+            'browseImages': [{'link': 'http://geogratis.gc.ca/images/{0}.png'.format(record_id)}],
+            'files': [{'description': u'{0} {1} {2}'.format(u'Données' if fr else u'Data', i, file_type),
+                       'link': u'http://ftp.geogratis.gc.ca/{0}/{1}_{2}.{3}'.format(record_id, lang, i, extension),
+                       'size': size, 'type': file_type}
+                      for i, (file_type, extension, size) in enumerate(files)],
+        }
+    return record('en'), record('fr')
+
+
+NAP_TEMPLATE = u'''<?xml version="1.0" encoding="UTF-8"?>
+<gmd:MD_Metadata xmlns:gmd="http://www.isotc211.org/2005/gmd" xmlns:gco="http://www.isotc211.org/2005/gco" xmlns:gml="http://www.opengis.net/gml" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <gmd:fileIdentifier><gco:CharacterString>{id}</gco:CharacterString></gmd:fileIdentifier>
+  <gmd:identificationInfo>
+    <gmd:MD_DataIdentification>
+      <gmd:citation>
+        <gmd:CI_Citation>
+          <gmd:title>
+            <gco:CharacterString>{title}</gco:CharacterString>
+            <gmd:PT_FreeText><gmd:textGroup><gmd:LocalisedCharacterString locale="#fra">{title_fra}</gmd:LocalisedCharacterString></gmd:textGroup></gmd:PT_FreeText>
+          </gmd:title>
+          <gmd:date><gmd:CI_Date><gmd:date><gco:Date>{published}</gco:Date></gmd:date></gmd:CI_Date></gmd:date>
+        </gmd:CI_Citation>
+      </gmd:citation>
+      <gmd:abstract>
+        <gco:CharacterString>{abstract}</gco:CharacterString>
+        <gmd:PT_FreeText><gmd:textGroup><gmd:LocalisedCharacterString locale="#fra">{abstract_fra}</gmd:LocalisedCharacterString></gmd:textGroup></gmd:PT_FreeText>
+      </gmd:abstract>
+      <gmd:supplementalInformation>
+        <gco:CharacterString>Home page: http://www.ec.gc.ca/data/{id} Service: http://geo.ec.gc.ca/wms/{id}?service=WMS</gco:CharacterString>
+        <gmd:PT_FreeText><gmd:textGroup><gmd:LocalisedCharacterString locale="#fra">Page : http://www.ec.gc.ca/donnees/{id} Service : http://geo.ec.gc.ca/wms/{id}?service=WMS</gmd:LocalisedCharacterString></gmd:textGroup></gmd:PT_FreeText>
+      </gmd:supplementalInformation>
+      <gmd:resourceMaintenance><gmd:MD_MaintenanceInformation><gmd:maintenanceAndUpdateFrequency><gmd:MD_MaintenanceFrequencyCode codeListValue="{frequency}"/></gmd:maintenanceAndUpdateFrequency></gmd:MD_MaintenanceInformation></gmd:resourceMaintenance>
+      <gmd:graphicOverview><gmd:MD_BrowseGraphic><gmd:fileName><gco:CharacterString>http://www.ec.gc.ca/images/{id}.png</gco:CharacterString></gmd:fileName></gmd:MD_BrowseGraphic></gmd:graphicOverview>
+      <gmd:descriptiveKeywords>
+        <gmd:MD_Keywords>
+          <gmd:keyword>
+            <gco:CharacterString>{keywords}</gco:CharacterString>
+            <gmd:PT_FreeText><gmd:textGroup><gmd:LocalisedCharacterString locale="#fra">{keywords_fra}</gmd:LocalisedCharacterString></gmd:textGroup></gmd:PT_FreeText>
+          </gmd:keyword>
+        </gmd:MD_Keywords>
+      </gmd:descriptiveKeywords>
+{topics}
+      <gmd:extent>
+        <gmd:EX_Extent>
+          <gmd:geographicElement>
+            <gmd:EX_GeographicBoundingBox>
+              <gmd:westBoundLongitude><gco:Decimal>{west}</gco:Decimal></gmd:westBoundLongitude>
+              <gmd:eastBoundLongitude><gco:Decimal>{east}</gco:Decimal></gmd:eastBoundLongitude>
+              <gmd:southBoundLatitude><gco:Decimal>{south}</gco:Decimal></gmd:southBoundLatitude>
+              <gmd:northBoundLatitude><gco:Decimal>{north}</gco:Decimal></gmd:northBoundLatitude>
+            </gmd:EX_GeographicBoundingBox>
+          </gmd:geographicElement>
+          <gmd:temporalElement>
+            <gmd:EX_TemporalExtent>
+              <gmd:extent><gml:TimePeriod><gml:beginPosition>{begin}</gml:beginPosition><gml:endPosition>{end}</gml:endPosition></gml:TimePeriod></gmd:extent>
+            </gmd:EX_TemporalExtent>
+          </gmd:temporalElement>
+        </gmd:EX_Extent>
+      </gmd:extent>
+    </gmd:MD_DataIdentification>
+  </gmd:identificationInfo>
+  <gmd:distributionInfo>
+    <gmd:MD_Distribution>
+      <gmd:transferOptions>
+        <gmd:MD_DigitalTransferOptions>
+{resources}
+        </gmd:MD_DigitalTransferOptions>
+      </gmd:transferOptions>
+    </gmd:MD_Distribution>
+  </gmd:distributionInfo>
+</gmd:MD_Metadata>'''
+
+NAP_TOPIC = u'      <gmd:topicCategory><gmd:MD_TopicCategoryCode>{0}</gmd:MD_TopicCategoryCode></gmd:topicCategory>'
+
+NAP_RESOURCE = u'''          <gmd:onLine xlink:role="{role}">
+            <gmd:CI_OnlineResource>
+              <gmd:linkage><gmd:URL>{url}</gmd:URL></gmd:linkage>
+              <gmd:name><gco:CharacterString>{name}</gco:CharacterString></gmd:name>
+            </gmd:CI_OnlineResource>
+          </gmd:onLine>'''
+
+
+def nap_document(rnd, index):
+    """Return the id and NAP XML document of one EC dataset"""
+    record_id = str(uuid_module.UUID(int=rnd.getrandbits(128)))
+    west = rnd.uniform(-140.0, -60.0)
+    south = rnd.uniform(42.0, 75.0)
+    begin = rnd.randint(1950, 2010)
+    keywords = [k for k in rnd.sample(LEVELS, rnd.randint(2, 8))]
+    resources = []
+    for i in xrange(rnd.randint(1, 6)):
+        name, extension = rnd.choice([(u'Data (CSV)', u'csv'), (u'Web page', u'html'), (u'Map service', u'wms'),
+                                      (u'Dataset', u'zip'), (u'Données', u'xml'), (u'Report', u'pdf')])
+        role = rnd.choice(['urn:xml:lang:eng-CAN', 'urn:xml:lang:fra-CAN'])
+        resources.append(NAP_RESOURCE.format(
+            role=role, name=escape(name),
+            url=escape(u'http://data.ec.gc.ca/{0}/{1}.{2}'.format(record_id, i, extension))))
+    document = NAP_TEMPLATE.format(
+        id=record_id,
+        title=escape(u'Monitoring network {0}'.format(index)),
+        title_fra=escape(u'Réseau de surveillance {0}'.format(index)),
+        published=u'{0}-{1:02d}-{2:02d}'.format(rnd.randint(1990, 2015), rnd.randint(1, 12), rnd.randint(1, 28)),
+        abstract=escape(u'Observations of station network {0}. '.format(index) * 20),
+        abstract_fra=escape(u'Observations du réseau de stations {0}. '.format(index) * 20),
+        frequency=rnd.choice(FREQUENCIES),
+        keywords=escape(u','.join(k[0] for k in keywords)),
+        keywords_fra=escape(u','.join(k[1] for k in keywords)),
+        topics=u'\n'.join(NAP_TOPIC.format(t) for t in rnd.sample(EC_TOPICS, rnd.randint(1, 3))),
+        west=round(west, 4), east=round(west + rnd.uniform(0.5, 20), 4),
+        south=round(south, 4), north=round(south + rnd.uniform(0.5, 10), 4),
+        begin=begin, end=rnd.choice([str(begin + rnd.randint(1, 10)), u'ongoing']),
+        resources=u'\n'.join(resources))
+    return record_id, document.encode('utf-8')
+
+
+def geogratis_corpus(count, seed=42):
+    rnd = random.Random(seed)
+    return [geogratis_pair(rnd, i) for i in xrange(count)]
+
+
+def nap_corpus(count, seed=42):
+    # Not the seed of the Geogratis corpus, which would give the same dataset ids to both sources
+    rnd = random.Random(seed + 1)
+    return [nap_document(rnd, i) for i in xrange(count)]
+
+
+def corpus_file(directory, source, count):
+    return os.path.join(directory, '{0}-{1}.jsonl'.format(source, count))
+
+
+def write_corpus(directory, count, seed=42):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(corpus_file(directory, 'gr', count), 'w') as out:
+        for en, fr in geogratis_corpus(count, seed):
+            out.write(json.dumps({'en': en, 'fr': fr}) + '\n')
+    with open(corpus_file(directory, 'ec', count), 'w') as out:
+        for record_id, xml in nap_corpus(count, seed):
+            out.write(json.dumps({'uuid': record_id, 'xml': xml.decode('utf-8')}) + '\n')
+
+
+def read_corpus(directory, source, count):
+    """Read a corpus written by write_corpus(): (en, fr) pairs for 'gr', (uuid, xml) for 'ec'"""
+    corpus = []
+    with open(corpus_file(directory, source, count)) as lines:
+        for line in lines:
+            record = json.loads(line)
+            if source == 'gr':
+                corpus.append((record['en'], record['fr']))
+            else:
+                corpus.append((record['uuid'], record['xml'].encode('utf-8')))
+    return corpus
+
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    for size in [int(s) for s in args.sizes.split(',')]:
+        write_corpus(args.output, size, args.seed)
+        print 'Wrote {0} records of each source to {1}'.format(size, args.output)
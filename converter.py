@@ -2,16 +2,20 @@ __author__ = 'Statistics Canada'
 __license__ = 'MIT'
 
 from datetime import datetime
-from db_schema import connect_to_database, find_all_records, add_record, Packages, find_record_by_uuid, \
-                      Settings, get_setting, save_setting, GeogratisRecord, ECRecord
-from ec_dataset_factory import MetadataDatasetModelECFactory
-from geogratis_dataset_factory import MetadataDatasetModelGeogratisFactory
-from ConfigParser import ConfigParser
+from db_schema import connect_to_database, close_session, find_all_records, upsert_unique_records, Packages, \
+                      advance_setting, get_setting
+from harvest_logging import ProgressReporter, add_logging_arguments, setup_logging
+from harvest_sources import get_source
+from harvester_config import add_config_argument, get_config, load_config
+from metadata_schema import schema_description
+from metrics import get_metrics
+from profiling import add_profile_arguments, profiled
+from spatial_index import save_extents, spatial_bounds
 import argparse
+import hashlib
 import json
 import logging
 import time
-import traceback
 
 
 argparser = argparse.ArgumentParser(
@@ -23,24 +27,117 @@ argparser.add_argument('-m', '--monitor', action='store_true', dest='monitoring'
                        help='Only convert Geogratis records scanned since the last run of the converter')
 argparser.add_argument('-t', '--type', action='store', dest='scan_type', default='gr',
                        help='Type of harvest data to convert: e.g. ec or gr')
+argparser.add_argument('-f', '--force', action='store_true', default=False, dest='force',
+                       help='Convert every record again, even if it has not changed since it was last converted')
+add_config_argument(argparser)
+add_logging_arguments(argparser)
+add_profile_arguments(argparser)
 
-def main(since, scan_type):
+
+def conversion_key(factory, scan_record):
+    """Identify the output of a conversion by what it depends on: the harvested record, the factory version
+    and settings, the Open Data schema, the region outlines and the resource format aliases"""
+    h = hashlib.sha1()
+    h.update('{0}:{1}:{2}:{3}:{4}:{5}'.format(factory.__class__.__name__, factory.version, schema_description.digest,
+                                              factory.geometry.key, factory.regions.digest, factory.formats.digest))
+    for payload in factory.record_payload(scan_record):
+        if payload is None:
+            payload = ''
+        elif isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+        h.update('\0{0}:'.format(len(payload)))
+        h.update(payload)
+    return h.hexdigest()
+
+
+def _saved_packages(session, uuids):
+    """Return {uuid: (conversion_key, ckan_json)} of the package updates already saved for a batch of datasets"""
+    rows = session.query(Packages.uuid, Packages.conversion_key, Packages.ckan_json).\
+        filter(Packages.uuid.in_(uuids)).all()
+    return dict((uuid, (key, ckan_json)) for uuid, key, ckan_json in rows)
+
+
+def convert_records(session, factory, scan_records, scan_type, force=False):
+    """Convert a batch of harvested records and save their package updates. Returns the ckan_json of the package
+    update of every active record that converted, in the order of the records.
+
+    A record is only converted again if it, the factory version or the schema have changed since its package
+    update was saved, unless `force` is set. Otherwise the saved package update is returned as is.
+
+    The saved package updates are read with one query, and the batch is written with one multi-row upsert
+    on the unique uuid of package_updates, so there is only ever one package update per dataset, even with
+    several converters running at once.
+
+    """
+    metrics = get_metrics()
+    with metrics.span('db_read', source=scan_type, stage='convert'):
+        saved = _saved_packages(session, [scan_record.uuid for scan_record in scan_records])
+
+    current_time_str = time.strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    extents = {}
+    # (ckan_json, True if it still has to be written) of each package update, in the order of the records
+    packages = []
+    for scan_record in scan_records:
+        try:
+            if scan_record.state != 'active':
+                # Inactive datasets are left out of region queries
+                extents[scan_record.uuid] = None
+                metrics.increment('records_total', source=scan_type, stage='convert', outcome='inactive')
+                continue
+            key = conversion_key(factory, scan_record)
+            saved_key, saved_json = saved.get(scan_record.uuid, (None, None))
+            if not force and saved_json and saved_key == key:
+                logging.debug('{0} is unchanged, not converting it again'.format(scan_record.uuid))
+                metrics.increment('records_total', source=scan_type, stage='convert', outcome='unchanged')
+                packages.append((saved_json, False))
+                continue
+
+            # Convert the entire harvested record to CKAN format
+            logging.debug('Converting %s (ID %s)', scan_record.uuid, scan_record.id)
+            with metrics.span('conversion', record_id=scan_record.uuid, source=scan_type):
+                geo_record = factory.create_model_from_record(scan_record)
+                if geo_record is None:
+                    metrics.increment('records_total', source=scan_type, stage='convert', outcome='invalid')
+                    continue
+
+                # Set the dataset for immediate release on the Registry
+                geo_record.portal_release_date = time.strftime("%Y-%m-%d")
+                geo_record.ready_to_publish = True
+
+                ckan_json = json.dumps(geo_record.as_dict())
+            metrics.increment('records_total', source=scan_type, stage='convert', outcome='converted')
+        except Exception:
+            logging.exception('{0} failed to convert'.format(scan_record.uuid))
+            metrics.increment('records_total', source=scan_type, stage='convert', outcome='failed')
+            continue
+
+        # The creation date is only written when the package update is first saved
+        rows.append({'uuid': scan_record.uuid, 'created': current_time_str, 'updated': current_time_str,
+                     'ckan_json': ckan_json, 'source': scan_type, 'conversion_key': key})
+        extents[scan_record.uuid] = spatial_bounds(geo_record.spatial)
+        packages.append((ckan_json, True))
+
+    try:
+        with metrics.span('db_write', source=scan_type, stage='convert'):
+            save_extents(session, scan_type, extents)
+            upsert_unique_records(session, Packages, rows, keep_columns=['created'])
+            session.commit()
+    except Exception:
+        session.rollback()
+        logging.exception('Failed to save a batch of {0} package updates'.format(len(rows)))
+        metrics.increment('records_total', value=len(rows), source=scan_type, stage='convert', outcome='failed')
+        return [ckan_json for ckan_json, written in packages if not written]
+    return [ckan_json for ckan_json, written in packages]
+
+
+def main(since, scan_type, monitoring=False, force=False):
 
     now_str = datetime.now().strftime('%Y-%m-%dT%H:%M:%S.000Z')
-    if scan_type == 'gr':
-        factory = MetadataDatasetModelGeogratisFactory()
-        setting = get_setting('last_conversion_gr')
-        query_class = GeogratisRecord
-        if setting is None:
-            setting = Settings()
-            setting.setting_name = 'last_conversion_gr'
-    else:
-        factory = MetadataDatasetModelECFactory()
-        setting = get_setting('last_conversion_ec')
-        query_class = ECRecord
-        if setting is None:
-            setting = Settings()
-            setting.setting_name = 'last_conversion_ec'
+    source = get_source(scan_type)
+    factory = source.create_factory()
+    query_class = source.record_class
+    setting = get_setting('last_conversion_' + scan_type)
 
     # Potentially doing a VERY large ORM query. If we don't limit the read, then SQLAlchemy will try to pull
     # everything into memory. Therefore the query must be paged. Paging requires keeping track of the sequential
@@ -52,65 +149,48 @@ def main(since, scan_type):
 
     if since != '':
         try:
-            scan_date = datetime.fromtimestamp(time.mktime(time.strptime(args.since, '%Y-%m-%d')))
+            scan_date = datetime.fromtimestamp(time.mktime(time.strptime(since, '%Y-%m-%d')))
         except ValueError:
             logging.error("Incorrect since date format. Use YYYY-MM-DD")
-            session.close()
+            close_session()
             exit()
         except Exception, e:
             logging.error(e.message)
-            session.close()
+            close_session()
             exit()
-    elif args.monitoring:
+    elif monitoring:
         if setting.setting_value is not None:
             scan_date = datetime.strptime(setting.setting_value, '%Y-%m-%dT%H:%M:%S.000Z')
 
-    setting.setting_value = now_str
-
+    metrics = get_metrics()
+    batch_size = get_config().getint('harvester', 'harvester.convert_batch_size', 100)
+    total_query = session.query(query_class)
+    if scan_date is not None:
+        total_query = total_query.filter(query_class.scanned > scan_date)
+    progress = ProgressReporter('{0} conversion'.format(scan_type), total=total_query.count())
     while True:
-        scan_records = find_all_records(session, query_limit=10, limit_id=last_id, cutoff=scan_date,
-                                        query_class=query_class)
+        with metrics.span('db_read', source=scan_type, stage='convert'):
+            scan_records = find_all_records(session, query_limit=batch_size, limit_id=last_id, cutoff=scan_date,
+                                            query_class=query_class)
 
         if len(scan_records) == 0:
             break
         else:
-            for scan_record in scan_records:
-                try:
-                    if scan_date and scan_record.scanned:
-                        if scan_record.geogratis_scanned < scan_date:
-                            last_id = scan_record.id
-                            continue
-                    print 'ID: {0}'.format(scan_record.id)
-                    # In order to avoid multiple updates, only allow for one instance of an update per uuid.
-                    # Previous updates are overridden with the latest update
-                    pkg_update_record = find_record_by_uuid(session, scan_record.uuid, query_class=Packages)
-                    if pkg_update_record is None:
-                        pkg_update_record = Packages()
-                    if scan_record.state == 'active':
-                        # Retrieve the entire Geogratis record in CKAN format and then populate the fields of
-                        # the Package Update record for the database.
-                        geo_record = factory.create_model(scan_record.uuid)
-                        pkg_update_record.uuid = scan_record.uuid
-
-                        if geo_record is not None:
-                            # Set the dataset for immediate release on the Registry
-                            geo_record.portal_release_date = time.strftime("%Y-%m-%d")
-                            geo_record.ready_to_publish = True
-
-                            pkg_update_record.ckan_json = json.dumps(geo_record.as_dict())
-
-                            current_time_str = time.strftime("%Y-%m-%d %H:%M:%S")
-                            if not pkg_update_record.created:
-                                pkg_update_record.created = current_time_str
-                            pkg_update_record.updated = current_time_str
-                            pkg_update_record.source = scan_type
-                            add_record(session, pkg_update_record)
-                except Exception, e:
-                    logging.error(e.message)
-                    traceback.print_exc()
-                last_id = scan_record.id
-    save_setting(setting)
-    session.close()
-
-args = argparser.parse_args()
-main(since=args.since, scan_type=args.scan_type)
\ No newline at end of file
+            last_id = scan_records[-1].id
+            if scan_date:
+                scan_records = [r for r in scan_records if not r.scanned or r.scanned >= scan_date]
+            convert_records(session, factory, scan_records, scan_type, force)
+            progress.advance(len(scan_records))
+            metrics.flush(force=False)
+    # Other converter runs may have finished in the meantime, so only move the watermark forward
+    advance_setting(setting.setting_name, now_str)
+    close_session()
+    progress.finish()
+    metrics.flush()
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    setup_logging(args)
+    with profiled(args):
+        main(since=args.since, scan_type=args.scan_type, monitoring=args.monitoring, force=args.force)
\ No newline at end of file
@@ -0,0 +1,199 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import http_cache
+import logging
+import requests
+import threading
+
+from collections import OrderedDict
+from harvester_config import get_config
+from lxml import etree
+from owslib.csw import CatalogueServiceWeb
+from owslib.fes import PropertyIsGreaterThanOrEqualTo
+from owslib.namespaces import Namespaces
+
+_ns = Namespaces()
+NAMESPACES = {
+    'csw': _ns.get_namespace('csw'),
+    'dc': _ns.get_namespace('dc'),
+    'gco': _ns.get_namespace('gco'),
+    'gmd': _ns.get_namespace('gmd'),
+}
+MD_METADATA = '{{{0}}}MD_Metadata'.format(NAMESPACES['gmd'])
+
+# GetRecords request used for a full scan. The filter is left empty: it returns every metadata record.
+ALL_RECORDS_REQUEST = '<csw:GetRecords xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" service="CSW" version="2.0.2" resultType="results" outputSchema="csw:IsoRecord" startPosition="{0}" maxRecords="{1}"><csw:Query typeNames="gmd:MD_Metadata"><csw:Constraint version="1.1.0"><Filter xmlns="http://www.opengis.net/ogc" xmlns:gml="http://www.opengis.net/gml"/></csw:Constraint></csw:Query></csw:GetRecords>'
+
+# GetRecords request for the records modified since a date
+MODIFIED_SINCE_REQUEST = '<csw:GetRecords xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" xmlns:ogc="http://www.opengis.net/ogc" service="CSW" version="2.0.2" resultType="results" outputSchema="http://www.opengis.net/cat/csw/2.0.2" startPosition="{0}" maxRecords="{1}"><csw:Query typeNames="gmd:MD_Metadata"><csw:ElementSetName>brief</csw:ElementSetName><csw:Constraint version="1.1.0"><ogc:Filter><ogc:PropertyIsGreaterThanOrEqualTo><ogc:PropertyName>Modified</ogc:PropertyName><ogc:Literal>{2}</ogc:Literal></ogc:PropertyIsGreaterThanOrEqualTo></ogc:Filter></csw:Constraint></csw:Query></csw:GetRecords>'
+
+
+class CswError(Exception):
+    pass
+
+
+class CswRecord:
+    """A record returned by the CSW server: its id, title and, for full records, the ISO 19115 XML"""
+
+    def __init__(self, identifier, title, xml=None):
+        self.identifier = identifier
+        self.title = title
+        self.xml = xml
+
+
+class CswClient:
+    """CSW 2.0.2 client for GetRecords paging and GetRecordById, built on requests and lxml.
+
+    The client is shared by the fetch threads of a scan. Each thread has its own HTTP session, and at most
+    `max_concurrency` requests are sent to the server at the same time, however many threads are fetching.
+
+    """
+
+    def __init__(self, url, username=None, password=None, timeout=20, max_concurrency=4, page_size=10):
+        self.url = url
+        self.auth = None
+        if username and password:
+            self.auth = (username, password)
+        self.timeout = timeout
+        self.page_size = page_size
+        self._requests = threading.BoundedSemaphore(max(max_concurrency, 1))
+        self._local = threading.local()
+
+    def _post(self, request_xml):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        with self._requests:
+            r = http_cache.post(self.url, data=request_xml, session=session, auth=self.auth,
+                                timeout=self.timeout, headers={'Content-Type': 'application/xml'})
+        if r.status_code != 200:
+            raise CswError('HTTP Error {0} from {1}'.format(r.status_code, self.url))
+        root = etree.fromstring(r.content)
+        if root.tag.endswith('ExceptionReport'):
+            raise CswError(' '.join(root.itertext()).strip())
+        return root
+
+    def get_records(self, start_position=0, since=None):
+        """Request one page of records, modified since the date `since` if given.
+
+        Returns the results (matches, returned and nextrecord, as in OWSLib) and an ordered dictionary of the
+        records of the page by id.
+
+        """
+        if since is not None:
+            request_xml = MODIFIED_SINCE_REQUEST.format(start_position, self.page_size, since.strftime('%Y-%m-%d'))
+        else:
+            request_xml = ALL_RECORDS_REQUEST.format(start_position, self.page_size)
+        root = self._post(request_xml)
+
+        search_results = root.find('csw:SearchResults', NAMESPACES)
+        if search_results is None:
+            raise CswError('No search results in the GetRecords response')
+        results = {
+            'matches': int(search_results.get('numberOfRecordsMatched', 0)),
+            'returned': int(search_results.get('numberOfRecordsReturned', 0)),
+            'nextrecord': int(search_results.get('nextRecord', 0)),
+        }
+        records = OrderedDict()
+        for element in search_results:
+            if element.tag == MD_METADATA:
+                record = _iso_record(element)
+            else:
+                record = CswRecord(element.findtext('dc:identifier', namespaces=NAMESPACES),
+                                   element.findtext('dc:title', namespaces=NAMESPACES))
+            if record.identifier:
+                records[record.identifier] = record
+        return results, records
+
+    def get_record(self, record_id):
+        """Retrieve the full ISO 19115 record, or None if the server does not have it"""
+        request_xml = etree.Element(etree.QName(NAMESPACES['csw'], 'GetRecordById'), nsmap={'csw': NAMESPACES['csw']},
+                                    service='CSW', version='2.0.2', outputSchema=NAMESPACES['gmd'])
+        etree.SubElement(request_xml, etree.QName(NAMESPACES['csw'], 'Id')).text = record_id
+        etree.SubElement(request_xml, etree.QName(NAMESPACES['csw'], 'ElementSetName')).text = 'full'
+        root = self._post(etree.tostring(request_xml))
+
+        for element in root.iter(MD_METADATA):
+            record = _iso_record(element)
+            if record.identifier == record_id:
+                return record
+        logging.warning('CSW record {0} not found'.format(record_id))
+        return None
+
+
+class OwslibCswClient:
+    """The same requests as CswClient, made one at a time through OWSLib's CatalogueServiceWeb"""
+
+    def __init__(self, url, username=None, password=None, timeout=20, page_size=10):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.page_size = page_size
+        self._local = threading.local()
+
+    @property
+    def csw(self):
+        # OWSLib keeps the results of the last request on the CatalogueServiceWeb object, so every
+        # thread gets its own connection
+        csw = getattr(self._local, 'csw', None)
+        if csw is None:
+            if self.username and self.password:
+                csw = CatalogueServiceWeb(self.url, username=self.username, password=self.password,
+                                          timeout=self.timeout)
+            else:
+                csw = CatalogueServiceWeb(self.url, timeout=self.timeout)
+            self._local.csw = csw
+        return csw
+
+    def get_records(self, start_position=0, since=None):
+        csw = self.csw
+        if since is not None:
+            since_query = PropertyIsGreaterThanOrEqualTo('Modified', since.strftime('%Y-%m-%d'))
+            csw.getrecords2(esn='brief', startposition=start_position, maxrecords=self.page_size,
+                            typenames='gmd:MD_Metadata', constraints=[since_query])
+        else:
+            csw.getrecords2(xml=ALL_RECORDS_REQUEST.format(start_position, self.page_size))
+        records = OrderedDict()
+        for record_id in csw.records:
+            records[record_id] = CswRecord(record_id, csw.records[record_id].title)
+        return csw.results, records
+
+    def get_record(self, record_id):
+        csw = self.csw
+        csw.getrecordbyid(id=[record_id], outputschema=NAMESPACES['gmd'])
+        if record_id not in csw.records:
+            logging.warning('CSW record {0} not found'.format(record_id))
+            return None
+        nap = csw.records[record_id]
+        return CswRecord(nap.identifier, nap.identification.title, nap.xml)
+
+
+def create_csw_client():
+    """Create the CSW client configured in the [csw] section of harvester.ini.
+
+    csw.client selects the client: requests (the default) or owslib.
+
+    """
+    config = get_config()
+    url = config.get('csw', 'csw.url')
+    username = config.get('csw', 'csw.username', '')
+    password = config.get('csw', 'csw.password', '')
+    timeout = config.getint('csw', 'csw.timeout', 20)
+    page_size = config.getint('csw', 'csw.page_size', 10)
+    client = config.get('csw', 'csw.client', 'requests')
+    if client == 'owslib':
+        return OwslibCswClient(url, username, password, timeout, page_size)
+    elif client == 'requests':
+        return CswClient(url, username, password, timeout,
+                         max_concurrency=config.getint('csw', 'csw.max_concurrency', 4), page_size=page_size)
+    raise ValueError('Unknown CSW client: {0}'.format(client))
+
+
+def _iso_record(md_metadata):
+    identifier = md_metadata.findtext('gmd:fileIdentifier/gco:CharacterString', namespaces=NAMESPACES)
+    title = md_metadata.findtext('gmd:identificationInfo/*/gmd:citation/gmd:CI_Citation/gmd:title/gco:CharacterString',
+                                 namespaces=NAMESPACES)
+    return CswRecord(identifier, title, etree.tostring(md_metadata))
@@ -1,136 +1,136 @@
 import argparse
 import dateutil.parser
 import logging
+import threading
 
-from ConfigParser import ConfigParser
-from db_schema import ECRecord, add_record, connect_to_database, find_record_by_uuid, get_setting, save_setting
-from owslib.csw import CatalogueServiceWeb
-from owslib.fes import PropertyIsGreaterThanOrEqualTo, FilterRequest
-from owslib.namespaces import Namespaces
-from colorama import init, Fore, Style
+from csw_client import create_csw_client
+from db_schema import ECRecord, advance_setting, find_record_by_uuid, get_setting
+from ec_dataset_factory import MetadataDatasetModelECFactory
+from harvest_logging import add_logging_arguments, setup_logging
+from harvest_sources import HarvestSource, register_source, run_scan
 from datetime import datetime
-
-# Init colorama
-init(autoreset=True)
+from harvester_config import add_config_argument, load_config
+from profiling import add_profile_arguments, profiled
 
 argparser = argparse.ArgumentParser(
     description="Scan Environment Canada's CSW server and save record(s) to the Open Data harvester database"
 )
 argparser.add_argument('-s', '--since', action='store', default='', dest='since',
                        help='Scan since date in ISO 8601 format (e.g. 2015-02-11T00:00:00)')
-argparser.add_argument('-l', '--log', action='store', default='', dest='log_filename', help='Log file')
 argparser.add_argument('-m', '--monitor', action='store_true', default=False, dest='monitor',
                        help='Use the last scan date which was saved the last time the scanner was run')
 argparser.add_argument('-a', '--all', action='store_true', default=False, dest='all')
+argparser.add_argument('-r', '--resume', action='store_true', default=False, dest='resume',
+                       help='Resume an interrupted scan from its last checkpoint')
+argparser.add_argument('-i', '--checkpoint-interval', action='store', type=int, default=None,
+                       dest='checkpoint_interval', help='Number of records between checkpoints (default: 100)')
+add_config_argument(argparser)
+add_logging_arguments(argparser)
+add_profile_arguments(argparser)
+
+
+@register_source
+class ECSource(HarvestSource):
+    """Harvest the NAP (ISO 19115) records of Environment Canada's CSW server"""
+
+    name = 'ec'
+    record_class = ECRecord
+
+    def __init__(self, since='', start_index='', monitor=False, scan_all=False, **options):
+        super(ECSource, self).__init__(since, start_index, monitor, scan_all, **options)
+        self._client = None
+        self._client_lock = threading.Lock()
+        # A full scan (scan_all) has no date and ignores the monitor and since options
+        self.scan_date = None
+        if monitor and not scan_all:
+            monitor_date = get_setting('csw_last_scan_date')
+            self.scan_date = datetime.now()
+            if monitor_date.setting_value is not None:
+                self.scan_date = dateutil.parser.parse(monitor_date.setting_value)
+        elif since != '' and not scan_all:
+            self.scan_date = dateutil.parser.parse(since)
+
+    @property
+    def client(self):
+        """The CSW client, created on first use so that the converter and the audit need no [csw] section"""
+        # A resumed scan fetches its pending records from the worker threads before listing any ids
+        with self._client_lock:
+            if self._client is None:
+                self._client = create_csw_client()
+        return self._client
+
+    def enumerate_ids(self, position=None):
+        start_pos = 0
+        if position is not None:
+            # The scan date of an interrupted scan is kept with its position
+            start_pos = position['nextrecord']
+            self.scan_date = None
+            if position['since'] is not None:
+                self.scan_date = dateutil.parser.parse(position['since'])
+        since = None
+        if self.scan_date is not None:
+            since = self.scan_date.isoformat()
+
+        while start_pos is not None:
+            results, records = self.client.get_records(start_pos, self.scan_date)
+            if results['returned'] == 0:
+                break
+            self.total = results['matches']
+            logging.debug('Found %s records, next record: %s', results['matches'], results['nextrecord'])
+            start_pos = results['nextrecord']
+            # A next record of 0 means the last page has been returned
+            if start_pos == 0:
+                start_pos = None
+
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                for rec in records:
+                    logging.debug(u'%s: %s', rec, records[rec].title)
+            next_position = None
+            if start_pos is not None:
+                next_position = {'nextrecord': start_pos, 'since': since}
+            yield next_position, list(records)
+
+    def fetch(self, napid):
+        logging.debug('Full NAP record for %s', napid)
+        return self.client.get_record(napid)
+
+    def save(self, session, napid, nap):
+        ec_rec = find_record_by_uuid(session, napid, query_class=ECRecord)
+
+        if ec_rec is None:
+            ec_rec = ECRecord(
+                uuid=nap.identifier,
+                title=nap.title,
+                state='active',
+                nap_record=nap.xml,
+                scanned=datetime.now().isoformat()
+            )
+        else:
+            ec_rec.title = nap.title
+            ec_rec.state = 'active'
+            ec_rec.nap_record = nap.xml
+            ec_rec.scanned = datetime.now().isoformat()
+        session.add(ec_rec)
+        return ec_rec
 
-args = argparser.parse_args()
-
-if args.log_filename != '':
-    logging.basicConfig(filename=args.log_filename, level=logging.WARNING,
-                        format='%(asctime)s %(levelname)s: %(message)s',
-                        datefmt='%m/%d/%Y %I:%M:%S %p')
-    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
-                        datefmt='%m/%d/%Y %I:%M:%S %p')
-
-
-class CswScanner:
-
-    def __init__(self):
-        self.napids = []
-        self.start_pos = 0
+    def create_factory(self):
+        return MetadataDatasetModelECFactory()
 
-        # Get the CSW URL, Username and Password
+    def finish(self, started):
+        advance_setting('csw_last_scan_date', started.isoformat())
 
-        ini_config = ConfigParser()
-        ini_config.read('harvester.ini')
-        csw_url = ini_config.get('csw', 'csw.url')
-        csw_user = ini_config.get('csw', 'csw.username')
-        csw_passwd = ini_config.get('csw', 'csw.password')
-        if csw_user and csw_passwd:
-            self.csw = CatalogueServiceWeb(csw_url, username=csw_user, password=csw_passwd, timeout=20)
-        else:
-            self.csw = CatalogueServiceWeb(csw_url, timeout=20)
 
+def main(since='', monitor=False, scan_all=False, resume=False, checkpoint_interval=None, record_sink=None):
+    """Scan the CSW server. Each saved ECRecord is also passed to record_sink, if one is given."""
+    source = ECSource(since=since, monitor=monitor, scan_all=scan_all)
+    run_scan(source, resume=resume, checkpoint_interval=checkpoint_interval, record_sink=record_sink)
 
-#### The since date is currently being ignored.
 
-    def get_all_ids(self, since=None):
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    setup_logging(args)
 
-        while True:
-            if since is not None:
-                scan_date = since.strftime('%Y-%m-%d')
-                since_query = PropertyIsGreaterThanOrEqualTo('Modified', scan_date)
-                self.csw.getrecords2(esn='brief', startposition=self.start_pos, typenames='gmd:MD_Metadata', constraints=[since_query])
-            else:
-                #self.csw.getrecords2(esn='brief', startposition=self.start_pos, typenames='gmd:MD_Metadata')
-                self.csw.getrecords2(xml='<csw:GetRecords xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" service="CSW" version="2.0.2" resultType="results" outputSchema="csw:IsoRecord"><csw:Query typeNames="gmd:MD_Metadata"><csw:Constraint version="1.1.0"><Filter xmlns="http://www.opengis.net/ogc" xmlns:gml="http://www.opengis.net/gml"/></csw:Constraint></csw:Query></csw:GetRecords>')
-            if self.csw.results['returned'] == 0:
-                break
-            print '{0}Found {1}{2}{3} records'.format(Fore.GREEN, Fore.BLUE, self.csw.results['matches'], Fore.GREEN)
-            print '{0}Next record: {1}{2}'.format(Fore.GREEN, Fore.BLUE, self.csw.results['nextrecord'])
-            self.start_pos = self.csw.results['nextrecord']
-
-            for rec in self.csw.records:
-                try:
-                    print u'{0}{1}{2}: {3}'.format(Fore.RED, rec, Fore.CYAN, self.csw.records[rec].title.decode('utf-8'))
-                except UnicodeEncodeError:
-                    print u'{0}Unprintable title for {1}{2}'.format(Fore.GREEN, Fore.RED, rec)
-                self.napids.append(rec)
-
-    def load_naps(self):
-
-        ns = Namespaces()
-        gmd = ns.get_namespace('gmd')
-        session = connect_to_database()
-
-        for napid in self.napids:
-
-            print '{0}Full NAP Record for {1}{2}'.format(Fore.GREEN, Fore.CYAN, napid)
-            self.csw.getrecordbyid(id=[napid], outputschema=gmd)
-
-            ec_rec = find_record_by_uuid(session, napid, query_class=ECRecord)
-
-            if ec_rec is None:
-                ec_rec = ECRecord(
-                    uuid=self.csw.records[napid].identifier,
-                    title=self.csw.records[napid].identification.title,
-                    state='active',
-                    nap_record=self.csw.records[napid].xml,
-                    csw_scanned=datetime.now().isoformat()
-                )
-            else:
-                ec_rec.title = self.csw.records[napid].identification.title,
-                ec_rec.state = 'active',
-                ec_rec.nap_record = self.csw.records[napid].xml,
-                ec_rec.csw_scanned = datetime.now().isoformat()
-
-            add_record(session, ec_rec)
-
-        session.close_all()
-
-# Temporary main
-
-eccsw = CswScanner()
-scan8601 = None
-scan_date = None
-
-if args.all:
-    scan_date = None
-elif args.monitor:
-    monitor_date = get_setting('csw_last_scan_date')
-    scan_date = datetime.now()
-    if monitor_date.setting_value is not None:
-        scan_date = dateutil.parser.parse(monitor_date.setting_value)
-elif args.since != '':
-    scan_date = dateutil.parser.parse(args.since)
-    if scan_date is None:
-        logging.error('Invalid date: ' + args.since)
-        exit()
-
-eccsw.get_all_ids(scan_date)
-eccsw.load_naps()
-
-monitor_date = get_setting('csw_last_scan_date')
-scan_date = datetime.now()
-monitor_date.setting_value = scan_date.isoformat()
-save_setting(monitor_date)
+    with profiled(args):
+        main(since=args.since, monitor=args.monitor, scan_all=args.all, resume=args.resume,
+             checkpoint_interval=args.checkpoint_interval)
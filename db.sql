@@ -16,6 +16,8 @@ CREATE TABLE geogratis_records (
     od_status TEXT
 );
 
+CREATE INDEX geogratis_records_uuid_idx ON geogratis_records (uuid);
+
 -- Scanned EC ISO 19115 records
 
 CREATE TABLE ec_records (
@@ -27,6 +29,8 @@ CREATE TABLE ec_records (
     scanned TIMESTAMP WITHOUT TIME ZONE
 );
 
+CREATE INDEX ec_records_uuid_idx ON ec_records (uuid);
+
 -- CKAN JSONL records
 
 CREATE TABLE package_updates (
@@ -36,9 +40,40 @@ CREATE TABLE package_updates (
     updated TIMESTAMP WITHOUT TIME ZONE,
     ckan_json TEXT,
     message TEXT DEFAULT '',
-    source TEXT
+    source TEXT,
+    conversion_key TEXT
+);
+
+CREATE UNIQUE INDEX package_updates_uuid_idx ON package_updates (uuid);
+CREATE INDEX package_updates_source_updated_idx ON package_updates (source, updated);
+
+-- Upgrading an existing database: add the conversion cache key
+--
+--  ALTER TABLE package_updates ADD COLUMN conversion_key TEXT;
+
+-- Upgrading an existing database: keep the latest package update of each dataset before making the uuid
+-- index unique. The converter's upsert needs the unique index, also in an existing SQLite database.
+--
+--  DELETE FROM package_updates WHERE id NOT IN (SELECT MAX(id) FROM package_updates GROUP BY uuid);
+--  DROP INDEX IF EXISTS package_updates_uuid_idx;
+--  CREATE UNIQUE INDEX package_updates_uuid_idx ON package_updates (uuid);
+
+-- Bounding boxes of the active datasets, for region queries
+
+CREATE TABLE dataset_extents (
+    id serial PRIMARY KEY NOT NULL,
+    uuid TEXT NOT NULL,
+    source TEXT,
+    west DOUBLE PRECISION NOT NULL,
+    south DOUBLE PRECISION NOT NULL,
+    east DOUBLE PRECISION NOT NULL,
+    north DOUBLE PRECISION NOT NULL,
+    updated TIMESTAMP WITHOUT TIME ZONE
 );
 
+CREATE UNIQUE INDEX dataset_extents_uuid_idx ON dataset_extents (uuid);
+CREATE INDEX dataset_extents_bounds_idx ON dataset_extents (west, east, south, north);
+
 -- Application settings and run-time information
 
     CREATE TABLE settings (
@@ -47,5 +82,13 @@ CREATE TABLE package_updates (
         setting_value TEXT DEFAULT ''
     );
 
+    CREATE UNIQUE INDEX settings_setting_name_idx ON settings (setting_name);
+
+-- Upgrading an existing database: remove duplicate settings before adding the unique index
+--
+--  DELETE FROM settings s USING settings d WHERE s.setting_name = d.setting_name AND s.id < d.id;
+--  DROP INDEX IF EXISTS settings_setting_name_idx;
+--  CREATE UNIQUE INDEX settings_setting_name_idx ON settings (setting_name);
+
 
 
@@ -1,38 +1,74 @@
 __author__ = 'thomros'
 
+import dateutil.parser
 import logging
-from ConfigParser import ConfigParser
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from harvester_config import get_config
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
-from sqlalchemy import Column
-from sqlalchemy import UnicodeText, Date, Integer
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy import Column, Index
+from sqlalchemy import UnicodeText, DateTime, Float, Integer
+from sqlalchemy import or_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 
-# SQLalchemy MetaData object for the Geogratis tracking database.
+# SQLalchemy MetaData object for the Geogratis tracking database. Db_Session is a registry holding one
+# session per thread; it is rebuilt, along with the engine and its pool, in a forked worker process.
 Db_Session = None
+Db_Engine = None
+_engine_pid = None
 g_base = declarative_base()
 
+# In-process cache of setting values by name. A missing entry means the value has not been read yet.
+_settings_cache = {}
+_settings_lock = threading.Lock()
+
+
+class Timestamp(TypeDecorator):
+    """TIMESTAMP column that also accepts the ISO 8601 strings used throughout the harvester.
+
+    PostgreSQL casts these strings itself, but the SQLite driver only accepts datetime objects. The stored
+    times are naive, so a zone in the string, e.g. the Z of the last_conversion_* watermarks, is ignored as
+    PostgreSQL does: a timezone-aware bind would be shifted by the UTC offset of the server.
+
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, basestring):
+            value = dateutil.parser.parse(value, ignoretz=True)
+        return value
+
+
 class GeogratisRecord(g_base):
     __tablename__ = 'geogratis_records'
     id = Column(Integer, primary_key=True, nullable=False)
     uuid = Column(UnicodeText)
     title_en = Column(UnicodeText)
     title_fr = Column(UnicodeText)
-    created = Column(Date)
-    updated = Column(Date)
-    edited = Column(Date)
+    created = Column(Timestamp)
+    updated = Column(Timestamp)
+    edited = Column(Timestamp)
     state = Column(UnicodeText)
     json_record_en = Column(UnicodeText)
     json_record_fr = Column(UnicodeText)
     od_status = Column(UnicodeText)
-    scanned = Column(Date, nullable=True)
+    scanned = Column(Timestamp, nullable=True)
 
 
     def __repr__(self):
         return "<GeogratisRecord(id='%s'), title_en='%s', edited='%s'>" % (
             self.id, self.title_en, self.edited)
 
+Index('geogratis_records_uuid_idx', GeogratisRecord.uuid)
+
 
 class ECRecord(g_base):
     __tablename__ = 'ec_records'
@@ -41,18 +77,40 @@ class ECRecord(g_base):
     title = Column(UnicodeText)
     state = Column(UnicodeText)
     nap_record = Column(UnicodeText)
-    scanned = Column(Date, nullable=True)
+    scanned = Column(Timestamp, nullable=True)
+
+Index('ec_records_uuid_idx', ECRecord.uuid)
 
 
 class Packages(g_base):
     __tablename__ = 'package_updates'
     id = Column(Integer, primary_key=True, nullable=False)
     uuid = Column(UnicodeText)
-    created = Column(Date, nullable=True)
-    updated = Column(Date, nullable=True)
+    created = Column(Timestamp, nullable=True)
+    updated = Column(Timestamp, nullable=True)
     ckan_json = Column(UnicodeText, nullable=True)
     message = Column(UnicodeText, nullable=True)
     source = Column(UnicodeText, nullable=True)
+    # Hash of the harvested record, factory version and schema that ckan_json was converted from
+    conversion_key = Column(UnicodeText, nullable=True)
+
+Index('package_updates_uuid_idx', Packages.uuid, unique=True)
+Index('package_updates_source_updated_idx', Packages.source, Packages.updated)
+
+class DatasetExtent(g_base):
+    """Bounding box of the spatial footprint of an active dataset, for region queries"""
+    __tablename__ = 'dataset_extents'
+    id = Column(Integer, primary_key=True, nullable=False)
+    uuid = Column(UnicodeText, nullable=False)
+    source = Column(UnicodeText, nullable=True)
+    west = Column(Float, nullable=False)
+    south = Column(Float, nullable=False)
+    east = Column(Float, nullable=False)
+    north = Column(Float, nullable=False)
+    updated = Column(Timestamp, nullable=True)
+
+Index('dataset_extents_uuid_idx', DatasetExtent.uuid, unique=True)
+Index('dataset_extents_bounds_idx', DatasetExtent.west, DatasetExtent.east, DatasetExtent.south, DatasetExtent.north)
 
 class Settings(g_base):
     __tablename__ = 'settings'
@@ -60,23 +118,136 @@ class Settings(g_base):
     setting_name = Column(UnicodeText, nullable=False)
     setting_value = Column(UnicodeText, nullable=True)
 
-def connect_to_database():
+Index('settings_setting_name_idx', Settings.setting_name, unique=True)
+
+# Pragmas applied to every connection of the embedded SQLite backend. WAL lets the scanners write while the
+# converter or dump read, and synchronous=NORMAL is durable enough for a database that can always be re-harvested.
+SQLITE_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', '-65536'),
+    ('mmap_size', '268435456'),
+    ('busy_timeout', '30000'),
+]
+
 
-    global Db_Session
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA {0}={1}'.format(pragma, value))
+    cursor.close()
 
-    ini_config = ConfigParser()
-    ini_config.read('harvester.ini')
-    db_url = ini_config.get('sqlalchemy', 'sqlalchemy.url')
-    if Db_Session is None:
-        engine = create_engine(db_url, echo=False)
-        Db_Session = sessionmaker(bind=engine)
+
+def create_database_engine(db_url):
+    """Create the engine for a database URL.
+
+    PostgreSQL databases are created manually from db.sql. The connection pool is configured from the
+    [sqlalchemy] section of harvester.ini: sqlalchemy.pool_size, sqlalchemy.max_overflow,
+    sqlalchemy.pool_recycle (seconds), sqlalchemy.pool_pre_ping, sqlalchemy.statement_timeout (milliseconds)
+    and sqlalchemy.executemany_page_size (rows sent per round trip by bulk writes).
+
+    An embedded SQLite database (e.g. sqlite:///harvester.db) is tuned on connect and has its tables
+    and indexes created on first use.
+
+    """
+    config = get_config()
+    url = make_url(db_url)
+    if url.get_backend_name() == 'sqlite':
+        engine = create_engine(url, echo=False)
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+        g_base.metadata.create_all(engine)
+        return engine
+
+    engine_args = {
+        'pool_size': config.getint('sqlalchemy', 'sqlalchemy.pool_size', 5),
+        'max_overflow': config.getint('sqlalchemy', 'sqlalchemy.max_overflow', 10),
+        'pool_recycle': config.getint('sqlalchemy', 'sqlalchemy.pool_recycle', 3600),
+        'pool_pre_ping': config.getboolean('sqlalchemy', 'sqlalchemy.pool_pre_ping', True),
+    }
+    statement_timeout = config.getint('sqlalchemy', 'sqlalchemy.statement_timeout', 0)
+    if url.get_driver_name() == 'psycopg2':
+        page_size = config.getint('sqlalchemy', 'sqlalchemy.executemany_page_size', 1000)
+        engine_args['executemany_mode'] = 'values_plus_batch'
+        engine_args['executemany_values_page_size'] = page_size
+        engine_args['executemany_batch_page_size'] = page_size
+        if statement_timeout > 0:
+            engine_args['connect_args'] = {'options': '-c statement_timeout={0}'.format(statement_timeout)}
+    return create_engine(url, echo=False, **engine_args)
+
+
+def get_engine():
+    """Return the engine of the current process, creating it and the session registry on first use"""
+
+    global Db_Session, Db_Engine, _engine_pid
+
+    if Db_Engine is None or _engine_pid != os.getpid():
+        # Pooled connections inherited from a parent process must not be reused, so a forked worker gets
+        # its own engine. The parent's engine is left alone since its connections are still in use there.
+        db_url = get_config().get('sqlalchemy', 'sqlalchemy.url')
+        Db_Engine = create_database_engine(db_url)
+        Db_Session = scoped_session(sessionmaker(bind=Db_Engine, expire_on_commit=False))
+        _engine_pid = os.getpid()
+    return Db_Engine
+
+
+def connect_to_database():
+    """Return the session of the current thread. Release it with close_session() when the thread is done."""
+    get_engine()
     return Db_Session()
 
 
-def add_record(session, new_record):
+def close_session():
+    """Close the session of the current thread and return its connection to the pool"""
+    if Db_Session is not None and _engine_pid == os.getpid():
+        Db_Session.remove()
 
-    session.add(new_record)
-    session.commit()
+
+@contextmanager
+def session_scope():
+    """Unit of work on a new session: committed on success, rolled back on error and always closed.
+
+    Usage::
+
+        with session_scope() as session:
+            session.add(record)
+
+    """
+    get_engine()
+    session = Db_Session.session_factory()
+    try:
+        yield session
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def upsert_unique_records(session, query_class, rows, key='uuid', keep_columns=()):
+    """Insert or update a batch of rows (dicts with the same columns) with INSERT ... ON CONFLICT statements.
+
+    The key column must have a unique index, so rows are never duplicated when several processes write the
+    same keys at once. The columns in keep_columns, e.g. a creation date, are only written when a row is
+    inserted. When a key appears more than once in the batch, its last row is written. Does not commit.
+
+    """
+    if len(rows) == 0:
+        return
+    rows = OrderedDict((row[key], row) for row in rows).values()
+    table = query_class.__table__
+    columns = rows[0].keys()
+    # SQLite builds before 3.32 accept at most 999 bound parameters in a statement
+    max_parameters = 65535 if get_engine().dialect.name == 'postgresql' else 999
+    chunk_size = max(1, max_parameters // len(columns))
+    for start in xrange(0, len(rows), chunk_size):
+        statement = _dialect_insert(table).values(rows[start:start + chunk_size])
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c[key]],
+            set_=dict((column, statement.excluded[column]) for column in columns
+                      if column != key and column not in keep_columns))
+        session.execute(statement)
 
 
 def find_record_by_uuid(session, uuid, query_class=GeogratisRecord):
@@ -106,39 +277,122 @@ def find_all_records(session, query_class=GeogratisRecord, query_limit=1000, lim
             records = session.query(query_class).filter(query_class.id > limit_id).\
                 order_by(query_class.id).limit(query_limit).all()
         else:
-            records = session.query(query_class).filter(query_class.id > limit_id, query_class.geogratis_scanned > cutoff).\
+            records = session.query(query_class).filter(query_class.id > limit_id, query_class.scanned > cutoff).\
                 order_by(query_class.id).limit(query_limit).all()
     except Exception, e:
         logging.error(e.message)
     return records
 
 
-def get_setting(key_name):
-    session = None
-    setting = None
+def _dialect_insert(table):
+    """Return an INSERT for the current backend that supports ON CONFLICT clauses"""
+    if get_engine().dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def _cache_setting(key_name, value):
+    with _settings_lock:
+        _settings_cache[key_name] = value
+
+
+def _uncache_setting(key_name):
+    with _settings_lock:
+        _settings_cache.pop(key_name, None)
+
+
+def get_setting(key_name, refresh=False):
+    """Return the setting, read from the database only the first time it is used in this process.
+
+    The result is a detached Settings object whose setting_value is None if the setting does not exist yet.
+    Use refresh=True to re-read a value that other processes may have changed.
+
+    """
+    with _settings_lock:
+        cached = key_name in _settings_cache and not refresh
+        value = _settings_cache.get(key_name)
+    if not cached:
+        try:
+            with session_scope() as session:
+                value = session.query(Settings.setting_value).filter(Settings.setting_name == key_name).scalar()
+            _cache_setting(key_name, value)
+        except Exception, e:
+            logging.error(e)
+    return Settings(setting_name=key_name, setting_value=value)
+
+
+def save_setting(setting):
+    """Insert or update a setting in one atomic statement. Saving an unchanged value does not hit the database."""
+    with _settings_lock:
+        if setting.setting_name in _settings_cache and _settings_cache[setting.setting_name] == setting.setting_value:
+            return
     try:
-        session = connect_to_database()
-        rec = session.query(Settings).filter(Settings.setting_name == key_name).one()
-        setting = rec
-    except NoResultFound:
-        setting = Settings()
-        setting.setting_name = key_name
+        statement = _dialect_insert(Settings.__table__).values(setting_name=setting.setting_name,
+                                                               setting_value=setting.setting_value)
+        statement = statement.on_conflict_do_update(index_elements=[Settings.setting_name],
+                                                    set_={'setting_value': statement.excluded.setting_value})
+        with session_scope() as session:
+            session.execute(statement)
+        _cache_setting(setting.setting_name, setting.setting_value)
+        logging.info('Setting ID: {0}, Value: {1}'.format(setting.setting_name, setting.setting_value))
     except Exception, e:
+        _uncache_setting(setting.setting_name)
         logging.error(e)
-    finally:
-        if session is not None:
-            session.close_all()
-    return setting
 
 
-def save_setting(setting):
-    session = None
+def compare_and_set_setting(key_name, expected_value, new_value):
+    """Atomically change a setting from expected_value (None if it does not exist yet) to new_value.
+
+    Returns False, and leaves the setting alone, if another process changed it first.
+
+    """
+    settings = Settings.__table__
     try:
-        session = connect_to_database()
-        add_record(session, setting)
-        logging.info('Setting ID: {0}, Value: {1}'.format(setting.setting_name, setting.setting_value))
+        with session_scope() as session:
+            if expected_value is None:
+                result = session.execute(
+                    _dialect_insert(settings).values(setting_name=key_name, setting_value=new_value).
+                    on_conflict_do_nothing(index_elements=[settings.c.setting_name]))
+                if result.rowcount == 0:
+                    result = session.execute(
+                        update(settings).where(settings.c.setting_name == key_name).
+                        where(settings.c.setting_value.is_(None)).values(setting_value=new_value))
+            else:
+                result = session.execute(
+                    update(settings).where(settings.c.setting_name == key_name).
+                    where(settings.c.setting_value == expected_value).values(setting_value=new_value))
+            swapped = result.rowcount == 1
     except Exception, e:
         logging.error(e)
-    finally:
-        if session is not None:
-            session.close_all()
\ No newline at end of file
+        swapped = False
+    if swapped:
+        _cache_setting(key_name, new_value)
+    else:
+        _uncache_setting(key_name)
+    return swapped
+
+
+def advance_setting(key_name, new_value):
+    """Atomically move a watermark forward, e.g. an ISO 8601 scan or conversion date.
+
+    The setting is only written if it does not exist or its current value sorts before new_value, so parallel
+    workers can all report their progress and the latest one wins. Returns True if the value was written.
+
+    """
+    settings = Settings.__table__
+    try:
+        statement = _dialect_insert(settings).values(setting_name=key_name, setting_value=new_value)
+        statement = statement.on_conflict_do_update(
+            index_elements=[settings.c.setting_name],
+            set_={'setting_value': statement.excluded.setting_value},
+            where=or_(settings.c.setting_value.is_(None), settings.c.setting_value < statement.excluded.setting_value))
+        with session_scope() as session:
+            advanced = session.execute(statement).rowcount == 1
+    except Exception, e:
+        logging.error(e)
+        advanced = False
+    if advanced:
+        _cache_setting(key_name, new_value)
+    else:
+        _uncache_setting(key_name)
+    return advanced
\ No newline at end of file
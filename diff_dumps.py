@@ -0,0 +1,175 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import argparse
+import heapq
+import logging
+import os
+import shutil
+import simplejson as json
+import sys
+import tempfile
+
+from collections import Counter
+from harvest_logging import add_logging_arguments, setup_logging
+from harvester_config import add_config_argument, load_config
+from metadata_model import MetadataDatasetModel
+
+argparser = argparse.ArgumentParser(
+    description='Compare two JSON Lines dumps of CKAN datasets and list the added, removed and changed datasets'
+)
+argparser.add_argument('old', help='Earlier dump, e.g. geodump_2015-06-01-020000.jsonl')
+argparser.add_argument('new', help='Later dump')
+argparser.add_argument('-o', '--output', action='store', default='', dest='output',
+                       help='File to write the differences to, as JSON Lines (default: standard output)')
+argparser.add_argument('-s', '--sorted', action='store_true', default=False, dest='presorted',
+                       help='Both dumps are already sorted by id, with one line per id: skip the sort')
+argparser.add_argument('-n', '--run-size', action='store', type=int, default=10000, dest='run_size',
+                       help='Datasets held in memory at a time while sorting (default: 10000)')
+argparser.add_argument('--temp-dir', action='store', default=None, dest='temp_dir',
+                       help='Directory of the sorted runs (default: the system temporary directory)')
+add_config_argument(argparser)
+add_logging_arguments(argparser)
+
+
+def _keyed_lines(path):
+    """Generate (id, line) for every dataset of a dump, in the order of the file"""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)['id'], line
+
+
+def _write_run(lines, directory):
+    lines.sort()
+    run = tempfile.NamedTemporaryFile(mode='w', dir=directory, suffix='.run', delete=False)
+    with run:
+        for line in lines:
+            run.write(line)
+            run.write('\n')
+    return run.name
+
+
+def _read_run(path):
+    with open(path) as f:
+        for line in f:
+            yield line
+
+
+def sorted_datasets(path, run_size=10000, temp_dir=None):
+    """Generate (id, line) for every dataset of a dump in id order, holding at most `run_size` lines in memory.
+
+    The dump is read in runs of `run_size` lines, each sorted and written to a temporary file, and the runs are
+    then merged. Each line is written as "id<TAB>position<TAB>json": the JSON encoder escapes tabs, so the lines
+    sort by id, and by position in the dump for the same id. When a dataset appears more than once, e.g. in a
+    dump that was appended to, its last line is kept.
+
+    """
+    directory = tempfile.mkdtemp(prefix='diff_dumps', dir=temp_dir)
+    try:
+        runs = []
+        lines = []
+        for position, (dataset_id, line) in enumerate(_keyed_lines(path)):
+            lines.append('{0}\t{1:012d}\t{2}'.format(dataset_id.encode('utf-8'), position, line))
+            if len(lines) >= run_size:
+                runs.append(_write_run(lines, directory))
+                lines = []
+        if len(lines) > 0:
+            runs.append(_write_run(lines, directory))
+
+        last_id = None
+        last_line = None
+        for merged in heapq.merge(*[_read_run(run) for run in runs]):
+            dataset_id, _, line = merged.rstrip('\n').split('\t', 2)
+            if dataset_id != last_id and last_id is not None:
+                yield last_id.decode('utf-8'), last_line
+            last_id, last_line = dataset_id, line
+        if last_id is not None:
+            yield last_id.decode('utf-8'), last_line
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def presorted_datasets(path):
+    """Generate (id, line) for a dump that is already sorted by id, checking the order as it goes"""
+    last_id = None
+    for dataset_id, line in _keyed_lines(path):
+        if last_id is not None and dataset_id <= last_id:
+            raise ValueError('{0} is not sorted by id: {1} follows {2}'.format(path, dataset_id, last_id))
+        last_id = dataset_id
+        yield dataset_id, line
+
+
+def _field_value(ds, field):
+    value = getattr(ds, field)
+    if field == 'resources':
+        return [r.as_dict() for r in value]
+    return value
+
+
+def compare_datasets(old_line, new_line):
+    """Return {field: [old value, new value]} for the fields compared by MetadataDatasetModel that differ"""
+    if old_line == new_line:
+        return {}
+    old = MetadataDatasetModel.from_dict(json.loads(old_line))
+    new = MetadataDatasetModel.from_dict(json.loads(new_line))
+    return dict((field, [_field_value(old, field), _field_value(new, field)]) for field in old.diff_fields(new))
+
+
+def diff_dumps(old_datasets, new_datasets):
+    """Merge two streams of (id, line) sorted by id. Generates a dict for each added, removed or changed dataset."""
+    old_datasets = iter(old_datasets)
+    new_datasets = iter(new_datasets)
+    old = next(old_datasets, None)
+    new = next(new_datasets, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield {'id': old[0], 'change': 'removed', 'title': json.loads(old[1]).get('title')}
+            old = next(old_datasets, None)
+        elif old is None or new[0] < old[0]:
+            yield {'id': new[0], 'change': 'added', 'title': json.loads(new[1]).get('title')}
+            new = next(new_datasets, None)
+        else:
+            fields = compare_datasets(old[1], new[1])
+            if fields:
+                yield {'id': new[0], 'change': 'changed', 'fields': fields}
+            old = next(old_datasets, None)
+            new = next(new_datasets, None)
+
+
+def main(old_dump, new_dump, output=None, presorted=False, run_size=10000, temp_dir=None):
+    """Write the differences between two dumps as JSON Lines to `output` (a file object). Returns the counts of
+    added, removed and changed datasets and of the changes to each field."""
+    if output is None:
+        output = sys.stdout
+    if presorted:
+        old_datasets, new_datasets = presorted_datasets(old_dump), presorted_datasets(new_dump)
+    else:
+        old_datasets = sorted_datasets(old_dump, run_size, temp_dir)
+        new_datasets = sorted_datasets(new_dump, run_size, temp_dir)
+    changes = Counter()
+    fields = Counter()
+    for difference in diff_dumps(old_datasets, new_datasets):
+        changes[difference['change']] += 1
+        fields.update(difference.get('fields', {}).keys())
+        output.write(json.dumps(difference) + '\n')
+    logging.info('{0} added, {1} removed, {2} changed'.format(changes['added'], changes['removed'],
+                                                              changes['changed']))
+    for field, count in fields.most_common():
+        logging.info('{0}: {1} datasets changed'.format(field, count))
+    return changes, fields
+
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    setup_logging(args)
+    for path in (args.old, args.new):
+        if not os.path.exists(path):
+            argparser.error('{0} does not exist'.format(path))
+    if args.output:
+        with open(args.output, 'w') as f:
+            main(args.old, args.new, f, args.presorted, args.run_size, args.temp_dir)
+    else:
+        main(args.old, args.new, None, args.presorted, args.run_size, args.temp_dir)
@@ -1,9 +1,14 @@
 __author__ = 'Statistics Canada'
 
-from ConfigParser import ConfigParser
 from datetime import datetime
-from db_schema import connect_to_database, Packages, get_setting
+from db_schema import connect_to_database, close_session, Packages, get_setting
+from harvest_logging import ProgressReporter, add_logging_arguments, setup_logging
+from harvester_config import add_config_argument, load_config
+from metrics import get_metrics
+from profiling import add_profile_arguments, profiled
 import argparse
+import logging
+import time
 
 argparser = argparse.ArgumentParser(
     description='Scan Geogratis and save record to a database'
@@ -15,20 +20,25 @@ argparser.add_argument('-f', '--file', action='store', default='', dest='dumpfil
 argparser.add_argument('-m', '--monitor', action='store_true', default=False, dest='monitor')
 argparser.add_argument('-t', '--type', action='store', dest='scan_type', default='gr',
                        help='Type of harvest data to convert: e.g. ec or gr')
+add_config_argument(argparser)
+add_logging_arguments(argparser)
+add_profile_arguments(argparser)
 
-args = argparser.parse_args()
 
+def default_dump_file():
+    return 'geodump_{0}.jsonl'.format(datetime.now().strftime('%Y-%m-%d-%H%M%S'))
 
-def main(since, dumpfile, scan_type):
-    ini_config = ConfigParser()
-    ini_config.read('harvester.ini')
 
+def main(since, dumpfile, scan_type, monitor=False):
     session = connect_to_database()
+    metrics = get_metrics()
+    progress = ProgressReporter('{0} dump'.format(scan_type))
     last_id = 0
 
     while True:
 
-        if args.monitor:
+        read_started = time.time()
+        if monitor:
             last_run_setting = get_setting('last_conversion_' + scan_type)
             if last_run_setting.setting_value:
                 package_stream = session.query(Packages).filter(Packages.id > last_id).\
@@ -39,33 +49,43 @@ def main(since, dumpfile, scan_type):
                 package_stream = session.query(Packages).filter(Packages.id > last_id).\
                     filter(Packages.source == scan_type).\
                     order_by(Packages.id).limit(10).all()
-        elif args.since != '':
+        elif since != '':
             package_stream = session.query(Packages).filter(Packages.id > last_id).\
-                filter(Packages.updated > args.since).\
+                filter(Packages.updated > since).\
                 filter(Packages.source == scan_type).\
                 order_by(Packages.id).limit(10).all()
         else:
             package_stream = session.query(Packages).filter(Packages.id > last_id).\
                 filter(Packages.source == scan_type).\
                 order_by(Packages.id).limit(10).all()
+        metrics.observe('db_read_seconds', time.time() - read_started, source=scan_type, stage='dump')
         if len(package_stream) == 0:
             break
         else:
             if dumpfile != '':
                 with open(dumpfile, 'a') as dfile:
                     for r in package_stream:
-                        print u'Processing dataset {0}'.format(r.id)
+                        logging.debug('Processing dataset %s', r.id)
                         dfile.write(r.ckan_json + '\n')
                         last_id = r.id
+                        metrics.increment('records_total', source=scan_type, stage='dump', outcome='written')
+                        progress.advance()
             else:
                 for r in package_stream:
                     print r.ckan_json + '\n'
                     last_id = r.id
 
-    session.close()
+    close_session()
+    progress.finish()
+    metrics.flush()
 
-dumpfile = args.dumpfile
-if dumpfile == '':
-    dumpfile = 'geodump_{0}.jsonl'.format(datetime.now().strftime('%Y-%m-%d-%H%M%S'))
-main(since=args.since, dumpfile=dumpfile, scan_type=args.scan_type)
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    setup_logging(args)
+    dumpfile = args.dumpfile
+    if dumpfile == '':
+        dumpfile = default_dump_file()
+    with profiled(args):
+        main(since=args.since, dumpfile=dumpfile, scan_type=args.scan_type, monitor=args.monitor)
 
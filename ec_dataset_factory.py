@@ -6,18 +6,22 @@ __license__ = 'MIT'
 import logging
 import re
 import simplejson as json
-import traceback
 
-from ConfigParser import ConfigParser
-from db_schema import connect_to_database, find_record_by_uuid, ECRecord
+from db_schema import find_record_by_uuid, session_scope, ECRecord
+from geometry import bbox_polygon, create_encoder
 from HTMLParser import HTMLParser
 from lxml import etree
 from metadata_model import MetadataDatasetModel, MetadataResourcesModel
-from metadata_schema import schema_description
+from regions import RegionFinder
+from resource_formats import create_format_detector
+from topic_resolver import TopicResolver
 
 
 class MetadataDatasetModelECFactory:
 
+    # Change the version whenever a change to the factory changes the records it produces
+    version = '5'
+
     def __init__(self):
         self.nap_namespaces = {'gmd'   : 'http://www.isotc211.org/2005/gmd',
                                'gco'   : 'http://www.isotc211.org/2005/gco',
@@ -41,22 +45,33 @@ class MetadataDatasetModelECFactory:
             'unknown'     : "Unknown | Inconnu"}
         self.root = None
         self.valid = False
+        self.geometry = create_encoder()
+        self.regions = RegionFinder()
 
         # Topic categories
-        self.topic_choices = dict((c['eng'], c) for c in schema_description.dataset_field_by_id['topic_category']['choices'] if 'eng' in c)
+        self.topics = TopicResolver()
+        self.formats = create_format_detector()
 
     def create_model(self, uuid):
 
         # Get the previously harvested NAP XML
-        session = connect_to_database()
-        try:
+        with session_scope() as session:
             ec_rec = find_record_by_uuid(session, uuid, query_class=ECRecord)
-            self.root = etree.fromstring(ec_rec.nap_record)
-        finally:
-            session.close()
+        return self.create_model_from_record(ec_rec)
+
+    def create_model_from_record(self, ec_rec):
+        """Convert an ECRecord that has already been read from the database"""
+        return self.convert_nap_xml(ec_rec.nap_record)
+
+    def record_payload(self, ec_rec):
+        """The harvested data that the conversion of an ECRecord depends on"""
+        return [ec_rec.nap_record]
 
+    def convert_nap_xml(self, nap_xml):
         """Convert a NAP file into an Open Data record"""
 
+        self.root = etree.fromstring(nap_xml)
+
         ds = MetadataDatasetModel()
         ds.owner_org = 'ec'
         ds.catalog_type = u'Geo Data | G\u00e9o'
@@ -89,12 +104,12 @@ class MetadataDatasetModelECFactory:
 
             ds.title = self._get_first_text('/gmd:MD_Metadata/gmd:identificationInfo/gmd:MD_DataIdentification/gmd:citation/gmd:CI_Citation/gmd:title/gco:CharacterString')
             if len(ds.title) == 0:
-                print(ds.id + 'No English Title Given')
+                logging.warning(ds.id + ' No English Title Given')
                 self.valid = False
 
             ds.title_fra = self._get_first_text('/gmd:MD_Metadata/gmd:identificationInfo/gmd:MD_DataIdentification/gmd:citation/gmd:CI_Citation/gmd:title/gmd:PT_FreeText/gmd:textGroup/gmd:LocalisedCharacterString')
             if len(ds.title_fra) == 0:
-               print(ds.id + ' No French Title Given')
+               logging.warning(ds.id + ' No French Title Given')
                self.valid = False
 
             # Description - English and French
@@ -146,14 +161,14 @@ class MetadataDatasetModelECFactory:
             ds.subject = topics_subjects['subjects']
             if len(ds.subject) == 0:
                 self.valid = False
-                print(ds.id + ' No GC Subjects')
+                logging.warning(ds.id + ' No GC Subjects')
 
             # GoC Topic
 
             ds.topic_category = topics_subjects['topics']
             if len(ds.topic_category) == 0:
                 self.valid = False
-                print(ds.id + ' No GC Topics')
+                logging.warning(ds.id + ' No GC Topics')
 
             # Tags - English and French
 
@@ -162,7 +177,7 @@ class MetadataDatasetModelECFactory:
             keywords_en = keywords_en.replace(';', ' ')
             if len(keywords_en) == 0:
                 self.valid = False
-                print(ds.id + ' No English Keywords')
+                logging.warning(ds.id + ' No English Keywords')
             else:
                 ds.keywords = keywords_en.split(',')
             ds.keywords_fra = []
@@ -170,7 +185,7 @@ class MetadataDatasetModelECFactory:
             keywords_fr = keywords_fr.replace(u"/u2019", "'").replace(";", " ")
             if len(keywords_fr) == 0:
                 self.valid = False
-                print(ds.id + ' No French Keywords')
+                logging.warning(ds.id + ' No French Keywords')
             else:
                 ds.keywords_fra = keywords_fr.split(',')
 
@@ -185,8 +200,12 @@ class MetadataDatasetModelECFactory:
             southLat = self._get_first_text('/gmd:MD_Metadata/gmd:identificationInfo/gmd:MD_DataIdentification/gmd:extent/gmd:EX_Extent/gmd:geographicElement/gmd:EX_GeographicBoundingBox/gmd:southBoundLatitude/gco:Decimal')
 
             # convert these 4 points into a bounding box
-            ds.spatial = '{\"type\": \"Polygon\", \"coordinates\": [[[%s, %s], [%s, %s], [%s, %s], [%s, %s], [%s, %s]]]}' % (
-                                   westLong,northLat,eastLong,northLat,eastLong,southLat,westLong,southLat,westLong,northLat)
+            bounding_box = bbox_polygon(westLong, southLat, eastLong, northLat)
+            if bounding_box is None:
+                logging.warning('{0}: no valid bounding box'.format(ds.id))
+            ds.spatial = self.geometry.encode(bounding_box)
+            # NAP records have no place names, so the regions are those that the bounding box covers
+            ds.geographic_region = self.regions.find_regions_for_geometry(bounding_box)
 
             # Data Published
 
@@ -244,14 +263,13 @@ class MetadataDatasetModelECFactory:
                 od_resource.resource_type = "file"
                 od_resource.url = resource.xpath('gmd:CI_OnlineResource/gmd:linkage/gmd:URL', namespaces=self.nap_namespaces)[0].text
                 od_resource.size = ''
-                od_resource.format = self._guess_resource_type(od_resource.name)
+                od_resource.format = self._guess_resource_type(od_resource.name, od_resource.url)
                 if not od_resource.format == 'none':
                     od_resources.append(od_resource)
             ds.resources = od_resources
 
         except Exception as e:
-            print("Failure: ", e)
-            traceback.print_exc()
+            logging.exception('Failure: {0}'.format(e))
 
         if self.valid:
             ds.state = 'active'
@@ -286,45 +304,18 @@ class MetadataDatasetModelECFactory:
                 text_value = text_value.replace(")", " ")
             return text_value
         except Exception as e:
-            print ("Error ", e, xpath_query)
+            logging.error('Error {0} {1}'.format(e, xpath_query))
             raise
 
     def _get_gc_subject_category(self, geocategories):
         """Look up the GoC thesaurus values to determine topics and subjects.
 
         The Open Data schema uses the Government of Canada (GoC) thesaurus to enumerate valid topics and subjects.
-        The schema provides a mapping of subjects to topic categories. Geogratis records provide GoC topics.
-        This function looks up the subjects for these topics and returns two dictionaries with appropriate
-        Open Data topics and subjects for this Geogratis record.
+        The schema provides a mapping of subjects to topic categories. NAP records provide ISO topic categories.
+        This function looks up the topics and their subjects and returns them in a dictionary.
 
         """
-        topics = []
-        subjects = []
-
-        topic_categories = []
-        for geocat in geocategories:
-            if not geocat.text is None:
-                topic_categories.append(geocat.text.title())
-
-        # Subjects are mapped to the topics in the schema, so both are looked up from the topic keys
-        for topic in topic_categories:
-            # This seems to be a common pattern - deal with it
-            if topic == 'Climatologymeteorologyatmosphere':
-                topic_key = 'Climatology / Meteorology / Atmosphere'
-            elif topic == 'Geoscientificinformation':
-                topic_key = 'Geoscientific Information'
-            elif topic == 'Inlandwaters':
-                topic_key = 'Inland Waters'
-            else:
-                topic_key = re.sub("([a-z])([A-Z])","\g<1> \g<2>", topic).title()
-            if not topic_key in self.topic_choices.keys():
-                continue
-            topics.append(self.topic_choices[topic_key]['key'])
-            topic_subject_keys = self.topic_choices[topic_key]['subject_ids']
-            for topic_subject_key in topic_subject_keys:
-                if schema_description.dataset_field_by_id['subject']['choices_by_id'][topic_subject_key]:
-                    subjects.append(schema_description.dataset_field_by_id['subject']['choices_by_id'][topic_subject_key]['key'])
-
+        topics, subjects = self.topics.resolve_all([geocat.text for geocat in geocategories])
         return { 'topics' : topics, 'subjects' : subjects}
 
     def _get_update_frequency(self, rawFrequency):
@@ -336,13 +327,8 @@ class MetadataDatasetModelECFactory:
         else:
             return self.ds_update_freq_map['unknown']
 
-    def _guess_resource_type(self, title):
-        """Try to determine the file type of the resource from the file name"""
+    def _guess_resource_type(self, title, url=None):
+        """Try to determine the file type of the resource from the file name and URL"""
         if title is None:
           return "none"
-        if len(re.findall('csv', title, flags=re.IGNORECASE)) > 0:
-            return "CSV"
-        elif len(re.findall('html', title, flags=re.IGNORECASE)) > 0:
-            return "HTML"
-        else:
-            return "other"
\ No newline at end of file
+        return self.formats.detect(title, url)
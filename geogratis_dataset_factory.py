@@ -4,71 +4,42 @@ __license__ = 'MIT'
 
 import ckanapi
 import logging
-import re
-import simplejson as json
 
-from ConfigParser import ConfigParser
-from db_schema import connect_to_database, find_record_by_uuid
+from db_schema import find_record_by_uuid, session_scope
+from geometry import create_encoder
+from harvester_config import get_config
+from keyword_normalizer import KeywordNormalizer
+from lazy_json import json_value, loads_lazy
 from metadata_model import MetadataDatasetModel, MetadataResourcesModel
+from metadata_schema import schema_description
+from regions import RegionFinder
+from resource_formats import create_format_detector
+from topic_resolver import TopicResolver
 
 
 class MetadataDatasetModelGeogratisFactory():
 
+    # Change the version whenever a change to the factory changes the records it produces
+    version = '6'
+
     od_regions = {}
-    od_topics = {}
-    od_topic_subjects = {}
-    od_subjects = {}
-    od_resource_formats = {}
     od_presentation_forms = {}
 
     def __init__(self):
 
-        # Read from the schema.json file to get a list of acceptable choices for the fields in the Open Data schema
-        od_schema_file = open('schema.json', 'r')
-        schema_model = json.load(od_schema_file)
-        dataset_fields = []
-        for s in schema_model['dataset_sections']:
-            dataset_fields.extend(s['fields'])
-        dataset_field_by_id = dict((f['id'], f) for f in dataset_fields)
-        resource_fields = schema_model['resource_fields']
-        resource_field_by_id = dict((f['id'], f) for f in resource_fields)
+        # Keywords recur across records, so the normalizer is shared by all the records of this factory
+        self.keywords = KeywordNormalizer()
+        self.geometry = create_encoder()
+        self.regions = RegionFinder()
+        self.topics = TopicResolver()
+        self.formats = create_format_detector()
+
+        # Use the schema.json file to get a list of acceptable choices for the fields in the Open Data schema
+        dataset_field_by_id = schema_description.dataset_field_by_id
 
         for r in dataset_field_by_id['geographic_region']['choices']:
             self.od_regions[r['eng']] = r['key']
 
-        for t in dataset_field_by_id['topic_category']['choices']:
-            self.od_topics[t['eng']] = t['key']
-
-        # For convenience, let's have a dictionary of subjects by subject key
-        subjects = {}
-        for b in dataset_field_by_id['topic_category']['choices']:
-            subjects[b['id']] = b
-
-        for t in dataset_field_by_id['topic_category']['choices']:
-            self.od_topic_subjects[t['eng']] = []
-            for s in t['subject_ids']:
-                self.od_topic_subjects[t['eng']].append(s)
-
-        for f in dataset_field_by_id['subject']['choices']:
-            self.od_subjects[f['id']] = f['key']
-        for r in resource_field_by_id['format']['choices']:
-            self.od_resource_formats[r['eng']] = r['key']
-        # Additional mappings to the correct types are added because the file formats in Geogratis
-        # do not match one-for-one with Open Data formats
-        self.od_resource_formats['GeoTIFF (Georeferenced Tag Image File Format)'] = 'geotif'
-        self.od_resource_formats['TIFF (Tag Image File Format)'] = "tiff"
-        self.od_resource_formats['GeoTIFF'] = 'geotif'
-        self.od_resource_formats['Adobe PDF'] = 'PDF'
-        self.od_resource_formats['PDF - Portable Document Format'] = "PDF"
-        self.od_resource_formats['ASCII (American Standard Code for Information Interchange)'] = "TXT"
-        self.od_resource_formats['GML (Geography Markup Language)'] = "gml"
-        self.od_resource_formats['Shape'] = "SHAPE"
-        self.od_resource_formats['gzip (GNU zip)'] = "ZIP"
-        self.od_resource_formats['ZIP'] = "ZIP"
-        self.od_resource_formats['ESRI Shapefile'] = "SHAPE"
-        self.od_resource_formats['JPEG'] = "jpg"
-        self.od_resource_formats['Jpeg 2000'] = "jpeg 2000"
-
         self.od_presentation_forms['documentDigital'] = u"Document Digital | Document num\u00e9rique"
         self.od_presentation_forms['documentHardcopy'] = u"Document Hardcopy | Document papier"
         self.od_presentation_forms['imageDigital'] = u"Image Digital | Image num\u00e9rique"
@@ -92,19 +63,27 @@ class MetadataDatasetModelGeogratisFactory():
 
 
     def create_model(self, uuid):
-        session = connect_to_database()
-        try:
+        with session_scope() as session:
             geogratis_rec = find_record_by_uuid(session, uuid)
-            geo_rec_en = json.loads(geogratis_rec.json_record_en)
-            geo_rec_fr = json.loads(geogratis_rec.json_record_fr)
-        finally:
-            session.close()
+        return self.create_model_from_record(geogratis_rec)
+
+
+    def create_model_from_record(self, geogratis_rec):
+        """Convert a GeogratisRecord that has already been read from the database"""
+        # The geometry, often most of a record, is only decoded if it has to be reduced or its regions found
+        geo_rec_en = loads_lazy(geogratis_rec.json_record_en, ['geometry'])
+        geo_rec_fr = loads_lazy(geogratis_rec.json_record_fr, ['geometry'])
 
         # Even if the French or English record is missing, create an object with
 
         return self.convert_geogratis_json(geo_rec_en, geo_rec_fr)
 
 
+    def record_payload(self, geogratis_rec):
+        """The harvested data that the conversion of a GeogratisRecord depends on"""
+        return [geogratis_rec.json_record_en, geogratis_rec.json_record_fr]
+
+
     def convert_geogratis_json(self, geo_obj_en, geo_obj_fr):
 
         ds = MetadataDatasetModel()
@@ -122,14 +101,12 @@ class MetadataDatasetModelGeogratisFactory():
 
             # Keywords are extracted from two sources in the Geogratis record: the gc:subject category
             # and the keywords list
-            en_keywords = []
             en_subjects = self._get_category(geo_obj_en['categories'], 'urn:gc:subject')
-            for term in en_subjects:
-                en_keywords.append(self._clean_keyword(term['label']))
-            ds.keywords = self._extract_keywords(geo_obj_en.get('keywords', []), en_keywords)
+            ds.keywords = self.keywords.record_keywords([term['label'] for term in en_subjects],
+                                                        geo_obj_en.get('keywords', []))
 
             # CKAN needs to treat the GeoJSON as a string to store, not as actual JSON
-            ds.spatial = unicode(str(geo_obj_en['geometry']).replace("u'", '\"').replace("'", '\"'))
+            ds.spatial = self.geometry.encode(geo_obj_en.get('geometry'))
 
             if ('citation' in geo_obj_en) and ('presentationForm' in geo_obj_en['citation']):
                 for form in geo_obj_en['citation']['presentationForm'].split():
@@ -148,6 +125,9 @@ class MetadataDatasetModelGeogratisFactory():
             for term in terms:
                 if term['label'] in self.od_regions:
                     ds.geographic_region.append(self.od_regions[term['label']])
+            # Without place names, use the provinces and territories that the footprint covers
+            if len(ds.geographic_region) == 0:
+                ds.geographic_region = self.regions.find_regions_for_geometry(json_value(geo_obj_en.get('geometry')))
 
             if ('citation' in geo_obj_en) and ('seriesIssue' in geo_obj_en['citation']):
                 ds.data_series_issue_identification = geo_obj_en['citation']['seriesIssue']
@@ -164,29 +144,9 @@ class MetadataDatasetModelGeogratisFactory():
             if len(ds.date_published) == 4:
                 ds.date_published = '%s-01-01' % ds.date_published
 
+            # Topics also determine which subjects are used
             if 'topicCategories' in geo_obj_en:
-                for topic in geo_obj_en['topicCategories']:
-                    # Test for a non-standard exceptions specific to Geogratis
-                    if topic == u'society; soci\u00e9t\u00e9':
-                        topic = "society"
-                    elif topic == "farming; agriculture":
-                        topic = "farming"
-                    # Transform topic from Geogratis format to Open Data format.
-                    # e.g. geoscientificInformation -> Geoscientific Information
-                    topic_key = re.sub("([a-z])([A-Z])", "\g<1> \g<2>", topic).title()
-
-                    # Test for a formats specific to Geogratis
-                    if topic_key == "Climatology Meteorology Atmosphere":
-                        topic_key = "Climatology / Meteorology / Atmosphere"
-
-                    # Finally, validate that the topic appears in the approved Open Data list of topics.
-                    # Topics also determine which subjects are used, so for valid topics, assign the relevant subjects
-                    if topic_key in self.od_topics:
-                        ds.topic_category.append(self.od_topics[topic_key])
-                        for s in self.od_topic_subjects[topic_key]:
-                            if not s in ds.subject:
-                                ds.subject.append(self.od_subjects[s])
-                        ds.subject.sort()
+                ds.topic_category, ds.subject = self.topics.resolve_all(geo_obj_en['topicCategories'])
 
             if geo_obj_en['deleted'] == 'false':
                 ds.state = 'active'
@@ -199,10 +159,7 @@ class MetadataDatasetModelGeogratisFactory():
                     new_res.name = res['description']
                     new_res.url = res['link']
                     new_res.size = self._convert_size(res['size'])
-                    if res['type'] in self.od_resource_formats:
-                        new_res.format = self.od_resource_formats[res['type']]
-                    else:
-                        new_res.format = 'other'
+                    new_res.format = self.formats.lookup(res['type']) or self.formats.detect(res['type'], res['link'])
                     ds.resources.append(new_res)
             # Add a check for datasets with 0 resources
             if len(ds.resources) == 0:
@@ -227,11 +184,9 @@ class MetadataDatasetModelGeogratisFactory():
 
             # Keywords are extracted from two sources in the Geogratis record: the gc:subject category
             # and the keywords list
-            fr_keywords = []
             fr_subjects = self._get_category(geo_obj_fr['categories'], 'urn:gc:subject')
-            for term in fr_subjects:
-                fr_keywords.append(self._clean_keyword(term['label']))
-            ds.keywords_fra = self._extract_keywords(geo_obj_fr.get('keywords', []), fr_keywords)
+            ds.keywords_fra = self.keywords.record_keywords([term['label'] for term in fr_subjects],
+                                                            geo_obj_fr.get('keywords', []))
 
             if ('citation' in geo_obj_fr) and ('seriesIssue' in geo_obj_fr['citation']):
                 ds.data_series_issue_identification_fra = geo_obj_fr['citation']['seriesIssue']
@@ -255,33 +210,6 @@ class MetadataDatasetModelGeogratisFactory():
         return category
 
 
-    def _extract_keywords(self, keywords, base_keywords):
-        """Extract the keywords from keyword hierarchies
-
-        Obtain a string with comma-separated keywords. For some NRCAN products it is necessary to
-        strip away keyword hierarchy: e.g. for "one > two > three" should only be "three".
-
-        """
-        for keyword in keywords:
-            words = keyword.split('>')
-            if len(words) > 0:
-                last_word = words.pop()
-                last_word = self._clean_keyword(last_word)
-                base_keywords.append(last_word.strip())
-        base_keywords = list(set(base_keywords))
-        base_keywords.sort()
-        return base_keywords
-
-
-    def _clean_keyword(self, keyword):
-        """Clean up formatting on the keywords"""
-        keyword = keyword.strip().replace("/", " - ")
-        keyword = keyword.replace("(", "- ").replace(")", "") # change "one (two)" to "one - two"
-        keyword = keyword.replace("[", "- ").replace("]", "") # change "one [two]" to "one - two"
-        keyword = keyword.replace("+", "")                    # Get rid of plus signs
-        keyword = keyword.lower().strip()
-        return keyword
-
     def _convert_size(self, filesize):
         """Take a Geogratis file size string (e.g. 1.25 MB) and convert into a number of bytes in base 10"""
         byte_size = 0
@@ -307,9 +235,7 @@ class MetadataDatasetModelGeogratisFactory():
         :param uuid:
         :return:
         """
-        ini_config = ConfigParser()
-        ini_config.read('harvester.ini')
-        remote_url = ini_config.get('ckan', 'ckan.remote_portal')
+        remote_url = get_config().get('ckan', 'ckan.remote_portal')
 
         ckansite = ckanapi.RemoteCKAN(remote_url)
         package = None
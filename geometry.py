@@ -0,0 +1,275 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import logging
+import simplejson as json
+
+from collections import OrderedDict
+from harvester_config import get_config
+from lazy_json import JsonFragment
+
+# Fewest positions of a valid line and of a valid (closed) polygon ring
+_MIN_LINE = 2
+_MIN_RING = 4
+
+
+class GeometryEncoder(object):
+    """Serializes GeoJSON geometries for the `spatial` field.
+
+    Coordinates are rounded to `precision` decimals if given. Geometries with more than `max_vertices`
+    positions (0 for no limit) are simplified with the Douglas-Peucker algorithm, with a tolerance that is
+    doubled until they fit, starting from the coordinate precision. Rings are kept closed and valid, so a
+    geometry made of many rings may remain over the budget.
+
+    """
+
+    def __init__(self, precision=None, max_vertices=0):
+        self.precision = precision
+        self.max_vertices = max_vertices
+        # Identifies the settings in the conversion cache key, since they change the output
+        self.key = 'precision={0};max_vertices={1}'.format(precision, max_vertices)
+
+    def encode(self, geometry):
+        """Return the geometry as a GeoJSON string, or '' if there is no geometry.
+
+        A geometry that has not been decoded (a JsonFragment) is returned as it is when the settings leave
+        geometries unchanged, and only decoded to be reduced otherwise.
+
+        """
+        if not geometry:
+            return u''
+        if isinstance(geometry, JsonFragment):
+            if self.precision is None and self.max_vertices == 0:
+                return unicode(geometry.text)
+            geometry = geometry.value
+        geometry = self.reduce(geometry)
+        return unicode(json.dumps(geometry, ensure_ascii=False))
+
+    def reduce(self, geometry):
+        """Return a copy of the geometry, quantized and simplified according to the settings"""
+        if self.precision is not None:
+            geometry = map_coordinates(geometry, lambda ring, min_size: quantize(ring, self.precision, min_size))
+        if self.max_vertices > 0:
+            tolerance = 10 ** -(self.precision if self.precision is not None else 6)
+            while vertex_count(geometry) > self.max_vertices:
+                simplified = map_coordinates(geometry, lambda ring, min_size: simplify(ring, tolerance, min_size))
+                if vertex_count(simplified) == vertex_count(geometry) and tolerance > 360:
+                    logging.warning('Unable to simplify geometry to {0} vertices'.format(self.max_vertices))
+                    break
+                geometry = simplified
+                tolerance *= 2
+        return _ordered(geometry)
+
+
+def create_encoder():
+    """Create the GeometryEncoder configured in the [geometry] section of harvester.ini:
+    geometry.precision (decimals, default: unchanged) and geometry.max_vertices (default 0, no limit)"""
+    config = get_config()
+    return GeometryEncoder(config.getint('geometry', 'geometry.precision', None),
+                           config.getint('geometry', 'geometry.max_vertices', 0))
+
+
+def bbox_polygon(west, south, east, north):
+    """Return the GeoJSON polygon of a bounding box, or None if a bound is missing or not a number"""
+    try:
+        west, south, east, north = [float(v) for v in (west, south, east, north)]
+    except (TypeError, ValueError):
+        return None
+    return OrderedDict([('type', 'Polygon'),
+                        ('coordinates', [[[west, north], [east, north], [east, south], [west, south],
+                                          [west, north]]])])
+
+
+def bbox(geometry):
+    """Return the (west, south, east, north) bounds of a geometry, or None if it has no coordinates"""
+    xs = []
+    ys = []
+
+    def collect(ring, min_size):
+        xs.extend(p[0] for p in ring)
+        ys.extend(p[1] for p in ring)
+        return ring
+    if geometry:
+        map_coordinates(geometry, collect)
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def bounds_intersect(a, b):
+    """True if two (west, south, east, north) bounding boxes overlap or touch"""
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def intersects_bounds(geometry, bounds):
+    """True if a Polygon or MultiPolygon intersects a (west, south, east, north) bounding box.
+
+    Only the outer rings are considered: a bounding box that lies entirely in a hole still intersects.
+
+    """
+    if geometry['type'] == 'Polygon':
+        rings = geometry['coordinates'][:1]
+    elif geometry['type'] == 'MultiPolygon':
+        rings = [polygon[0] for polygon in geometry['coordinates'] if polygon]
+    else:
+        raise ValueError('Not a polygon: {0}'.format(geometry['type']))
+    west, south, east, north = bounds
+    corners = [(west, south), (east, south), (east, north), (west, north)]
+    for ring in rings:
+        if not ring or not bounds_intersect(bbox({'type': 'LineString', 'coordinates': ring}), bounds):
+            continue
+        for p in ring:
+            if west <= p[0] <= east and south <= p[1] <= north:
+                return True
+        if _point_in_ring(corners[0], ring):
+            return True
+        for i in xrange(len(ring) - 1):
+            for j in xrange(4):
+                if _segments_cross(ring[i], ring[i + 1], corners[j], corners[(j + 1) % 4]):
+                    return True
+    return False
+
+
+def _point_in_ring(point, ring):
+    x, y = point
+    inside = False
+    j = len(ring) - 1
+    for i in xrange(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _segments_cross(p1, p2, q1, q2):
+    def orientation(a, b, c):
+        value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return (value > 0) - (value < 0)
+    return (orientation(p1, p2, q1) != orientation(p1, p2, q2) and
+            orientation(q1, q2, p1) != orientation(q1, q2, p2))
+
+
+def vertex_count(geometry):
+    count = [0]
+
+    def add(ring, min_size):
+        count[0] += len(ring)
+        return ring
+    map_coordinates(geometry, add)
+    return count[0]
+
+
+def map_coordinates(geometry, f):
+    """Return a copy of the geometry with every list of positions replaced by f(positions, min_size), where
+    min_size is the fewest positions the list may have (1 for points, 2 for lines, 4 for polygon rings)"""
+    geo_type = geometry.get('type')
+    result = dict(geometry)
+    if geo_type == 'GeometryCollection':
+        result['geometries'] = [map_coordinates(g, f) for g in geometry.get('geometries', [])]
+        return result
+    coordinates = geometry.get('coordinates')
+    if coordinates is None:
+        return result
+    if geo_type == 'Point':
+        result['coordinates'] = f([coordinates], 1)[0]
+    elif geo_type == 'MultiPoint':
+        result['coordinates'] = f(coordinates, 1)
+    elif geo_type == 'LineString':
+        result['coordinates'] = f(coordinates, _MIN_LINE)
+    elif geo_type == 'MultiLineString':
+        result['coordinates'] = [f(line, _MIN_LINE) for line in coordinates]
+    elif geo_type == 'Polygon':
+        result['coordinates'] = [f(ring, _MIN_RING) for ring in coordinates]
+    elif geo_type == 'MultiPolygon':
+        result['coordinates'] = [[f(ring, _MIN_RING) for ring in polygon] for polygon in coordinates]
+    return result
+
+
+def quantize(positions, precision, min_size=1):
+    """Round the positions to `precision` decimals and drop the consecutive positions that become equal"""
+    rounded = []
+    for p in positions:
+        q = [round(c, precision) for c in p]
+        if not rounded or q != rounded[-1]:
+            rounded.append(q)
+    if len(rounded) < min_size:
+        # Too small to survive the rounding; keep every position instead
+        return [[round(c, precision) for c in p] for p in positions]
+    return rounded
+
+
+def simplify(positions, tolerance, min_size=_MIN_LINE):
+    """Douglas-Peucker simplification of a line or closed ring, keeping at least min_size positions"""
+    n = len(positions)
+    if n <= min_size:
+        return positions
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+    # Iterative, since rings of NRCan footprints can be deeper than the recursion limit
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        index, distance = _farthest(positions, first, last)
+        if index is not None and distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    simplified = [p for p, k in zip(positions, keep) if k]
+    if len(simplified) < min_size:
+        # A ring collapsed: keep the positions farthest from each other instead
+        simplified = _widest(positions, min_size)
+    return simplified
+
+
+def _farthest(positions, first, last):
+    ax, ay = positions[first][0], positions[first][1]
+    bx, by = positions[last][0], positions[last][1]
+    dx = bx - ax
+    dy = by - ay
+    length_sq = dx * dx + dy * dy
+    index = None
+    max_distance = -1.0
+    for i in xrange(first + 1, last):
+        px, py = positions[i][0], positions[i][1]
+        if length_sq == 0:
+            # The two ends of a closed ring are the same position
+            distance = ((px - ax) ** 2 + (py - ay) ** 2) ** 0.5
+        else:
+            distance = abs(dy * px - dx * py + bx * ay - by * ax) / length_sq ** 0.5
+        if distance > max_distance:
+            index = i
+            max_distance = distance
+    return index, max_distance
+
+
+def _widest(positions, min_size):
+    """Keep the first position and those with the largest Douglas-Peucker distances, in their original order"""
+    n = len(positions)
+    keep = set([0, n - 1])
+    segments = [(0, n - 1)]
+    while len(keep) < min_size and segments:
+        best = None
+        for first, last in segments:
+            index, distance = _farthest(positions, first, last)
+            if index is not None and (best is None or distance > best[1]):
+                best = (index, distance, first, last)
+        if best is None:
+            break
+        index, distance, first, last = best
+        keep.add(index)
+        segments.remove((first, last))
+        segments.extend([(first, index), (index, last)])
+    return [positions[i] for i in sorted(keep)]
+
+
+def _ordered(geometry):
+    # Write the type first, as GeoJSON usually is, followed by the other members in a stable order
+    result = OrderedDict([('type', geometry.get('type'))])
+    for member in sorted(geometry):
+        if member == 'geometries':
+            result[member] = [_ordered(g) for g in geometry[member]]
+        elif member != 'type':
+            result[member] = geometry[member]
+    return result
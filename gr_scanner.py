@@ -2,16 +2,26 @@ __author__ = 'Statistics Canada'
 __license__ = 'MIT'
 
 import argparse
+import http_cache
 import logging
-import requests
 import simplejson as json
-from colorama import init, Fore, Style
+import threading
 from datetime import datetime
-from db_schema import connect_to_database, GeogratisRecord, add_record, find_record_by_uuid, get_setting, save_setting
-from time import sleep
-
-# Init colorama
-init(autoreset=True)
+from db_schema import compare_and_set_setting, GeogratisRecord, find_record_by_uuid, get_setting
+from geogratis_dataset_factory import MetadataDatasetModelGeogratisFactory
+from harvest_logging import add_logging_arguments, setup_logging
+from harvest_sources import HarvestSource, register_source, run_scan
+from harvester_config import add_config_argument, get_config, load_config
+from profiling import add_profile_arguments, profiled
+from time import sleep, time
+
+# Base URL of the Geogratis API, e.g. of a mirror or a stub server, in the geogratis.url option
+GEOGRATIS_API = 'http://geogratis.gc.ca/api'
+
+# Time before which the next record request must not be sent. It is shared by the fetch workers, so that the
+# geogratis.request_delay option is the pause between two requests to the server, whatever the number of workers.
+_next_request_time = [0.0]
+_request_lock = threading.Lock()
 
 # Set up command line arguments
 
@@ -20,115 +30,140 @@ argparser = argparse.ArgumentParser(
 )
 argparser.add_argument('-d', '--since', action='store', default='', dest='since',
                        help='Scan since date (e.g. 2014-01-21)')
-argparser.add_argument('-l', '--log', action='store', default='', dest='log_filename', help='Log to file')
 argparser.add_argument('-s', '--start_index', action='store', default='', dest='start_index',
                        help='Start-index')
 argparser.add_argument('-m', '--monitor', action='store_true', default=False, dest='monitor')
+argparser.add_argument('-r', '--resume', action='store_true', default=False, dest='resume',
+                       help='Resume an interrupted scan from its last checkpoint')
+argparser.add_argument('-i', '--checkpoint-interval', action='store', type=int, default=None,
+                       dest='checkpoint_interval', help='Number of records between checkpoints (default: 100)')
+add_config_argument(argparser)
+add_logging_arguments(argparser)
+add_profile_arguments(argparser)
 
-args = argparser.parse_args()
-
-if args.log_filename != '':
-    logging.basicConfig(filename=args.log_filename, level=logging.WARNING,
-                        format='%(asctime)s %(levelname)s: %(message)s',
-                        datefmt='%m/%d/%Y %I:%M:%S %p')
-    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
-                        datefmt='%m/%d/%Y %I:%M:%S %p')
 
 def _get_link(geo_page, link_rel='next'):
     next_link = ''
     for link in geo_page['links']:
         if link['rel'] == link_rel:
             next_link = link['href']
-            logging.warn(next_link)
+            logging.debug(next_link)
             break
     return next_link
 
 
+def _api_url(path, lang='en'):
+    base_url = get_config().get('geogratis', 'geogratis.url', GEOGRATIS_API).rstrip('/')
+    return '{0}/{1}/nrcan-rncan/ess-sst{2}'.format(base_url, lang, path)
+
+
 def get_geogratis_rec(uuid, lang='en', data_format='json'):
-    geog_url = 'http://geogratis.gc.ca/api/{0}/nrcan-rncan/ess-sst/{1}.{2}'.format(
-        lang, uuid, data_format)
-    r = requests.get(geog_url)
+    geog_url = _api_url('/{0}.{1}'.format(uuid, data_format), lang)
+    r = http_cache.get(geog_url)
     if r.status_code == 200 and data_format == 'json':
         geo_result = r.json()
     else:
         logging.error('HTTP Error: {0}'.format(r.status_code))
         geo_result = None
-    sleep(0.3)
+    # Go easy on the server, but there is no need to wait for a response that came from the cache
+    if not isinstance(r, http_cache.CachedResponse):
+        _wait_for_next_request(get_config().getfloat('geogratis', 'geogratis.request_delay', 0.3))
     return geo_result
 
 
-def main(since='', start_index='', monitor=False):
-    geog_url = 'http://geogratis.gc.ca/api/en/nrcan-rncan/ess-sst?alt=json&max-results=100'
-    monitor_setting = get_setting('monitor_link')
-    if monitor:
-        if monitor_setting.setting_value is None:
-            geog_url = 'http://geogratis.gc.ca/api/en/nrcan-rncan/ess-sst?edited-min=2015-01-01&alt=json&max-results=100'
-        else:
-            geog_url = monitor_setting.setting_value
-    elif since != '':
-        geog_url = 'http://geogratis.gc.ca/api/en/nrcan-rncan/ess-sst?edited-min={0}&alt=json&max-results=100'.format(since)
-    elif start_index != '':
-        geog_url = 'http://geogratis.gc.ca/api/en/nrcan-rncan/ess-sst/?start-index={0}&alt=json&max-results=100'.format(start_index)
-    print ('{0}Scanning: {1}{2}'.format(Fore.GREEN, Fore.BLUE, geog_url))
-    r = requests.get(geog_url)
-    logging.info('HTTP Response Status {0}'.format(r.status_code))
-    session = None
-    try:
-        session = connect_to_database()
-        # Get the first page of the feed
-        if r.status_code == 200:
+def _wait_for_next_request(delay):
+    """Take the next free request slot, `delay` seconds after the one before it, and sleep until it comes"""
+    if delay <= 0:
+        return
+    with _request_lock:
+        now = time()
+        slot = max(now, _next_request_time[0])
+        _next_request_time[0] = slot + delay
+    if slot + delay > now:
+        sleep(slot + delay - now)
+
+
+@register_source
+class GeogratisSource(HarvestSource):
+    """Harvest the NRCan Earth Sciences products listed in the Geogratis Atom/JSON feed"""
+
+    name = 'gr'
+    record_class = GeogratisRecord
+
+    def enumerate_ids(self, position=None):
+        geog_url = position
+        if geog_url is None:
+            geog_url = self._start_url()
+            logging.info('Scanning: {0}'.format(geog_url))
+            r = http_cache.get(geog_url)
+            logging.info('HTTP Response Status {0}'.format(r.status_code))
+            if r.status_code != 200:
+                logging.error('HTTP Error: {0}'.format(r.status_code))
+                return
             feed_page = r.json()
 
             # Save the monitor link for future use
             monitor_link = _get_link(feed_page, 'monitor')
             if monitor_link != '':
+                # Only replace the link this scan started from; a concurrent scan may have saved a newer one
+                if not compare_and_set_setting('monitor_link', self._monitor_link, monitor_link):
+                    logging.warning('Monitor link was changed by another scan, not saving {0}'.format(monitor_link))
+                logging.info('Next monitor link: {0}'.format(monitor_link))
+            self.total = feed_page['count']
+            logging.info('{0} records found'.format(self.total))
+        else:
+            feed_page = http_cache.get(geog_url).json()
 
-                monitor_setting.setting_value = monitor_link
-                save_setting(monitor_setting)
-                print  "{0}Next Monitor Link: {1}{2}".format(Fore.YELLOW, Fore.BLUE, monitor_setting.setting_value)
+        # Keep polling until exhausted
+        while True:
             next_link = _get_link(feed_page)
-
-            print ('{0}{1} Records Found'.format(Fore.BLUE, feed_page['count']))
-
-            if 'products' in feed_page:
-                for product in feed_page['products']:
-                    try:
-                        save_geogratis_record(session, product['id'])
-                    except Exception, e:
-                        logging.error('{0} failed to load'.format(product['id']))
-                        logging.error(e)
-
-            # Keep polling until exhausted
-            while next_link != '':
-                geog_url = next_link
-                r = requests.get(geog_url)
-                feed_page = r.json()
-                next_link = _get_link(feed_page)
-                print '{0}Next page link: {1}{2}'.format(Fore.YELLOW, Fore.BLUE, next_link)
-                if 'products' in feed_page:
-                    for product in feed_page['products']:
-
-                        # Don't crash on every call - log the error and continue
-                        try:
-                            save_geogratis_record(session, product['id'])
-                        except Exception, e:
-                            logging.error('{0} failed to load'.format(product['id']))
-                            logging.error(e)
-                save_setting(monitor_setting)
-
+            logging.debug('Next page link: %s', next_link)
+            yield next_link or None, _get_product_ids(feed_page)
+            if next_link == '':
+                break
+            feed_page = http_cache.get(next_link).json()
+
+    def _start_url(self):
+        self._monitor_link = get_setting('monitor_link').setting_value
+        geog_url = _api_url('?alt=json&max-results=100')
+        if self.monitor:
+            if self._monitor_link is None:
+                geog_url = _api_url('?edited-min=2015-01-01&alt=json&max-results=100')
+            else:
+                geog_url = self._monitor_link
+        elif self.since != '':
+            geog_url = _api_url('?edited-min={0}&alt=json&max-results=100'.format(self.since))
+        elif self.start_index != '':
+            geog_url = _api_url('/?start-index={0}&alt=json&max-results=100'.format(self.start_index))
+        return geog_url
+
+    def fetch(self, uuid):
+        logging.debug('Retrieving data set %s', uuid)
+        return get_geogratis_rec(uuid), get_geogratis_rec(uuid, 'fr')
+
+    def save(self, session, uuid, payload):
+        geo_rec_en, geo_rec_fr = payload
+        return save_geogratis_record(session, geo_rec_en, geo_rec_fr)
+
+    def create_factory(self):
+        return MetadataDatasetModelGeogratisFactory()
+
+
+def main(since='', start_index='', monitor=False, resume=False, checkpoint_interval=None, record_sink=None):
+    """Scan the Geogratis feed. Each saved GeogratisRecord is also passed to record_sink, if one is given."""
+    source = GeogratisSource(since=since, start_index=start_index, monitor=monitor)
+    try:
+        run_scan(source, resume=resume, checkpoint_interval=checkpoint_interval, record_sink=record_sink)
     except Exception, e:
         logging.error(e)
-    finally:
-        if session is not None:
-            session.close_all()
 
 
-def save_geogratis_record(session, uuid):
-    msg = 'Retrieving data set {0}'.format(uuid)
-    logging.info(msg)
-    print(msg)
-    geo_rec_en = get_geogratis_rec(uuid)
-    geo_rec_fr = get_geogratis_rec(uuid, 'fr')
+def _get_product_ids(feed_page):
+    return [product['id'] for product in feed_page.get('products', [])]
+
+
+def save_geogratis_record(session, geo_rec_en, geo_rec_fr):
+    """Add the English and French records to the session. Returns the GeogratisRecord, or None if not found."""
     if not geo_rec_en is None:
         state = 'deleted'
         title_fr = ''
@@ -159,28 +194,36 @@ def save_geogratis_record(session, uuid):
                                       updated=updated_date,
                                       edited=edited_date,
                                       state=state,
-                                      geogratis_scanned=geogratis_scanned)
+                                      scanned=geogratis_scanned)
         else:
             new_rec.title_en = geo_rec_en['title']
             new_rec.title_fr = title_fr
             new_rec.json_record_en = json.dumps(geo_rec_en)
-            new_rec.json_record_fr = json.dumps(geo_rec_fr),
-            new_rec.created = created_date,
-            new_rec.updated = updated_date,
-            new_rec.edited = edited_date,
+            new_rec.json_record_fr = json.dumps(geo_rec_fr)
+            new_rec.created = created_date
+            new_rec.updated = updated_date
+            new_rec.edited = edited_date
             new_rec.state = state
-            new_rec.geogratis_scanned = geogratis_scanned
+            new_rec.scanned = geogratis_scanned
 
-        add_record(session, new_rec)
+        session.add(new_rec)
+        return new_rec
+    return None
 
 # Run the scanner
 
-if args.monitor:
-    main('', '', True)
-elif args.since != '':
-    main(since=args.since)
-elif args.start_index != '':
-    main(start_index=args.start_index)
-else:
-    main()
-print 'Scan completed {0}{1}'.format(Style.BRIGHT, datetime.now().isoformat())
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    setup_logging(args)
+
+    with profiled(args):
+        if args.monitor:
+            main('', '', True, resume=args.resume, checkpoint_interval=args.checkpoint_interval)
+        elif args.since != '':
+            main(since=args.since, resume=args.resume, checkpoint_interval=args.checkpoint_interval)
+        elif args.start_index != '':
+            main(start_index=args.start_index, resume=args.resume, checkpoint_interval=args.checkpoint_interval)
+        else:
+            main(resume=args.resume, checkpoint_interval=args.checkpoint_interval)
+    logging.info('Scan completed {0}'.format(datetime.now().isoformat()))
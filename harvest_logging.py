@@ -0,0 +1,122 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import logging
+import simplejson as json
+import sys
+import time
+
+from datetime import datetime
+from harvester_config import get_config
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+TEXT_DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+# Attributes of every LogRecord; anything else was passed in `extra` and is added to the JSON lines
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', logging.INFO, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def add_logging_arguments(argparser):
+    argparser.add_argument('-l', '--log', action='store', default='', dest='log_filename',
+                           help='Log to file instead of the console')
+    argparser.add_argument('--log-level', action='store', default=None, dest='log_level',
+                           choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                           help='Lowest level logged (default: logging.level or INFO). DEBUG logs every record.')
+    argparser.add_argument('--log-format', action='store', default=None, dest='log_format',
+                           choices=['text', 'json'],
+                           help='text lines, or one JSON object per line (default: logging.format or text)')
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a log record as a JSON object on one line, with the fields given in `extra`"""
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'thread': record.threadName,
+                 'message': record.getMessage()}
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=unicode)
+
+
+def setup_logging(args):
+    """Configure the root logger from the add_logging_arguments() options, falling back to the [logging]
+    section of harvester.ini: logging.level (INFO), logging.format (text or json) and logging.file"""
+    config = get_config()
+    level = args.log_level or config.get('logging', 'logging.level', 'INFO').upper()
+    log_format = args.log_format or config.get('logging', 'logging.format', 'text')
+    filename = args.log_filename or config.get('logging', 'logging.file', '')
+
+    if filename:
+        handler = logging.FileHandler(filename)
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT, TEXT_DATE_FORMAT))
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level))
+
+
+class ProgressReporter(object):
+    """Logs the progress of a stage: records done, records per second and, when the total is known, the
+    estimated time left.
+
+    advance() only compares the clock to the time of the next report, so it can be called for every record;
+    a summary is logged at most once every `interval` seconds (logging.progress_interval, default 10), and
+    once more by finish(). The figures are also given as `extra` fields for JSON logs.
+
+    """
+
+    def __init__(self, stage, total=None, interval=None):
+        self.stage = stage
+        self.total = total
+        if interval is None:
+            interval = get_config().getfloat('logging', 'logging.progress_interval', 10)
+        self.interval = interval
+        self.done = 0
+        self.started = time.time()
+        self._next_report = self.started + interval
+
+    def advance(self, count=1):
+        self.done += count
+        if time.time() >= self._next_report:
+            self.report()
+
+    def report(self, final=False):
+        now = time.time()
+        self._next_report = now + self.interval
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        fields = {'stage': self.stage, 'done': self.done, 'total': self.total,
+                  'rate': round(rate, 2), 'elapsed': round(elapsed, 1)}
+        if final:
+            message = '{0}: {1} records in {2:.1f}s ({3:.1f}/s)'.format(self.stage, self.done, elapsed, rate)
+        elif self.total:
+            eta = (self.total - self.done) / rate if rate > 0 else None
+            fields['eta'] = None if eta is None else round(max(eta, 0), 1)
+            message = '{0}: {1}/{2} records ({3:.1f}/s), ETA {4}'.format(
+                self.stage, self.done, self.total, rate, _duration(fields['eta']))
+        else:
+            message = '{0}: {1} records ({2:.1f}/s)'.format(self.stage, self.done, rate)
+        logging.info(message, extra={'progress': fields})
+
+    def finish(self):
+        self.report(final=True)
+
+
+def _duration(seconds):
+    if seconds is None:
+        return 'unknown'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
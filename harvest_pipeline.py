@@ -0,0 +1,108 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import argparse
+import logging
+
+from converter import convert_records
+from datetime import datetime
+from db_schema import advance_setting, close_session, connect_to_database
+from dump_packages import default_dump_file
+from harvest_logging import add_logging_arguments, setup_logging
+from harvest_sources import get_source, run_scan
+from harvester_config import add_config_argument, get_config, load_config
+from metrics import get_metrics
+from profiling import add_profile_arguments, profiled
+
+argparser = argparse.ArgumentParser(
+    description='Scan a data source, convert each record and dump it to JSON Lines in a single pass'
+)
+argparser.add_argument('-t', '--type', action='store', dest='scan_type', default='gr',
+                       help='Type of harvest, i.e. the name of a harvest source: e.g. ec or gr')
+argparser.add_argument('-d', '--since', action='store', default='', dest='since',
+                       help='Scan since date (e.g. 2014-01-21)')
+argparser.add_argument('-s', '--start_index', action='store', default='', dest='start_index',
+                       help='Start-index (Geogratis only)')
+argparser.add_argument('-m', '--monitor', action='store_true', default=False, dest='monitor',
+                       help='Only scan the records changed since the last scan')
+argparser.add_argument('-a', '--all', action='store_true', default=False, dest='all',
+                       help='Scan all the records (EC only)')
+argparser.add_argument('-f', '--file', action='store', default='', dest='dumpfile',
+                       help='File to write dump to')
+argparser.add_argument('-r', '--resume', action='store_true', default=False, dest='resume',
+                       help='Resume an interrupted scan from its last checkpoint')
+argparser.add_argument('-i', '--checkpoint-interval', action='store', type=int, default=None,
+                       dest='checkpoint_interval', help='Number of records between checkpoints (default: 100)')
+add_config_argument(argparser)
+add_logging_arguments(argparser)
+add_profile_arguments(argparser)
+
+
+class PackageSink:
+    """Receives each record as soon as the scanner has saved it. The records are converted and saved in batches
+    of harvester.convert_batch_size, and the package updates of each batch are appended to the JSON Lines dump
+    file once they are saved."""
+
+    def __init__(self, source, dumpfile, batch_size=None):
+        self.scan_type = source.name
+        self.factory = source.create_factory()
+        self.dumpfile = open(dumpfile, 'a')
+        if batch_size is None:
+            batch_size = get_config().getint('harvester', 'harvester.convert_batch_size', 100)
+        self.batch_size = batch_size
+        self.batch = []
+        self.count = 0
+
+    def __call__(self, scan_record):
+        self.batch.append(scan_record)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.batch) == 0:
+            return
+        packages = convert_records(connect_to_database(), self.factory, self.batch, self.scan_type)
+        self.batch = []
+        for ckan_json in packages:
+            self.dumpfile.write(ckan_json + '\n')
+        # Flush every batch so the dump can be loaded while the scan is still running
+        self.dumpfile.flush()
+        self.count += len(packages)
+        get_metrics().increment('records_total', value=len(packages), source=self.scan_type, stage='dump',
+                                outcome='written')
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.dumpfile.close()
+
+
+def main(scan_type, dumpfile, since='', start_index='', monitor=False, scan_all=False, resume=False,
+         checkpoint_interval=None):
+
+    started = datetime.now().strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    source = get_source(scan_type, since=since, start_index=start_index, monitor=monitor, scan_all=scan_all)
+    sink = PackageSink(source, dumpfile)
+    try:
+        run_scan(source, resume=resume, checkpoint_interval=checkpoint_interval, record_sink=sink)
+    finally:
+        sink.close()
+        close_session()
+
+    # Everything scanned by this run has already been converted, so a later converter run can start from here
+    advance_setting('last_conversion_' + scan_type, started)
+    logging.info('Harvest completed: {0} packages written to {1}'.format(sink.count, dumpfile))
+
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    setup_logging(args)
+
+    dumpfile = args.dumpfile
+    if dumpfile == '':
+        dumpfile = default_dump_file()
+    with profiled(args):
+        main(args.scan_type, dumpfile, since=args.since, start_index=args.start_index, monitor=args.monitor,
+             scan_all=args.all, resume=args.resume, checkpoint_interval=args.checkpoint_interval)
@@ -0,0 +1,228 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import logging
+
+from datetime import datetime
+from db_schema import close_session, connect_to_database
+from harvest_logging import ProgressReporter
+from harvester_config import get_config
+from metrics import get_metrics
+from multiprocessing.pool import ThreadPool
+from scan_checkpoint import ScanCheckpoint
+
+# Harvest source adapters by name (the scan type, e.g. gr or ec)
+_sources = {}
+
+# Modules that define the built-in sources. Each adapter registers itself when its module is imported.
+_SOURCE_MODULES = ['gr_scanner', 'csw_scanner']
+
+
+class HarvestSource(object):
+    """Adapter between a metadata source and the harvester.
+
+    An adapter only knows how to list the record ids of its source, fetch one record and store it, and which
+    factory converts its records to the Open Data schema. run_scan() supplies the rest of the harvest: concurrent
+    fetching, batched database writes, checkpoints and watermarks. New sources subclass HarvestSource and are
+    made available with the @register_source decorator.
+
+    """
+
+    # Scan type used on the command line and in the settings, e.g. gr
+    name = None
+    # Table the harvested records are saved to
+    record_class = None
+    # Number of records fetched at the same time
+    fetch_workers = 4
+    # Number of records to harvest, if the source has found out, for the progress reports
+    total = None
+
+    def __init__(self, since='', start_index='', monitor=False, scan_all=False, **options):
+        self.since = since
+        self.start_index = start_index
+        self.monitor = monitor
+        self.scan_all = scan_all
+        self.options = options
+
+    def enumerate_ids(self, position=None):
+        """Generate (next_position, ids) for every page of record ids, starting from a saved position if given.
+
+        next_position must be JSON serializable, since it is saved in the scan checkpoint, and is None once
+        the last page has been returned.
+
+        """
+        raise NotImplementedError
+
+    def fetch(self, uuid):
+        """Retrieve a record from the source, or return None if it is not available. Called from worker threads."""
+        raise NotImplementedError
+
+    def save(self, session, uuid, payload):
+        """Add or update the harvested record in the session, without committing, and return it"""
+        raise NotImplementedError
+
+    def create_factory(self):
+        """Return the factory that converts the harvested records to MetadataDatasetModel objects"""
+        raise NotImplementedError
+
+    def finish(self, started):
+        """Called after a complete scan that started at `started`, e.g. to save the source's watermark"""
+        pass
+
+
+def register_source(source_class):
+    _sources[source_class.name] = source_class
+    return source_class
+
+
+def load_sources():
+    """Import the built-in sources and those listed in harvester.source_modules"""
+    modules = list(_SOURCE_MODULES)
+    extra_modules = get_config().get('harvester', 'harvester.source_modules', '')
+    modules.extend(m.strip() for m in extra_modules.split(',') if m.strip() != '')
+    for module in modules:
+        __import__(module)
+
+
+def get_source(name, **options):
+    if name not in _sources:
+        load_sources()
+    if name not in _sources:
+        raise ValueError('Unknown harvest source: {0}'.format(name))
+    return _sources[name](**options)
+
+
+def run_scan(source, resume=False, checkpoint_interval=None, record_sink=None, batch_size=None):
+    """Harvest every record listed by a source.
+
+    Records are fetched by a pool of `source.fetch_workers` threads and written in batches of `batch_size`
+    (harvester.batch_size, default 20) with one commit per batch. After each batch the position and the ids
+    still to be saved are reported to the scan checkpoint, so resume=True continues an interrupted scan.
+    Every saved record is passed to record_sink, if one is given. Returns counts of saved and failed records.
+
+    """
+    config = get_config()
+    if batch_size is None:
+        batch_size = config.getint('harvester', 'harvester.batch_size', 20)
+    fetch_workers = config.getint('harvester', 'harvester.fetch_workers', source.fetch_workers)
+    checkpoint = ScanCheckpoint('{0}_scan'.format(source.name), checkpoint_interval)
+    stats = {'saved': 0, 'failed': 0}
+    progress = ProgressReporter('{0} scan'.format(source.name))
+    started = datetime.now()
+    pool = ThreadPool(fetch_workers)
+    completed = False
+    try:
+        session = connect_to_database()
+        if resume and checkpoint.load():
+            # Finish the records that were in flight, then carry on from the saved position
+            logging.info('Resuming {0} scan: {1} records pending'.format(source.name, len(checkpoint.pending)))
+            position = checkpoint.position
+            _harvest_ids(source, session, pool, checkpoint.pending, position, checkpoint, record_sink, stats,
+                         batch_size, progress)
+            pages = []
+            if position is not None:
+                pages = source.enumerate_ids(position)
+        else:
+            pages = source.enumerate_ids()
+
+        for next_position, ids in pages:
+            _harvest_ids(source, session, pool, ids, next_position, checkpoint, record_sink, stats, batch_size,
+                         progress)
+
+        checkpoint.clear()
+        completed = True
+        source.finish(started)
+    except Exception, e:
+        logging.error(e)
+        raise
+    finally:
+        if completed:
+            pool.close()
+            pool.join()
+        else:
+            # Also when the scan is stopped with Ctrl-C: KeyboardInterrupt and SystemExit are not Exceptions
+            checkpoint.flush()
+            # Stop the fetch workers before the session and metrics are closed
+            pool.terminate()
+        close_session()
+        get_metrics().flush()
+    progress.finish()
+    logging.info('{0} scan completed: {1} records saved, {2} failed'.format(source.name, stats['saved'],
+                                                                           stats['failed']))
+    return stats
+
+
+def _harvest_ids(source, session, pool, ids, next_position, checkpoint, record_sink, stats, batch_size, progress):
+
+    metrics = get_metrics()
+    progress.total = source.total
+
+    def fetch(uuid):
+        # Don't crash on every call - log the error and continue
+        try:
+            with metrics.span('fetch', record_id=uuid, source=source.name):
+                payload = source.fetch(uuid)
+        except Exception, e:
+            logging.error('{0} failed to load'.format(uuid))
+            logging.error(e)
+            metrics.increment('records_total', source=source.name, stage='fetch', outcome='failed')
+            return uuid, None
+        outcome = 'skipped' if payload is None else 'fetched'
+        metrics.increment('records_total', source=source.name, stage='fetch', outcome=outcome)
+        return uuid, payload
+
+    pending = list(ids)
+    batch = []
+    for uuid, payload in pool.imap(fetch, ids):
+        batch.append((uuid, payload))
+        progress.advance()
+        if len(batch) >= batch_size:
+            _save_batch(source, session, batch, record_sink, stats)
+            del pending[:len(batch)]
+            checkpoint.advance(next_position, pending, len(batch))
+            batch = []
+            # Ids of the page that are still being fetched or waiting for a fetch worker
+            metrics.set_gauge('queue_depth', len(pending), source=source.name)
+            metrics.flush(force=False)
+    if len(batch) > 0:
+        _save_batch(source, session, batch, record_sink, stats)
+        del pending[:len(batch)]
+        checkpoint.advance(next_position, pending, len(batch))
+    metrics.set_gauge('queue_depth', 0, source=source.name)
+
+
+def _save_batch(source, session, batch, record_sink, stats):
+    metrics = get_metrics()
+    records = []
+    try:
+        with metrics.span('db_write', source=source.name, stage='scan'):
+            for uuid, payload in batch:
+                if payload is not None:
+                    records.append(source.save(session, uuid, payload))
+            session.commit()
+    except Exception, e:
+        # Find the bad record by saving the batch again one record at a time
+        session.rollback()
+        logging.warning('Batch write failed, saving records one at a time: {0}'.format(e))
+        records = []
+        for uuid, payload in batch:
+            if payload is None:
+                continue
+            try:
+                record = source.save(session, uuid, payload)
+                session.commit()
+                records.append(record)
+            except Exception, e:
+                session.rollback()
+                logging.error('{0} failed to save'.format(uuid))
+                logging.error(e)
+
+    records = [r for r in records if r is not None]
+    stats['saved'] += len(records)
+    stats['failed'] += len(batch) - len(records)
+    metrics.increment('records_total', len(records), source=source.name, stage='save', outcome='saved')
+    metrics.increment('records_total', len(batch) - len(records), source=source.name, stage='save',
+                      outcome='failed')
+    if record_sink is not None:
+        for record in records:
+            record_sink(record)
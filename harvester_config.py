@@ -0,0 +1,85 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import os
+from ConfigParser import ConfigParser, NoOptionError, NoSectionError
+
+# Environment variable that points to the harvester.ini file to use
+CONFIG_PATH_ENV = 'HARVESTER_INI'
+CONFIG_FILE_NAME = 'harvester.ini'
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_NO_DEFAULT = object()
+_config = None
+
+
+class HarvesterConfig(object):
+    """Run-time parameters of the harvester, read once from harvester.ini.
+
+    Any option can be overridden with an environment variable named after the option, e.g.
+    HARVESTER_SQLALCHEMY_URL for sqlalchemy.url or HARVESTER_CSW_PASSWORD for csw.password.
+
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.parser = ConfigParser()
+        if path is not None and len(self.parser.read(path)) == 0:
+            raise IOError('Unable to read configuration file {0}'.format(path))
+
+    def get(self, section, option, default=_NO_DEFAULT):
+        env_name = 'HARVESTER_' + option.upper().replace('.', '_')
+        if env_name in os.environ:
+            return os.environ[env_name]
+        try:
+            return self.parser.get(section, option)
+        except (NoSectionError, NoOptionError):
+            if default is _NO_DEFAULT:
+                raise
+            return default
+
+    def getint(self, section, option, default=_NO_DEFAULT):
+        value = self.get(section, option, default)
+        return value if value is None else int(value)
+
+    def getfloat(self, section, option, default=_NO_DEFAULT):
+        value = self.get(section, option, default)
+        return value if value is None else float(value)
+
+    def getboolean(self, section, option, default=_NO_DEFAULT):
+        value = self.get(section, option, default)
+        if isinstance(value, basestring):
+            return value.strip().lower() in ('1', 'yes', 'true', 'on')
+        return value
+
+
+def find_config_file():
+    """Locate harvester.ini: $HARVESTER_INI, then the working directory, then the harvester directory"""
+    if os.environ.get(CONFIG_PATH_ENV):
+        return os.environ[CONFIG_PATH_ENV]
+    for directory in (os.getcwd(), _HERE):
+        path = os.path.join(directory, CONFIG_FILE_NAME)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_config(path=None):
+    """(Re)load the process-wide configuration, optionally from an explicit file"""
+    global _config
+    if path is None:
+        path = find_config_file()
+    _config = HarvesterConfig(path)
+    return _config
+
+
+def get_config():
+    """Return the process-wide configuration, loading it on first use"""
+    if _config is None:
+        load_config()
+    return _config
+
+
+def add_config_argument(argparser):
+    argparser.add_argument('-c', '--config', action='store', default=None, dest='config',
+                           help='Path to the harvester.ini file (default: $HARVESTER_INI or ./harvester.ini)')
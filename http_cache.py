@@ -0,0 +1,224 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import hashlib
+import logging
+import os
+import requests
+import simplejson as json
+import tempfile
+import threading
+import time
+
+from harvester_config import get_config
+from metrics import get_metrics
+from urlparse import urlparse
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class CacheMissError(IOError):
+    """Raised in replay mode for a request that is not in the cache"""
+    pass
+
+
+class CachedResponse(object):
+    """The parts of a requests.Response that the harvester uses, read back from the cache"""
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpCache(object):
+    """Content-addressed cache of HTTP responses on disk.
+
+    Responses are stored in files named after the SHA-1 of the method, URL, query parameters and request
+    body. An entry expires `ttl` seconds after it was stored (0 keeps it forever), and once the cache grows
+    past `max_size` bytes the least recently used entries, by file modification time, are deleted. In replay
+    mode expired entries are still served and a request that is not in the cache raises CacheMissError
+    instead of going to the network, so a harvest can be reproduced offline.
+
+    """
+
+    def __init__(self, directory, ttl=86400, max_size=512 * 1024 * 1024, replay=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.replay = replay
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._size = sum(os.path.getsize(path) for path in self._entries())
+
+    def request(self, method, url, params=None, data=None, session=None, **kwargs):
+        key = self.key(method, url, params, data)
+        response = self._load(key)
+        if response is not None:
+            return response
+        if self.replay:
+            raise CacheMissError('Not in the HTTP cache: {0} {1}'.format(method, url))
+
+        r = (session or requests).request(method, url, params=params, data=data, **kwargs)
+        # Errors are not cached, so that they are retried on the next harvest
+        if r.status_code == 200:
+            self._store(key, r)
+        return r
+
+    @staticmethod
+    def key(method, url, params=None, data=None):
+        h = hashlib.sha1()
+        h.update(method.upper())
+        h.update('\n' + _utf8(url))
+        if params:
+            h.update('\n' + json.dumps(params, sort_keys=True))
+        if data:
+            h.update('\n' + _utf8(data))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                meta = json.loads(entry.readline())
+                content = entry.read()
+        except (IOError, OSError, ValueError):
+            return None
+        if not self.replay and self.ttl > 0 and time.time() - meta['stored'] > self.ttl:
+            return None
+        try:
+            # Mark the entry as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return CachedResponse(meta['url'], meta['status_code'], meta['headers'], content)
+
+    def _store(self, key, r):
+        meta = json.dumps({'url': r.url, 'status_code': r.status_code, 'stored': time.time(),
+                           'headers': {'Content-Type': r.headers.get('Content-Type', '')}})
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError:
+            # Created by another thread
+            pass
+        # Write to a temporary file first so that readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as entry:
+            entry.write(meta + '\n')
+            entry.write(r.content)
+        size = os.path.getsize(temp_path)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.rename(temp_path, path)
+        with self._lock:
+            self._size += size - old_size
+            if self.max_size > 0 and self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        for shard in os.listdir(self.directory):
+            shard_path = os.path.join(self.directory, shard)
+            if os.path.isdir(shard_path):
+                for name in os.listdir(shard_path):
+                    yield os.path.join(shard_path, name)
+
+    def _evict(self):
+        # Delete the least recently used entries until the cache is back to 90% of its maximum size
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                pass
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_size * 0.9
+        evicted = 0
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+                evicted += 1
+            except OSError:
+                pass
+        logging.info('HTTP cache: evicted {0} entries'.format(evicted))
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._entries()):
+                os.remove(path)
+            self._size = 0
+
+
+def get_http_cache():
+    """Return the HTTP cache configured in the [cache] section of harvester.ini, or None if it is disabled"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = get_config()
+            replay = config.getboolean('cache', 'cache.replay', False)
+            if not (replay or config.getboolean('cache', 'cache.enabled', False)):
+                return None
+            _cache = HttpCache(config.get('cache', 'cache.directory', 'http_cache'),
+                               ttl=config.getint('cache', 'cache.ttl', 86400),
+                               max_size=config.getint('cache', 'cache.max_size_mb', 512) * 1024 * 1024,
+                               replay=replay)
+        return _cache
+
+
+def reset_http_cache():
+    """Forget the process-wide cache, e.g. after the configuration has been reloaded"""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _timed(method, url, send):
+    start = time.time()
+    r = send()
+    metrics = get_metrics()
+    host = urlparse(url).netloc
+    cached = 'true' if isinstance(r, CachedResponse) else 'false'
+    metrics.observe('http_request_seconds', time.time() - start, method=method, host=host, cached=cached)
+    metrics.increment('http_requests_total', method=method, host=host, status=r.status_code)
+    return r
+
+
+def get(url, params=None, session=None, **kwargs):
+    """requests.get, through the HTTP cache when it is enabled"""
+    cache = get_http_cache()
+    if cache is None:
+        return _timed('GET', url, lambda: (session or requests).get(url, params=params, **kwargs))
+    return _timed('GET', url, lambda: cache.request('GET', url, params=params, session=session, **kwargs))
+
+
+def post(url, data=None, session=None, **kwargs):
+    """requests.post, through the HTTP cache when it is enabled"""
+    cache = get_http_cache()
+    if cache is None:
+        return _timed('POST', url, lambda: (session or requests).post(url, data=data, **kwargs))
+    return _timed('POST', url, lambda: cache.request('POST', url, data=data, session=session, **kwargs))
@@ -0,0 +1,76 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import re
+
+# Punctuation rewritten in keywords: "one/two" becomes "one - two", "one (two)" and "one [two]" become
+# "one - two", and plus signs are dropped. None of the replacements contain characters of the pattern,
+# so a single pass gives the same result as applying them one after the other.
+_REPLACEMENTS = {
+    u'/': u' - ',
+    u'(': u'- ',
+    u')': u'',
+    u'[': u'- ',
+    u']': u'',
+    u'+': u'',
+}
+_PUNCTUATION = re.compile(u'[/()\\[\\]+]')
+
+
+def _replace(match):
+    return _REPLACEMENTS[match.group()]
+
+
+def clean_keyword(keyword):
+    """Clean up formatting on a keyword"""
+    return _PUNCTUATION.sub(_replace, keyword).lower().strip()
+
+
+class KeywordNormalizer(object):
+    """Normalizes Geogratis keywords, remembering the result for up to `memo_size` distinct terms.
+
+    The same subjects and keyword hierarchies recur across thousands of records, so most terms of a
+    record have already been cleaned. The memo is emptied when it is full.
+
+    """
+
+    def __init__(self, memo_size=10000):
+        self.memo_size = memo_size
+        self._memo = {}
+
+    def clean(self, keyword):
+        try:
+            return self._memo[keyword]
+        except KeyError:
+            pass
+        cleaned = clean_keyword(keyword)
+        if len(self._memo) >= self.memo_size:
+            self._memo.clear()
+        self._memo[keyword] = cleaned
+        return cleaned
+
+    def clean_all(self, keywords):
+        """Clean a list of keywords"""
+        memo = self._memo
+        cleaned = []
+        for keyword in keywords:
+            value = memo.get(keyword)
+            if value is None:
+                value = self.clean(keyword)
+            cleaned.append(value)
+        return cleaned
+
+    def record_keywords(self, subjects, keywords):
+        """Return the sorted, unique keywords of a record.
+
+        `subjects` are the labels of the record's gc:subject terms and `keywords` its keyword list. Keywords
+        are hierarchies such as "one > two > three" of which only the last level, "three", is kept.
+
+        """
+        terms = set(self.clean_all(subjects))
+        terms.update(self.clean_all([keyword.rsplit('>', 1)[-1] for keyword in keywords]))
+        return sorted(terms)
+
+    def page_keywords(self, records):
+        """record_keywords() for a list of (subjects, keywords) pairs, e.g. all the records of a feed page"""
+        return [self.record_keywords(subjects, keywords) for subjects, keywords in records]
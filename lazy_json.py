@@ -0,0 +1,147 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import re
+import simplejson as json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'\s*')
+# Strings are matched whole, so that the brackets inside them are not counted
+_BRACKETS = {u'{': re.compile(r'"(?:[^"\\]|\\.)*"|[{}]'), u'[': re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]]')}
+_CLOSERS = {u'{': u'}', u'[': u']'}
+
+
+class JsonFragment(object):
+    """The JSON text of a value that has not been decoded. It is decoded the first time `value` is read."""
+
+    __slots__ = ('text', '_value')
+
+    def __init__(self, text):
+        self.text = text
+        self._value = None
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = json.loads(self.text)
+        return self._value
+
+
+def json_value(value):
+    """Return the decoded value of a JsonFragment, or the value itself if it has already been decoded"""
+    if isinstance(value, JsonFragment):
+        return value.value
+    return value
+
+
+def _skip(text, start):
+    """Return the end of the object or array that starts at `start`, without decoding it.
+
+    Only the brackets of the outermost kind and the strings are visited, so the numbers of a GeoJSON geometry,
+    which make up nearly all of its text, are left to the regular expression engine.
+
+    """
+    opener = text[start]
+    closer = _CLOSERS[opener]
+    depth = 0
+    for match in _BRACKETS[opener].finditer(text, start):
+        token = match.group()
+        if token == opener:
+            depth += 1
+        elif token == closer:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    raise ValueError('Unterminated JSON value at {0}'.format(start))
+
+
+def _fragment(text):
+    # Empty values are decoded, so that they are still false
+    if text.strip(u'{}[] \t\r\n'):
+        return JsonFragment(text)
+    return json.loads(text)
+
+
+def _loads_spliced(text, lazy_keys):
+    """Cut the lazy values out of the text, replaced by null, and decode the rest in one call.
+
+    This only works when each lazy key appears once in the text, so that the value cut out is certainly
+    the one of the top level key; returns None when the keys do not appear that way.
+
+    """
+    spans = []
+    for key in lazy_keys:
+        quoted = u'"{0}"'.format(key)
+        count = text.count(quoted)
+        if count == 0:
+            continue
+        if count > 1:
+            return None
+        pos = _WHITESPACE.match(text, text.find(quoted) + len(quoted)).end()
+        if text[pos:pos + 1] != u':':
+            return None
+        pos = _WHITESPACE.match(text, pos + 1).end()
+        if text[pos:pos + 1] in _CLOSERS:
+            spans.append((pos, _skip(text, pos), key))
+    if len(spans) == 0:
+        return json.loads(text)
+
+    spans.sort()
+    pieces = []
+    last = 0
+    for start, end, key in spans:
+        pieces.append(text[last:start])
+        pieces.append(u'null')
+        last = end
+    pieces.append(text[last:])
+    obj = json.loads(u''.join(pieces))
+    for start, end, key in spans:
+        if not isinstance(obj, dict) or obj.get(key, False) is not None:
+            return None
+        obj[key] = _fragment(text[start:end])
+    return obj
+
+
+def _loads_walked(text, lazy_keys):
+    """Decode the top level object one member at a time, skipping the lazy values"""
+    start = _WHITESPACE.match(text).end()
+    if text[start:start + 1] != u'{':
+        return json.loads(text)
+    obj = {}
+    pos = _WHITESPACE.match(text, start + 1).end()
+    if text[pos:pos + 1] == u'}':
+        return obj
+    while True:
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = _WHITESPACE.match(text, pos).end()
+        if text[pos:pos + 1] != u':':
+            raise ValueError('Expecting : at {0}'.format(pos))
+        pos = _WHITESPACE.match(text, pos + 1).end()
+        if key in lazy_keys and text[pos:pos + 1] in _CLOSERS:
+            end = _skip(text, pos)
+            obj[key] = _fragment(text[pos:end])
+        else:
+            obj[key], end = _decoder.raw_decode(text, pos)
+        pos = _WHITESPACE.match(text, end).end()
+        separator = text[pos:pos + 1]
+        if separator == u'}':
+            return obj
+        if separator != u',':
+            raise ValueError('Expecting , or }} at {0}'.format(pos))
+        pos = _WHITESPACE.match(text, pos + 1).end()
+
+
+def loads_lazy(text, lazy_keys):
+    """Decode a JSON object, keeping the objects and arrays of the top level `lazy_keys` as JsonFragment.
+
+    Meant for records with a few large members that are usually copied to the output as they are, such as
+    the geometry of a Geogratis record: those are neither decoded nor encoded again unless they are needed.
+
+    """
+    if text is None:
+        return None
+    lazy_keys = frozenset(lazy_keys)
+    obj = _loads_spliced(text, lazy_keys)
+    if obj is None:
+        obj = _loads_walked(text, lazy_keys)
+    return obj
@@ -2,7 +2,192 @@ __author__ = 'Statistics Canada'
 __copyright__ = 'Crown Copyright'
 __license__ = 'MIT'
 
-import simplejson as json
+from collections import namedtuple
+
+
+# The fields of a model: the attribute, its key in as_dict() (None to leave it out), its label in compare()
+# (None if the field is not compared) and its kind:
+#   value      - compared and serialized as is
+#   list       - compared item by item, with the counts reported by compare() if they differ
+#   joined     - a list, serialized as a comma separated string
+#   resources  - the list of MetadataResourcesModel of a dataset
+# An attribute can be serialized under more than one key, e.g. the id of a dataset is also its name.
+# A list field can have another label, list_label, for the line of compare() that shows its items.
+Field = namedtuple('Field', ['attribute', 'key', 'label', 'kind', 'list_label'])
+Field.__new__.__defaults__ = (None,)
+
+DATASET_FIELDS = [
+    Field('id', 'id', 'ID', 'value'),
+    Field('url', 'url', 'URL', 'value'),
+    Field('url_fra', 'url_fra', 'URL (FR)', 'value'),
+    Field('title', 'title', 'Title', 'value'),
+    Field('title_fra', 'title_fra', 'Title (FR)', 'value'),
+    Field('notes', 'notes', 'Notes', 'value'),
+    Field('notes_fra', 'notes_fra', 'Notes (FR)', 'value'),
+    Field('date_modified', None, 'Date', 'value'),
+    Field('data_series_name', 'data_series_name', 'DSN', 'value'),
+    Field('data_series_name_fra', 'data_series_name_fra', 'DSN (FR)', 'value'),
+    Field('spatial', 'spatial', 'Spatial', 'value'),
+    Field('presentation_form', 'presentation_form', 'PForm', 'value'),
+    Field('digital_object_identifier', 'digital_object_identifier', 'DOI', 'value'),
+    Field('data_series_issue_identification', 'data_series_issue_identification', 'DSII', 'value'),
+    Field('data_series_issue_identification_fra', 'data_series_issue_identification_fra', 'DSII (FR)', 'value'),
+    Field('browse_graphic_url', 'browse_graphic_url', 'Graphic', 'value'),
+    Field('state', 'state', 'State', 'value'),
+    Field('keywords', 'keywords', 'Keywords', 'joined'),
+    Field('keywords_fra', 'keywords_fra', 'Keywords (FR)', 'joined', 'Keywords FR'),
+    Field('geographic_region', 'regions', 'Regions', 'list', 'geographic_region'),
+    Field('topic_category', 'topic_category', 'Topics', 'list'),
+    Field('subject', 'subject', 'Subjects', 'list', 'subject'),
+    Field('resources', 'resources', 'Resources', 'resources'),
+    # Not used when comparing datasets
+    Field('id', 'name', None, 'value'),
+    Field('author_email', 'author_email', None, 'value'),
+    Field('catalog_type', 'catalog_type', None, 'value'),
+    Field('date_published', 'date_published', None, 'value'),
+    Field('endpoint_url', 'endpoint_url', None, 'value'),
+    Field('endpoint_url_fra', 'endpoint_url_fra', None, 'value'),
+    Field('language', 'language', None, 'value'),
+    Field('license_id', 'license_id', None, 'value'),
+    Field('maintenance_and_update_frequency', 'maintenance_and_update_frequency', None, 'value'),
+    Field('owner_org', 'owner_org', None, 'value'),
+    Field('portal_release_date', 'portal_release_date', None, 'value'),
+    Field('ready_to_publish', 'ready_to_publish', None, 'value'),
+    Field('spatial_representation_type', 'spatial_representation_type', None, 'value'),
+    Field('ds_type', 'type', None, 'value'),
+]
+
+# Keys with the same value for every dataset
+DATASET_CONSTANTS = {
+    'attribution': u'Contains information licensed under the Open Government Licence \u2013 Canada.',
+    'attribution_fra': u'Contient des informations autoris\u00e9es sous la Licence du gouvernement ouvert- Canada',
+}
+
+RESOURCE_FIELDS = [
+    Field('name', 'name', 'Name', 'value'),
+    Field('name_fra', 'name_fra', 'Name (FR)', 'value'),
+    Field('url', 'url', 'URL', 'value'),
+    Field('format', 'format', 'Form', 'value'),
+    Field('resource_type', 'resource_type', 'Type', 'value'),
+    Field('size', None, 'Size', 'value'),
+    Field('language', 'language', 'Language', 'value'),
+]
+
+
+def _define(name, lines, namespace):
+    """Compile the source of a function and return it"""
+    exec compile(u'\n'.join(lines), '<{0}>'.format(name), 'exec') in namespace
+    return namespace[name]
+
+
+def _compile_model(fields, constants=None):
+    """Build the as_dict, from_dict, equals, diff_fields and compare methods of a model from its fields.
+
+    as_dict() and equals(), which run for every dataset of a harvest, are generated as source code with one
+    expression per field, so that they are as fast as if they had been written out by hand.
+
+    """
+    namespace = {'_resources_equal': _resources_equal}
+    dict_fields = [f for f in fields if f.key is not None]
+    items = []
+    for f in dict_fields:
+        if f.kind == 'joined':
+            items.append((f.key, u"','.join(self.{0})".format(f.attribute)))
+        elif f.kind != 'resources':
+            items.append((f.key, u'self.{0}'.format(f.attribute)))
+    for key, value in (constants or {}).items():
+        items.append((key, repr(value)))
+    # In key order, so that the dumps keep the same layout as the hand-written as_dict() they replace
+    lines = [u'def as_dict(self):', u'    me = {' + u',\n          '.join(
+        u'{0!r}: {1}'.format(key, expression) for key, expression in sorted(items)) + u'}']
+    for f in dict_fields:
+        if f.kind == 'resources':
+            lines.extend([u'    my_resources = [r.as_dict() for r in self.{0}]'.format(f.attribute),
+                          u'    if len(my_resources) > 0:',
+                          u'        me[{0!r}] = my_resources'.format(f.key)])
+    lines.append(u'    return me')
+    as_dict = _define('as_dict', lines, namespace)
+
+    # Keys read back by from_dict(): the first key of every attribute, e.g. id rather than name
+    readers = {}
+    for f in dict_fields:
+        if f.attribute not in [r.attribute for r in readers.values()]:
+            readers[f.key] = f
+
+    compared = [f for f in fields if f.label is not None]
+    tests = []
+    for f in compared:
+        if f.kind == 'resources':
+            tests.append(u'_resources_equal(self.{0}, other.{0})'.format(f.attribute))
+        else:
+            tests.append(u'self.{0} == other.{0}'.format(f.attribute))
+    equals = _define('equals', [u'def equals(self, other):',
+                                u'    return (' + u' and\n            '.join(tests) + u')'], namespace)
+
+    @classmethod
+    def from_dict(cls, me):
+        """Create a model from the output of as_dict(), e.g. a line of a dump file"""
+        obj = cls()
+        for key, value in me.items():
+            f = readers.get(key)
+            if f is None:
+                continue
+            if f.kind == 'joined':
+                value = value.split(',') if value else []
+            elif f.kind == 'resources':
+                value = [MetadataResourcesModel.from_dict(r) for r in value]
+            setattr(obj, f.attribute, value)
+        return obj
+
+    def diff_fields(self, other):
+        """Return the names of the compared fields that differ between two models"""
+        if equals(self, other):
+            return []
+        fields = []
+        for f in compared:
+            mine = getattr(self, f.attribute)
+            theirs = getattr(other, f.attribute)
+            if f.kind == 'resources':
+                if not _resources_equal(mine, theirs):
+                    fields.append(f.attribute)
+            elif mine != theirs:
+                fields.append(f.attribute)
+        return fields
+
+    def compare(self, other, self_label='Source', other_label='Other'):
+        """Return a line of text for every compared field that differs between two models"""
+        diff_list = []
+        for f in compared:
+            mine = getattr(self, f.attribute)
+            theirs = getattr(other, f.attribute)
+            if f.kind == 'value':
+                if mine != theirs:
+                    diff_list.append(u"{0}: \t{3} [{1}], \t{4} [{2}]".format(f.label, mine, theirs, self_label,
+                                                                              other_label))
+            elif len(mine) != len(theirs):
+                diff_list.append(u"{0}: \tCount {3} - {1}, \tCount {4} - {2}".format(
+                    f.label, len(mine), len(theirs), self_label, other_label))
+            elif f.kind == 'resources':
+                for i, (r, o) in enumerate(zip(mine, theirs)):
+                    if not r.equals(o):
+                        diff_list.append(u"Resource {0} {1}: {2}, {3}: {4}".format(i, self_label, r.url,
+                                                                                   other_label, o.url))
+                        diff_list.extend(r.compare(o, self_label, other_label))
+            elif not compare_list(mine, theirs):
+                diff_list.append(u"{0}: \t{3} - {1}, \t{4} - {2}".format(f.list_label or f.label, mine, theirs,
+                                                                          self_label, other_label))
+        return diff_list
+
+    return as_dict, from_dict, equals, diff_fields, compare
+
+
+def _resources_equal(resources, others):
+    return len(resources) == len(others) and all(r.equals(o) for r, o in zip(resources, others))
+
+
+def compare_list(source, other):
+    return len(source) == len(other) and all(s == o for s, o in zip(source, other))
+
 
 class MetadataDatasetModel():
 
@@ -55,6 +240,9 @@ class MetadataDatasetModel():
     # Class fields
     topic_choices= []
 
+    # Fields compared by equals(), diff_fields() and compare(), in the order of compare()
+    compared_fields = list(f.attribute for f in DATASET_FIELDS if f.label is not None)
+
     def __init__(self):
 
         self.geographic_region = []
@@ -62,238 +250,7 @@ class MetadataDatasetModel():
         self.subject = []
         self.resources = []
 
-    def as_dict(self):
-
-        my_resources = []
-        for r in self.resources:
-            my_resources.append(r.as_dict())
-
-        me = {'attribution': u'Contains information licensed under the Open Government Licence \u2013 Canada.',
-              'attribution_fra': u'Contient des informations autoris\u00e9es sous la Licence du gouvernement ouvert- Canada',
-              'author_email': self.author_email,
-              'browse_graphic_url': self.browse_graphic_url,
-              'catalog_type': self.catalog_type,
-              'data_series_issue_identification': self.data_series_issue_identification,
-              'data_series_issue_identification_fra': self.data_series_issue_identification_fra,
-              'data_series_name': self.data_series_name,
-              'data_series_name_fra': self.data_series_name_fra,
-              'date_published': self.date_published,
-              'digital_object_identifier': self.digital_object_identifier,
-              'endpoint_url': self.endpoint_url,
-              'endpoint_url_fra': self.endpoint_url_fra,
-              'id': self.id,
-              'keywords': ','.join(self.keywords),
-              'keywords_fra': ','.join(self.keywords_fra),
-              'language': self.language,
-              'license_id': self.license_id,
-              'maintenance_and_update_frequency': self.maintenance_and_update_frequency,
-              'name': self.id,
-              'notes': self.notes,
-              'notes_fra': self.notes_fra,
-              'owner_org': self.owner_org,
-              'portal_release_date': self.portal_release_date,
-              'presentation_form': self.presentation_form,
-              'ready_to_publish': self.ready_to_publish,
-              'regions': self.geographic_region,
-              'spatial': self.spatial,
-              'spatial_representation_type': self.spatial_representation_type,
-              'state': self.state,
-              'subject': self.subject,
-              'title': self.title,
-              'title_fra': self.title_fra,
-              'topic_category': self.topic_category,
-              'type': self.ds_type,
-              'url': self.url,
-              'url_fra': self.url_fra}
-        if len(my_resources) > 0:
-            me['resources'] = my_resources
-
-        return me
-
-    def equals(self, other):
-        is_equal = True
-        if self.id != other.id: is_equal = False
-        if self.url != other.url: is_equal = False
-        if self.url_fra != other.url_fra: is_equal = False
-        if self.title != other.title: is_equal = False
-        if self.title_fra != other.title_fra: is_equal = False
-        if self.notes != other.notes: is_equal = False
-        if self.notes_fra != other.notes_fra: is_equal = False
-        if self.date_modified != other.date_modified: is_equal = False
-        if self.data_series_name != other.data_series_name: is_equal = False
-        if self.data_series_name_fra != other.data_series_name_fra: is_equal = False
-        if self.spatial != other.spatial: is_equal = False
-        if self.presentation_form != other.presentation_form: is_equal = False
-        if self.digital_object_identifier != other.digital_object_identifier: is_equal = False
-        if self.data_series_issue_identification != other.data_series_issue_identification: is_equal = False
-        if self.data_series_issue_identification_fra != other.data_series_issue_identification_fra: is_equal = False
-        if self.browse_graphic_url != other.browse_graphic_url: is_equal = False
-        if self.state != other.state: is_equal = False
-
-        if len(self.keywords) == len(other.keywords):
-            if not compare_list(self.keywords, other.keywords):
-                is_equal = False
-        else:
-            is_equal = False
-
-        if len(self.keywords_fra) == len(other.keywords_fra):
-            if not compare_list(self.keywords_fra, other.keywords_fra):
-                is_equal = False
-        else:
-            is_equal = False
-
-        if len(self.geographic_region) == len(other.geographic_region):
-            if not compare_list(self.geographic_region, other.geographic_region):
-                is_equal = False
-        else:
-            is_equal = False
-
-        if len(self.topic_category) == len(other.topic_category):
-            if not compare_list(self.topic_category, other.topic_category):
-                is_equal = False
-        else:
-            is_equal = False
-
-        if len(self.subject) == len(other.subject):
-            if not compare_list(self.subject, other.subject):
-                is_equal = False
-        else:
-            is_equal = False
-
-        if len(self.resources) == len(other.resources):
-            for i in range(0, len(self.resources) - 1):
-                if not self.resources[i].equals(other.resources[i]):
-                    is_equal = False
-                    break
-        else:
-            is_equal = False
-
-        return is_equal
-
-    def compare(self, other, self_label='Source', other_label='Other'):
-        diff_list = []
-        if self.id != other.id:
-            diff_list.append(u"ID: \t{2} [{0}], \t{3} [{1}]".format(self.id, other.id, self_label, other_label))
-        if self.url!= other.url:
-            diff_list.append(u"URL: \t{2} [{0}], \t{3} [{1}]".format(self.url, other.url, self_label, other_label))
-        if self.url_fra != other.url_fra:
-            diff_list.append(u"URL (FR): \t{2} [{0}], \t{3} [{1}]".format(self.url_fra, other.url_fra, 
-                                                                          self_label, other_label))
-        if self.title != other.title:
-            diff_list.append(u"Title: \t{2} [{0}], \t{3} [{1}]".format(self.title, other.title, 
-                                                                       self_label, other_label))
-        if self.title_fra != other.title_fra:
-            diff_list.append(u"Title (FR): \t{2} [{0}], \t{3} [{1}]".format(self.title_fra, other.title_fra, 
-                                                                            self_label, other_label))
-        if self.notes != other.notes:
-            diff_list.append(u"Notes: \t{2} [{0}], \t{3} [{1}]".format(self.notes, other.notes, 
-                                                                       self_label, other_label))
-        if self.notes_fra != other.notes_fra:
-            diff_list.append(u"Notes (FR): \t{2} [{0}], \t{3} [{1}]".format(self.notes_fra, other.notes_fra, 
-                                                                            self_label, other_label))
-        if self.date_modified != other.date_modified:
-            diff_list.append(u"Date: \t{2} [{0}], \t{3} [{1}]".format(self.date_modified, other.date_modified, 
-                                                                      self_label, other_label))
-        if self.data_series_name != other.data_series_name:
-            diff_list.append(u"DSN: \t{2} [{0}], \t{3} [{1}]".format(self.data_series_name,
-                                                                     other.data_series_name,
-                                                                     self_label, other_label))
-        if self.data_series_name_fra != other.data_series_name_fra:
-            diff_list.append(u"DSN (FR): \t{2} [{0}], \t{3} [{1}]".format(self.data_series_name_fra,
-                                                                          other.data_series_name_fra,
-                                                                          self_label, other_label))
-        if self.spatial != other.spatial:
-            diff_list.append(u"Spatial: \t{2} [{0}], \t{3} [{1}]".format(self.spatial, other.spatial, 
-                                                                         self_label, other_label))
-        if self.presentation_form != other.presentation_form:
-            diff_list.append(u"PForm: \t{2} [{0}], \t{3} [{1}]".format(self.presentation_form,
-                                                                       other.presentation_form,
-                                                                       self_label, other_label))
-        if self.digital_object_identifier != other.digital_object_identifier:
-            diff_list.append(u"DOI: \t{2} [{0}], \t{3} [{1}]".format(self.digital_object_identifier,
-                                                                     other.digital_object_identifier,
-                                                                     self_label, other_label))
-        if self.data_series_issue_identification != other.data_series_issue_identification:
-            diff_list.append(u"DSII: \t{2} [{0}], \t{3} [{1}]".format(self.data_series_issue_identification,
-                                                                      other.data_series_issue_identification,
-                                                                      self_label, other_label))
-        if self.data_series_issue_identification_fra != other.data_series_issue_identification_fra :
-            diff_list.append(u"DSII (FR): \t{2} [{0}], \t{3} [{1}]".format(
-                self.data_series_issue_identification_fra, other.data_series_issue_identification_fra, 
-                self_label, other_label))
-        if self.browse_graphic_url != other.browse_graphic_url:
-            diff_list.append(u"Graphic: \t{2} [{0}], \t{3} [{1}]".format(self.browse_graphic_url,
-                                                                         other.browse_graphic_url,
-                                                                         self_label, other_label))
-        if self.state != other.state:
-            diff_list.append(u"State: \t{2} [{0}], \t{3} [{1}]".format(self.state, other.state))
-            
-        if not len(self.keywords) == len(other.keywords):
-            diff_list.append(u"Keywords: \tCount {2} - {0}, \tCount {3} - {1}".format(len(self.keywords),
-                                                                                      len(other.keywords),
-                                                                                      self_label, other_label))
-        else:
-            if not compare_list(self.keywords, other.keywords):
-                diff_list.append(u"Keywords: \t{2} - {0}, \t{3} - {1}".format(self.keywords,
-                                                                              other.keywords,
-                                                                              self_label, other_label))
-        if not len(self.keywords_fra) == len(other.keywords_fra):
-            diff_list.append(u"Keywords (FR): \tCount {2} - {0}, \tCount {3} - {1}".format(len(self.keywords_fra),
-                                                                                           len(other.keywords_fra),
-                                                                                           self_label, other_label))
-        elif not compare_list(self.keywords_fra, other.keywords_fra):
-            diff_list.append(u"Keywords FR: \t{2} - {0}, \t{3} - {1}".format(self.keywords_fra,
-                                                                             other.keywords_fra,
-                                                                             self_label, other_label))            
-        if not len(self.geographic_region) == len(other.geographic_region):
-            diff_list.append(u"Regions: \tCount {2} - {0}, \tCount {3} - {1}".format(len(self.geographic_region),
-                                                                                     len(other.geographic_region),
-                                                                                     self_label, other_label))
-        elif not compare_list(self.geographic_region, other.geographic_region):
-                diff_list.append(u"geographic_region: \t{2} - {0}, \t{3} - {1}".format(self.geographic_region,
-                                                                                       other.geographic_region,
-                                                                                       self_label, other_label))
-        if not len(self.topic_category) == len(other.topic_category):
-            diff_list.append(u"Topics: \tCount {2} - {0}, \tCount {3} - {1}".format(len(self.topic_category),
-                                                                                    len(other.topic_category),
-                                                                                    self_label, other_label))
-        elif not compare_list(self.topic_category, other.topic_category):
-                diff_list.append(u"Topics: \t{2} - {0}, \t{3} - {1}".format(self.topic_category,
-                                                                            other.topic_category,
-                                                                            self_label, other_label))
-        if not len(self.subject) == len(other.subject):
-            diff_list.append(u"Subjects: \tCount {2} - {0}, \tCount {3} - {1}".format(len(self.subject),
-                                                                                      len(other.subject),
-                                                                                      self_label, other_label))
-        elif not compare_list(self.subject, other.subject):
-                diff_list.append(u"subject: \t{2} - {0}, \t{3} - {1}".format(self.subject,
-                                                                             other.subject,
-                                                                             self_label, other_label))
-        if not len(self.resources) == len(other.resources):
-            diff_list.append(u"Resources: \tCount {2} - {0}, \tCount {3} - {1}".format(len(self.resources),
-                                                                                       len(other.resources),
-                                                                                       self_label, other_label))
-        else:
-            for i in range(0, len(self.resources) - 1):
-                if not self.resources[i].equals(other.resources[i]):
-                    diff_list.append(u"Resource {0} {1}: {2}, {3}: {4}".format(i, self_label,
-                                                                               self.resources[i].url,
-                                                                               other_label,
-                                                                               other.resources[i].url)
-                                     )
-                    res_diffs = self.resources[i].compare(other.resources[i], self_label, other_label)
-                    for rf in res_diffs:
-                        diff_list.append(rf)
-        return diff_list
-
-
-def compare_list(source, other):
-    list_equal = True
-    for i in range(0, len(source) - 1):
-        if source[i] != other[i]:
-            list_equal = False
-            break
-    return list_equal
+    as_dict, from_dict, equals, diff_fields, compare = _compile_model(DATASET_FIELDS, DATASET_CONSTANTS)
 
 
 class MetadataResourcesModel():
@@ -319,53 +276,4 @@ class MetadataResourcesModel():
         self.size = res_size
         self.language = res_language
 
-
-    def as_dict(self):
-        me = {}
-        me['format'] = self.format
-        me['name'] = self.name
-        me['name_fra'] = self.name_fra
-        me['language'] = self.language
-        me['url'] = self.url
-        me['resource_type'] = self.resource_type
-        return me
-
-    def equals(self, other):
-
-        if self.name != other.name or \
-            self.name_fra != other.name_fra or \
-            self.url != other.url or \
-            self.format != other.format or \
-            self.resource_type != other.resource_type or \
-            self.size != other.size or \
-            self.language != other.language:
-            return False
-        else:
-            return True
-
-    def compare(self, other, self_label='Source', other_label='Other'):
-
-        diff_list = []
-        if self.name != other.name:
-            diff_list.append(u"Name: \t{2} [{0}], \t{3} [{1}]".format(self.name, other.name, self_label,
-                                                                           other_label))
-        if self.name_fra != other.name_fra:
-            diff_list.append(u"Name (FR): \t{2} [{0}], \t{3} [{1}]".format(self.name_fra, other.name_fra,
-                                                                                self_label, other_label))
-        if self.url != other.url:
-            diff_list.append(u"URL: \t{2} [{0}], \t{3} [{1}]".format(self.url, other.url, self_label,
-                                                                          other_label))
-        if self.format != other.format:
-            diff_list.append(u"Form: \t{2} [{0}], \t{3} [{1}]".format(self.format, other.format, self_label,
-                                                                           other_label))
-        if self.resource_type != other.resource_type:
-            diff_list.append(u"Type: \t{2} [{0}], \t{3} [{1}]".format(self.resource_type, other.resource_type,
-                                                                           self_label, other_label))
-        if self.size != other.size:
-            diff_list.append(u"Size: \t{2} [{0}], \t{3} [{1}]".format(self.size, other.size, self_label,
-                                                                           other_label))
-        if self.language != other.language:
-            diff_list.append(u"Language: \t{2} [{0}], \t{3} [{1}]".format(self.language, other.language,
-                                                                               self_label, other_label))
-        return diff_list
-
+    as_dict, from_dict, equals, diff_fields, compare = _compile_model(RESOURCE_FIELDS)
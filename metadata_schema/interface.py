@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import logging
@@ -31,7 +32,11 @@ class MetadataSchema(object):
     """
     def __init__(self):
         with open(_JSON_NAME) as j:
-            schema = json.load(j)
+            raw_schema = j.read()
+        schema = json.loads(raw_schema)
+
+        # Changes whenever schema.json changes, e.g. to invalidate converted records
+        self.digest = hashlib.sha1(raw_schema).hexdigest()
 
         # make markdown less noisy
         markdown_log = logging.getLogger('MARKDOWN')
@@ -0,0 +1,209 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import logging
+import os
+import simplejson as json
+import socket
+import threading
+import time
+
+from contextlib import contextmanager
+from harvester_config import get_config
+
+# Upper bounds, in seconds, of the histogram buckets: from a cached HTTP response to a slow CSW request
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+class StatsdClient(object):
+    """Sends metrics to a StatsD server over UDP. Label values are appended to the metric name."""
+
+    def __init__(self, host, port=8125, prefix='harvester'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, name, labels, value, metric_type):
+        parts = [self.prefix, name] + [str(labels[k]).replace('.', '_') for k in sorted(labels)]
+        try:
+            self.socket.sendto('{0}:{1}|{2}'.format('.'.join(parts), value, metric_type), self.address)
+        except socket.error, e:
+            logging.debug('StatsD: {0}'.format(e))
+
+
+class Metrics(object):
+    """Counters, gauges and histograms of a harvester run, with optional trace spans.
+
+    Metrics are identified by a name and labels, e.g. records_total{source="gr",stage="scan",outcome="saved"}.
+    They are written as a Prometheus text file (for the node exporter textfile collector) by flush(), at most
+    once every `flush_interval` seconds unless forced, and sent to StatsD as they are recorded if a client is
+    given. Spans time a block of code into the <name>_seconds histogram; with a trace file, every span is
+    also written to it as a JSON line, with the id of the record it belongs to.
+
+    """
+
+    def __init__(self, prefix='harvester', prometheus_file=None, statsd=None, trace_file=None, flush_interval=15):
+        self.prefix = prefix
+        self.prometheus_file = prometheus_file
+        self.statsd = statsd
+        self.flush_interval = flush_interval
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        self._trace = open(trace_file, 'a') if trace_file else None
+        self._spans = threading.local()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        if self.statsd is not None:
+            self.statsd.send(name, labels, value, 'c')
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+        if self.statsd is not None:
+            self.statsd.send(name, labels, value, 'g')
+
+    def observe(self, name, seconds, **labels):
+        """Add a duration to a histogram"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            counts = histogram[0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+                    break
+            histogram[1] += seconds
+            histogram[2] += 1
+        if self.statsd is not None:
+            self.statsd.send(name, labels, int(seconds * 1000), 'ms')
+
+    @contextmanager
+    def span(self, name, record_id=None, **labels):
+        """Time a block into the <name>_seconds histogram and, when tracing, write it to the trace file"""
+        stack = getattr(self._spans, 'stack', None)
+        if stack is None:
+            stack = self._spans.stack = []
+        parent = stack[-1] if stack else None
+        if record_id is None and parent is not None:
+            record_id = parent[1]
+        stack.append((name, record_id))
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            stack.pop()
+            self.observe(name + '_seconds', elapsed, **labels)
+            if self._trace is not None:
+                self._write_span(name, record_id, parent, start, elapsed, labels)
+
+    def _write_span(self, name, record_id, parent, start, elapsed, labels):
+        line = json.dumps({'span': name, 'record': record_id, 'parent': parent[0] if parent else None,
+                           'thread': threading.current_thread().name, 'start': start,
+                           'ms': round(elapsed * 1000, 3), 'labels': labels})
+        with self._lock:
+            self._trace.write(line + '\n')
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for metric_type, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(set(name for name, labels in metrics)):
+                    lines.append('# TYPE {0}_{1} {2}'.format(self.prefix, name, metric_type))
+                    for key in sorted(k for k in metrics if k[0] == name):
+                        lines.append('{0}_{1}{2} {3}'.format(self.prefix, name, _labels(key[1]), metrics[key]))
+            for name in sorted(set(name for name, labels in self.histograms)):
+                lines.append('# TYPE {0}_{1} histogram'.format(self.prefix, name))
+                for key in sorted(k for k in self.histograms if k[0] == name):
+                    counts, total, count = self.histograms[key]
+                    cumulative = 0
+                    for bound, bucket_count in zip(BUCKETS, counts):
+                        cumulative += bucket_count
+                        lines.append('{0}_{1}_bucket{2} {3}'.format(self.prefix, name,
+                                                                   _labels(key[1], ('le', repr(bound))), cumulative))
+                    lines.append('{0}_{1}_bucket{2} {3}'.format(self.prefix, name, _labels(key[1], ('le', '+Inf')),
+                                                               count))
+                    lines.append('{0}_{1}_sum{2} {3!r}'.format(self.prefix, name, _labels(key[1]), total))
+                    lines.append('{0}_{1}_count{2} {3}'.format(self.prefix, name, _labels(key[1]), count))
+        return '\n'.join(lines) + '\n'
+
+    def flush(self, force=True):
+        """Write the Prometheus text file, if one is configured, unless it was written less than
+        flush_interval seconds ago and `force` is False"""
+        if self._trace is not None:
+            with self._lock:
+                self._trace.flush()
+        if self.prometheus_file is None:
+            return
+        if not force and time.time() - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = time.time()
+        # Write to a temporary file first, so that the collector never reads a partial file
+        temp_path = '{0}.{1}.tmp'.format(self.prometheus_file, os.getpid())
+        try:
+            with open(temp_path, 'w') as f:
+                f.write(self.prometheus_text())
+            os.rename(temp_path, self.prometheus_file)
+        except (IOError, OSError), e:
+            logging.error('Unable to write metrics to {0}: {1}'.format(self.prometheus_file, e))
+
+    def close(self):
+        self.flush()
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+
+def _labels(labels, extra=None):
+    items = list(labels)
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in items) + '}'
+
+
+def get_metrics():
+    """Return the process-wide metrics, configured in the [metrics] section of harvester.ini:
+    metrics.prometheus_file, metrics.statsd_host, metrics.statsd_port (8125), metrics.prefix (harvester),
+    metrics.trace_file and metrics.flush_interval (15 seconds)"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            config = get_config()
+            prefix = config.get('metrics', 'metrics.prefix', 'harvester')
+            statsd = None
+            statsd_host = config.get('metrics', 'metrics.statsd_host', '')
+            if statsd_host:
+                statsd = StatsdClient(statsd_host, config.getint('metrics', 'metrics.statsd_port', 8125), prefix)
+            _metrics = Metrics(prefix,
+                               prometheus_file=config.get('metrics', 'metrics.prometheus_file', '') or None,
+                               statsd=statsd,
+                               trace_file=config.get('metrics', 'metrics.trace_file', '') or None,
+                               flush_interval=config.getfloat('metrics', 'metrics.flush_interval', 15))
+        return _metrics
+
+
+def reset_metrics():
+    """Write and forget the process-wide metrics, e.g. after the configuration has been reloaded"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is not None:
+            _metrics.close()
+        _metrics = None
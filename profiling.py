@@ -0,0 +1,201 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import cProfile
+import functools
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from metrics import get_metrics
+
+# The functions where a harvest spends its time, timed by --profile-functions=hot
+HOT_FUNCTIONS = [
+    'ec_dataset_factory:MetadataDatasetModelECFactory.create_model_from_record',
+    'ec_dataset_factory:MetadataDatasetModelECFactory.convert_nap_xml',
+    'ec_dataset_factory:MetadataDatasetModelECFactory._get_first_text',
+    'geogratis_dataset_factory:MetadataDatasetModelGeogratisFactory.create_model_from_record',
+    'geogratis_dataset_factory:MetadataDatasetModelGeogratisFactory.convert_geogratis_json',
+    'converter:convert_records',
+    'db_schema:upsert_unique_records',
+    'harvest_sources:_save_batch',
+    'gr_scanner:get_geogratis_rec',
+]
+
+
+def add_profile_arguments(argparser):
+    argparser.add_argument('--profile', action='store', default=None, dest='profile',
+                           help='Profile the run and write the profile to this file')
+    argparser.add_argument('--profile-mode', action='store', default='cprofile', dest='profile_mode',
+                           choices=['cprofile', 'sample'],
+                           help='cprofile writes a pstats file of the main thread (default); sample samples the '
+                                'stacks of all the threads, including the fetch workers of the scanners, and '
+                                'writes them in the collapsed format of flamegraph.pl and speedscope')
+    argparser.add_argument('--profile-interval', action='store', type=float, default=5, dest='profile_interval',
+                           help='Milliseconds between two samples of the sample mode (default: 5)')
+    argparser.add_argument('--profile-functions', action='store', default='', dest='profile_functions',
+                           help='Time every call of these functions: "hot" or a comma separated list of '
+                                'module:function or module:Class.method')
+
+
+class StackSampler(object):
+    """Samples the stacks of all the threads every `interval` seconds from a background thread.
+
+    Unlike cProfile, the overhead does not grow with the number of calls, so it can be left on for a full
+    harvest. Samples are counted by stack and written in the collapsed format: one line per stack, with the
+    frames from the outermost separated by semicolons, followed by the number of samples.
+
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='StackSampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.current_thread().ident
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                        code.co_firstlineno))
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write('{0} {1}\n'.format(stack, count))
+
+
+class FunctionTimer(object):
+    """Times every call of a set of functions, patched in place, into the function_seconds histogram"""
+
+    def __init__(self):
+        self.calls = defaultdict(list)
+        self._lock = threading.Lock()
+        self._patches = []
+
+    def _wrap(self, name, f):
+        metrics = get_metrics()
+
+        @functools.wraps(f)
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                metrics.observe('function_seconds', elapsed, function=name)
+                with self._lock:
+                    self.calls[name].append(elapsed)
+        timed._profiled = f
+        return timed
+
+    def patch(self, spec):
+        """Time the function given as module:function or module:Class.method"""
+        module_name, _, path = spec.partition(':')
+        for module in _modules(module_name):
+            owner = module
+            parts = path.split('.')
+            for part in parts[:-1]:
+                owner = getattr(owner, part)
+            attr = parts[-1]
+            original = vars(owner).get(attr)
+            if original is None:
+                raise ValueError('Unable to profile {0}: not found'.format(spec))
+            if getattr(original, '_profiled', None) is not None:
+                continue
+            wrapped = self._wrap(spec, original)
+            self._replace(owner, attr, original, wrapped)
+            if owner is module:
+                # Modules that imported the function with "from module import function" hold their own reference
+                for other in list(sys.modules.values()):
+                    if other is not None and other is not module and getattr(other, attr, None) is original:
+                        self._replace(other, attr, original, wrapped)
+
+    def _replace(self, owner, attr, original, wrapped):
+        setattr(owner, attr, wrapped)
+        self._patches.append((owner, attr, original))
+
+    def restore(self):
+        for owner, attr, original in reversed(self._patches):
+            setattr(owner, attr, original)
+        self._patches = []
+
+    def report(self, out=sys.stderr):
+        out.write('{0:<90} {1:>8} {2:>10} {3:>9} {4:>9}\n'.format('function', 'calls', 'total s', 'p50 ms',
+                                                                    'p99 ms'))
+        for name, timings in sorted(self.calls.items(), key=lambda item: -sum(item[1])):
+            timings = sorted(timings)
+            out.write('{0:<90} {1:8} {2:10.3f} {3:9.3f} {4:9.3f}\n'.format(
+                name, len(timings), sum(timings), timings[len(timings) // 2] * 1000,
+                timings[int(round(0.99 * (len(timings) - 1)))] * 1000))
+
+
+def _modules(module_name):
+    """The module, and the script being run if it is the same file: a script run as "python converter.py"
+    is the __main__ module, and may be imported a second time under its own name"""
+    module = importlib.import_module(module_name)
+    modules = [module]
+    main = sys.modules.get('__main__')
+    main_file = getattr(main, '__file__', None)
+    if main is not None and main_file and \
+            os.path.splitext(os.path.abspath(main_file))[0] == os.path.splitext(os.path.abspath(module.__file__))[0]:
+        modules.append(main)
+    return modules
+
+
+@contextmanager
+def profiled(args):
+    """Run a block under the profiler and function timers selected by the add_profile_arguments() options"""
+    timer = None
+    if args.profile_functions:
+        timer = FunctionTimer()
+        specs = HOT_FUNCTIONS if args.profile_functions == 'hot' else args.profile_functions.split(',')
+        for spec in specs:
+            timer.patch(spec.strip())
+
+    profiler = None
+    sampler = None
+    if args.profile and args.profile_mode == 'sample':
+        sampler = StackSampler(args.profile_interval / 1000.0)
+        sampler.start()
+    elif args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            logging.info('Profile written to {0}'.format(args.profile))
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(args.profile)
+            logging.info('Stack samples written to {0}'.format(args.profile))
+        if timer is not None:
+            timer.restore()
+            timer.report()
+            get_metrics().flush()
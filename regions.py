@@ -0,0 +1,49 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import hashlib
+import os
+import simplejson as json
+
+from geometry import bbox, bounds_intersect, intersects_bounds
+from metadata_schema import schema_description
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+REGIONS_FILE = os.path.join(_HERE, 'regions.geojson')
+
+
+class RegionFinder(object):
+    """Finds the Open Data geographic regions (provinces and territories) that a footprint falls in.
+
+    The polygons of regions.geojson are coarse outlines, with a few vertices each, so a footprint close to a
+    border may be placed in both regions. They are only meant to fill in geographic_region for records that
+    have no place names.
+
+    """
+
+    def __init__(self, path=REGIONS_FILE):
+        # Census divisions can share the name of their province or territory, which is listed first
+        region_keys = {}
+        for r in schema_description.dataset_field_by_id['geographic_region']['choices']:
+            region_keys.setdefault(r['eng'], r['key'])
+        with open(path) as regions_file:
+            raw_regions = regions_file.read()
+        features = json.loads(raw_regions)['features']
+
+        # Changes whenever the region outlines change, e.g. to invalidate converted records
+        self.digest = hashlib.sha1(raw_regions).hexdigest()
+        self.regions = []
+        for feature in features:
+            name = feature['properties']['name']
+            self.regions.append((region_keys[name], bbox(feature['geometry']), feature['geometry']))
+
+    def find_regions(self, bounds):
+        """Return the keys of the regions that intersect a (west, south, east, north) bounding box"""
+        return [key for key, region_bounds, geometry in self.regions
+                if bounds_intersect(region_bounds, bounds) and intersects_bounds(geometry, bounds)]
+
+    def find_regions_for_geometry(self, geometry):
+        bounds = bbox(geometry) if geometry else None
+        if bounds is None:
+            return []
+        return self.find_regions(bounds)
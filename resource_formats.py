@@ -0,0 +1,114 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import hashlib
+import logging
+import os
+import re
+import simplejson as json
+
+from harvester_config import get_config
+from metadata_schema import schema_description
+from urlparse import urlparse
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+FORMATS_FILE = os.path.join(_HERE, 'resource_formats.json')
+
+_EXTENSION = re.compile(u'\\.([a-z0-9]+)$')
+
+
+class FormatDetector(object):
+    """Maps resource format names, file names and URLs to the Open Data resource formats.
+
+    The aliases of each format are the key, English label and replaced labels of schema.json, plus the
+    format names, file extensions and MIME types of the alias files. All the aliases that may appear in free
+    text are compiled into a single alternation, longest first, so that a name is scanned once. Results are
+    remembered for up to `memo_size` distinct inputs; the memo is emptied when it is full.
+
+    """
+
+    def __init__(self, alias_files=(FORMATS_FILE,), memo_size=10000):
+        self.memo_size = memo_size
+        self._memo = {}
+        self.keys = set()
+        self.aliases = {}
+        self.extensions = {}
+        not_in_text = set()
+        for f in schema_description.resource_field_by_id['format']['choices']:
+            self.keys.add(f['key'])
+            for name in [f['key'], f.get('eng', f['key'])] + f.get('replaces', []):
+                self.aliases[name.lower()] = f['key']
+        for path in alias_files:
+            with open(path) as alias_file:
+                formats = json.load(alias_file)
+            for table, values in ((self.aliases, formats.get('names', {})),
+                                  (self.aliases, formats.get('mime_types', {})),
+                                  (self.extensions, formats.get('extensions', {}))):
+                for alias, key in values.items():
+                    if key not in self.keys:
+                        logging.warning(u'{0}: unknown resource format {1} for {2}'.format(path, key, alias))
+                        continue
+                    table[alias.lower()] = key
+            not_in_text.update(formats.get('not_in_text', []))
+
+        self.text_aliases = dict((alias, key) for alias, key in self.aliases.items() if alias not in not_in_text)
+        for extension, key in self.extensions.items():
+            if extension not in not_in_text:
+                self.text_aliases.setdefault(extension, key)
+        alternation = u'|'.join(re.escape(alias) for alias in sorted(self.text_aliases, key=len, reverse=True))
+        self._pattern = re.compile(u'(?<![a-z0-9])(?:{0})(?![a-z0-9])'.format(alternation), re.UNICODE)
+
+        # Changes whenever the merged aliases change, e.g. to invalidate converted records
+        self.digest = hashlib.sha1(json.dumps([self.aliases, self.extensions, sorted(self.text_aliases)],
+                                              sort_keys=True)).hexdigest()
+
+    def lookup(self, name):
+        """Return the format key of an exact format name or MIME type, ignoring case, or None"""
+        if not name:
+            return None
+        return self.aliases.get(name.strip().lower())
+
+    def search(self, text):
+        """Return the format key of the first format alias that appears as a word in a text, or None"""
+        if not text:
+            return None
+        match = self._pattern.search(text.lower())
+        return self.text_aliases[match.group()] if match else None
+
+    def detect(self, name, url=None, default='other'):
+        """Guess the format of a resource from its name and URL.
+
+        The extension of the URL path is the strongest hint, then a format named in the resource name, then
+        one named anywhere in the URL, e.g. a service=WMS parameter.
+
+        """
+        memo_key = (name, url, default)
+        try:
+            return self._memo[memo_key]
+        except KeyError:
+            pass
+        key = None
+        if url:
+            match = _EXTENSION.search(urlparse(url).path.lower())
+            if match:
+                key = self.extensions.get(match.group(1))
+        if key is None:
+            key = self.search(name)
+        if key is None:
+            key = self.search(url)
+        if key is None:
+            key = default
+        if len(self._memo) >= self.memo_size:
+            self._memo.clear()
+        self._memo[memo_key] = key
+        return key
+
+
+def create_format_detector():
+    """Create the FormatDetector of the shipped resource_formats.json, extended with the aliases of the file
+    in the formats.aliases_file option of the [formats] section of harvester.ini, if any"""
+    alias_files = [FORMATS_FILE]
+    extra = get_config().get('formats', 'formats.aliases_file', '')
+    if extra:
+        alias_files.append(extra)
+    return FormatDetector(alias_files)
@@ -0,0 +1,62 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import logging
+import simplejson as json
+
+from db_schema import Settings, get_setting, save_setting
+from harvester_config import get_config
+
+
+class ScanCheckpoint:
+    """Durable cursor of a long running scan, stored as JSON in the settings table (e.g. gr_scan_cursor).
+
+    The cursor holds the position to continue from (a feed page URL, a CSW record position, ...) and the
+    ids that were listed but not yet saved at that position. The scanner reports its progress with advance()
+    after saving records; the cursor is only written to the database every `interval` records.
+
+    """
+
+    def __init__(self, scan_name, interval=None):
+        self.setting_name = '{0}_cursor'.format(scan_name)
+        if interval is None:
+            interval = get_config().getint('harvester', 'harvester.checkpoint_interval', 100)
+        self.interval = max(interval, 1)
+        self.position = None
+        self.pending = []
+        self._unsaved = 0
+
+    def load(self):
+        """Read the saved cursor. Returns False if there is nothing to resume from."""
+        setting = get_setting(self.setting_name, refresh=True)
+        if not setting.setting_value:
+            return False
+        cursor = json.loads(setting.setting_value)
+        self.position = cursor['position']
+        self.pending = cursor['pending']
+        return True
+
+    def advance(self, position, pending, records=1):
+        self.position = position
+        self.pending = list(pending)
+        self._unsaved += records
+        if self._unsaved >= self.interval:
+            self.save()
+
+    def flush(self):
+        """Save any progress reported since the last checkpoint, e.g. when the scan is failing"""
+        if self._unsaved > 0:
+            self.save()
+
+    def save(self):
+        cursor = json.dumps({'position': self.position, 'pending': self.pending})
+        save_setting(Settings(setting_name=self.setting_name, setting_value=cursor))
+        self._unsaved = 0
+        logging.info('Checkpoint {0}: {1}, {2} pending'.format(self.setting_name, self.position, len(self.pending)))
+
+    def clear(self):
+        """Forget the cursor once the scan has completed"""
+        save_setting(Settings(setting_name=self.setting_name, setting_value=None))
+        self.position = None
+        self.pending = []
+        self._unsaved = 0
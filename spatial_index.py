@@ -0,0 +1,174 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import argparse
+import logging
+import math
+import simplejson as json
+
+from datetime import datetime
+from db_schema import DatasetExtent, Packages, close_session, connect_to_database, find_record_by_uuid, \
+                      upsert_unique_records
+from geometry import bbox, bounds_intersect
+from harvester_config import add_config_argument, load_config
+from profiling import add_profile_arguments, profiled
+
+argparser = argparse.ArgumentParser(
+    description='Find the harvested datasets whose footprint intersects a bounding box'
+)
+argparser.add_argument('-b', '--bbox', action='append', default=[], dest='bbox',
+                       help='Bounding box as west,south,east,north (e.g. --bbox=-80,45,-75,50). May be repeated.')
+argparser.add_argument('-t', '--type', action='store', default=None, dest='scan_type',
+                       help='Only find datasets of one type of harvest: e.g. ec or gr')
+argparser.add_argument('--rebuild', action='store_true', default=False, dest='rebuild',
+                       help='Rebuild the extents of all the converted datasets from package_updates')
+add_config_argument(argparser)
+add_profile_arguments(argparser)
+
+
+class ExtentIndex(object):
+    """In-memory grid index of dataset bounding boxes.
+
+    Each dataset is listed in every `cell_size` degree cell that its bounding box covers. A query only
+    compares the bounding boxes listed in the cells it covers.
+
+    """
+
+    def __init__(self, cell_size=5.0):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.bounds = {}
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def _cells(self, bounds):
+        west, south, east, north = bounds
+        for x in xrange(int(math.floor(west / self.cell_size)), int(math.floor(east / self.cell_size)) + 1):
+            for y in xrange(int(math.floor(south / self.cell_size)), int(math.floor(north / self.cell_size)) + 1):
+                yield x, y
+
+    def insert(self, uuid, bounds):
+        self.bounds[uuid] = bounds
+        for cell in self._cells(bounds):
+            self.cells.setdefault(cell, []).append(uuid)
+
+    def query(self, bounds):
+        """Return the sorted ids of the datasets whose bounding box intersects `bounds`"""
+        found = set()
+        for cell in self._cells(bounds):
+            for uuid in self.cells.get(cell, []):
+                if uuid not in found and bounds_intersect(self.bounds[uuid], bounds):
+                    found.add(uuid)
+        return sorted(found)
+
+
+def save_extent(session, uuid, source, bounds):
+    """Add or update the extent of a dataset in the session, or delete it if bounds is None. Does not commit."""
+    extent = find_record_by_uuid(session, uuid, query_class=DatasetExtent)
+    if bounds is None:
+        if extent is not None:
+            session.delete(extent)
+        return
+    if extent is None:
+        extent = DatasetExtent(uuid=uuid)
+        session.add(extent)
+    extent.source = source
+    extent.west, extent.south, extent.east, extent.north = bounds
+    extent.updated = datetime.now()
+
+
+def save_extents(session, source, extents):
+    """Write the extents of a batch of datasets, given as {uuid: bounds}. A bounds of None deletes the extent
+    of its dataset. Does not commit."""
+    removed = [uuid for uuid, bounds in extents.items() if bounds is None]
+    if len(removed) > 0:
+        session.query(DatasetExtent).filter(DatasetExtent.uuid.in_(removed)).delete(synchronize_session=False)
+    now = datetime.now()
+    upsert_unique_records(session, DatasetExtent, [
+        {'uuid': uuid, 'source': source, 'west': bounds[0], 'south': bounds[1], 'east': bounds[2],
+         'north': bounds[3], 'updated': now} for uuid, bounds in extents.items() if bounds is not None])
+
+
+def spatial_bounds(spatial):
+    """Return the bounding box of a `spatial` field, or None if it is empty or not valid GeoJSON"""
+    if not spatial:
+        return None
+    try:
+        return bbox(json.loads(spatial))
+    except (ValueError, KeyError, TypeError, AttributeError), e:
+        logging.warning('Invalid spatial field: {0}'.format(e))
+        return None
+
+
+def find_datasets(session, bounds, source=None):
+    """Return the sorted ids of the datasets whose bounding box intersects `bounds`, using the database index"""
+    west, south, east, north = bounds
+    query = session.query(DatasetExtent.uuid).filter(DatasetExtent.west <= east).\
+        filter(DatasetExtent.east >= west).\
+        filter(DatasetExtent.south <= north).\
+        filter(DatasetExtent.north >= south)
+    if source is not None:
+        query = query.filter(DatasetExtent.source == source)
+    return sorted(uuid for uuid, in query)
+
+
+def load_extent_index(session, source=None, cell_size=5.0):
+    """Build an ExtentIndex of all the dataset extents, e.g. to answer many queries"""
+    index = ExtentIndex(cell_size)
+    query = session.query(DatasetExtent.uuid, DatasetExtent.west, DatasetExtent.south, DatasetExtent.east,
+                          DatasetExtent.north)
+    if source is not None:
+        query = query.filter(DatasetExtent.source == source)
+    for uuid, west, south, east, north in query.yield_per(1000):
+        index.insert(uuid, (west, south, east, north))
+    return index
+
+
+def rebuild_extents(session):
+    """Recompute the extents of every converted dataset from the spatial field of its package update"""
+    session.query(DatasetExtent).delete()
+    session.commit()
+    last_id = 0
+    count = 0
+    while True:
+        packages = session.query(Packages).filter(Packages.id > last_id).order_by(Packages.id).limit(1000).all()
+        if len(packages) == 0:
+            break
+        for package in packages:
+            last_id = package.id
+            if not package.ckan_json:
+                continue
+            bounds = spatial_bounds(json.loads(package.ckan_json).get('spatial'))
+            if bounds is not None:
+                save_extent(session, package.uuid, package.source, bounds)
+                count += 1
+            # Flush so that a later package update of the same dataset finds this extent
+            session.flush()
+        session.commit()
+    return count
+
+
+def parse_bbox(text):
+    west, south, east, north = [float(v) for v in text.split(',')]
+    return west, south, east, north
+
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    load_config(args.config)
+    session = connect_to_database()
+
+    with profiled(args):
+        if args.rebuild:
+            print 'Rebuilt the extents of {0} datasets'.format(rebuild_extents(session))
+        if len(args.bbox) == 1:
+            for uuid in find_datasets(session, parse_bbox(args.bbox[0]), args.scan_type):
+                print uuid
+        elif len(args.bbox) > 1:
+            # Load the extents once rather than querying the database for every bounding box
+            index = load_extent_index(session, args.scan_type)
+            for text in args.bbox:
+                for uuid in index.query(parse_bbox(text)):
+                    print '{0}\t{1}'.format(text, uuid)
+    close_session()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from csw_client import CswClient
+from lxml import etree
+from multiprocessing.pool import ThreadPool
+from SocketServer import ThreadingMixIn
+
+CSW_NS = 'http://www.opengis.net/cat/csw/2.0.2'
+
+ISO_RECORD = u'''<gmd:MD_Metadata xmlns:gmd="http://www.isotc211.org/2005/gmd" xmlns:gco="http://www.isotc211.org/2005/gco">
+  <gmd:fileIdentifier><gco:CharacterString>{0}</gco:CharacterString></gmd:fileIdentifier>
+  <gmd:language><gco:CharacterString>eng; CAN</gco:CharacterString></gmd:language>
+  <gmd:identificationInfo>
+    <gmd:MD_DataIdentification>
+      <gmd:citation>
+        <gmd:CI_Citation>
+          <gmd:title><gco:CharacterString>{1}</gco:CharacterString></gmd:title>
+        </gmd:CI_Citation>
+      </gmd:citation>
+      <gmd:abstract><gco:CharacterString>Canned record served by the CSW stub</gco:CharacterString></gmd:abstract>
+    </gmd:MD_DataIdentification>
+  </gmd:identificationInfo>
+</gmd:MD_Metadata>'''
+
+SEARCH_RESULTS = u'''<csw:GetRecordsResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <csw:SearchResults numberOfRecordsMatched="{0}" numberOfRecordsReturned="{1}" nextRecord="{2}" elementSet="brief">
+{3}
+  </csw:SearchResults>
+</csw:GetRecordsResponse>'''
+
+BRIEF_RECORD = u'<csw:BriefRecord><dc:identifier>{0}</dc:identifier><dc:title>{1}</dc:title></csw:BriefRecord>'
+
+RECORD_BY_ID = u'''<csw:GetRecordByIdResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2">
+{0}
+</csw:GetRecordByIdResponse>'''
+
+RECORDS = [
+    ('9c3a2f4e-0000-4000-8000-000000000001', u'Stations hydrométriques'),
+    ('9c3a2f4e-0000-4000-8000-000000000002', u'Air quality monitoring'),
+    ('9c3a2f4e-0000-4000-8000-000000000003', u'Ice thickness'),
+]
+PAGE_SIZE = 2
+
+
+class CswStub(BaseHTTPRequestHandler):
+    """Serves the canned records, PAGE_SIZE records per GetRecords page"""
+
+    def do_POST(self):
+        request = etree.fromstring(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(request)
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.in_flight -= 1
+
+        if request.tag == '{{{0}}}GetRecords'.format(CSW_NS):
+            start = int(request.get('startPosition', 1) or 1)
+            if start < 1:
+                start = 1
+            page = RECORDS[start - 1:start - 1 + PAGE_SIZE]
+            next_record = start + len(page)
+            if next_record > len(RECORDS):
+                next_record = 0
+            body = SEARCH_RESULTS.format(len(RECORDS), len(page), next_record,
+                                         u'\n'.join(BRIEF_RECORD.format(*r) for r in page))
+        else:
+            record_id = request.findtext('{{{0}}}Id'.format(CSW_NS))
+            body = RECORD_BY_ID.format(u''.join(ISO_RECORD.format(*r) for r in RECORDS if r[0] == record_id))
+
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def setup_module(module):
+    module.server = ThreadingHTTPServer(('127.0.0.1', 0), CswStub)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.delay = 0
+    server.in_flight = 0
+    server.max_in_flight = 0
+    module.url = 'http://127.0.0.1:{0}/csw'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+
+def teardown_module(module):
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_records_pages():
+    client = CswClient(url)
+    results, records = client.get_records()
+    assert results == {'matches': 3, 'returned': 2, 'nextrecord': 3}
+    assert list(records) == [RECORDS[0][0], RECORDS[1][0]]
+    assert records[RECORDS[0][0]].title == RECORDS[0][1]
+
+    results, records = client.get_records(results['nextrecord'])
+    assert results['nextrecord'] == 0
+    assert list(records) == [RECORDS[2][0]]
+
+
+def test_get_records_since():
+    from datetime import datetime
+    CswClient(url, page_size=25).get_records(since=datetime(2015, 2, 11))
+    literal = server.requests[-1].find('.//{http://www.opengis.net/ogc}Literal')
+    assert literal.text == '2015-02-11'
+    assert server.requests[-1].get('maxRecords') == '25'
+
+
+def test_get_all_records_page_size():
+    CswClient(url, page_size=25).get_records()
+    assert server.requests[-1].get('maxRecords') == '25'
+
+
+def test_get_record():
+    record = CswClient(url).get_record(RECORDS[0][0])
+    assert record.identifier == RECORDS[0][0]
+    assert record.title == RECORDS[0][1]
+    nap = etree.fromstring(record.xml)
+    assert nap.tag == '{http://www.isotc211.org/2005/gmd}MD_Metadata'
+
+
+def test_get_missing_record():
+    assert CswClient(url).get_record('no-such-record') is None
+
+
+def test_concurrency_cap():
+    client = CswClient(url, max_concurrency=2)
+    server.delay = 0.05
+    server.max_in_flight = 0
+    pool = ThreadPool(6)
+    try:
+        records = pool.map(client.get_record, [r[0] for r in RECORDS] * 2)
+    finally:
+        pool.close()
+        server.delay = 0
+    assert [r.identifier for r in records] == [r[0] for r in RECORDS] * 2
+    assert 1 < server.max_in_flight <= 2
+
+
+def test_ec_scan():
+    import csw_scanner
+    import simplejson as json
+    from db_schema import ECRecord, close_session, connect_to_database, get_setting
+    from harvest_sources import run_scan
+    from harvester_config import load_config
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(work_dir, 'harvester.ini')
+        with open(config_path, 'w') as config_file:
+            config_file.write('[sqlalchemy]\nsqlalchemy.url = sqlite:///{0}\n'.format(os.path.join(work_dir, 'h.db')))
+            config_file.write('[csw]\ncsw.url = {0}\n'.format(url))
+        load_config(config_path)
+
+        csw_scanner.main(scan_all=True)
+        session = connect_to_database()
+        saved = dict((r.uuid, r) for r in session.query(ECRecord).all())
+        close_session()
+        assert sorted(saved) == sorted(r[0] for r in RECORDS)
+        assert saved[RECORDS[0][0]].title == RECORDS[0][1]
+        assert saved[RECORDS[0][0]].state == 'active'
+
+        # A scan stopped with Ctrl-C between two checkpoints still saves the records it has done
+        def interrupt(record):
+            if record.uuid != RECORDS[0][0]:
+                raise KeyboardInterrupt()
+        try:
+            run_scan(csw_scanner.ECSource(scan_all=True), checkpoint_interval=100, record_sink=interrupt,
+                     batch_size=1)
+            assert False, 'Expected KeyboardInterrupt'
+        except KeyboardInterrupt:
+            pass
+        cursor = json.loads(get_setting('ec_scan_cursor', refresh=True).setting_value)
+        assert cursor['pending'] == [RECORDS[1][0]]
+    finally:
+        load_config()
+        shutil.rmtree(work_dir)
+
+
+def test_http_cache_replay():
+    import http_cache
+    from http_cache import CacheMissError, HttpCache
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        http_cache._cache = HttpCache(cache_dir)
+        client = CswClient(url)
+        record = client.get_record(RECORDS[1][0])
+        request_count = len(server.requests)
+
+        # Served from the cache, without a request to the server
+        http_cache._cache = HttpCache(cache_dir, replay=True)
+        replayed = client.get_record(RECORDS[1][0])
+        assert len(server.requests) == request_count
+        assert replayed.xml == record.xml
+
+        try:
+            client.get_record(RECORDS[2][0])
+            assert False, 'Expected a cache miss'
+        except CacheMissError:
+            pass
+    finally:
+        http_cache.reset_http_cache()
+        shutil.rmtree(cache_dir)
+
+
+def test_http_cache_eviction():
+    from http_cache import HttpCache
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # Room for about two of the three records
+        cache = HttpCache(cache_dir, max_size=2500)
+        for record_id, _ in RECORDS:
+            request_xml = '<csw:GetRecordById xmlns:csw="{0}"><csw:Id>{1}</csw:Id></csw:GetRecordById>'.format(
+                CSW_NS, record_id)
+            cache.request('POST', url, data=request_xml)
+        assert 0 < len(list(cache._entries())) < len(RECORDS)
+        assert cache._size <= 2500
+    finally:
+        shutil.rmtree(cache_dir)
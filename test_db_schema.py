@@ -0,0 +1,11 @@
+from datetime import datetime
+
+from db_schema import Timestamp
+from sqlalchemy.dialects import postgresql
+
+
+def test_timestamp_bind_ignores_zone():
+    # The last_conversion_* watermarks end in Z; a timezone-aware bind would be shifted by the server's offset
+    value = Timestamp().process_bind_param('2026-10-19T11:00:00.000Z', postgresql.dialect())
+    assert value == datetime(2026, 10, 19, 11, 0, 0)
+    assert value.tzinfo is None
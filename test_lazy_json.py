@@ -0,0 +1,29 @@
+import simplejson as json
+
+from lazy_json import JsonFragment, _loads_walked, json_value, loads_lazy
+
+RECORD = u'{"title": "geometry", "geometry": {"type": "Polygon", "coordinates": [[[1.5, 2], [3, 4]]]}, ' \
+         u'"files": [{"link": "http://x/a]}.zip"}], "empty": {}, "deleted": "false"}'
+
+
+def test_lazy_values_are_not_decoded():
+    record = loads_lazy(RECORD, ['geometry', 'files', 'empty'])
+    assert isinstance(record['geometry'], JsonFragment)
+    assert record['geometry'].text == u'{"type": "Polygon", "coordinates": [[[1.5, 2], [3, 4]]]}'
+    assert json_value(record['files']) == [{'link': 'http://x/a]}.zip'}]
+    assert record['empty'] == {}
+    assert record['title'] == 'geometry'
+    assert dict((k, json_value(v)) for k, v in record.items()) == json.loads(RECORD)
+
+
+def test_walked_and_spliced_agree():
+    keys = frozenset(['geometry', 'files'])
+    walked = _loads_walked(RECORD, keys)
+    spliced = loads_lazy(RECORD, keys)
+    assert walked['geometry'].text == spliced['geometry'].text
+    assert walked['files'].text == spliced['files'].text
+
+
+def test_nested_key_is_not_taken_for_the_top_level_one():
+    record = loads_lazy(u'{"extent": {"geometry": [1, 2]}, "geometry": null}', ['geometry'])
+    assert record == {'extent': {'geometry': [1, 2]}, 'geometry': None}
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from metadata_model import MetadataDatasetModel, MetadataResourcesModel, compare_list
+
+
+def _dataset():
+    ds = MetadataDatasetModel()
+    ds.id = 'a1'
+    ds.title = u'Title'
+    ds.state = 'active'
+    ds.keywords = [u'lakes', u'rivers']
+    ds.keywords_fra = [u'lacs', u'rivières']
+    ds.topic_category = ['nature_and_environment']
+    ds.resources = [MetadataResourcesModel(u'Data', u'Données', 'http://x/a.zip', 'ZIP'),
+                    MetadataResourcesModel(u'Map', u'Carte', 'http://x/a.pdf', 'PDF')]
+    return ds
+
+
+def test_as_dict_round_trip():
+    ds = _dataset()
+    me = ds.as_dict()
+    assert me['name'] == me['id'] == 'a1'
+    assert me['keywords'] == u'lakes,rivers'
+    assert len(me['resources']) == 2
+    assert MetadataDatasetModel.from_dict(me).as_dict() == me
+
+
+def test_equals_compares_last_items():
+    ds = _dataset()
+    other = _dataset()
+    assert ds.equals(other)
+    other.keywords[-1] = u'streams'
+    other.resources[-1].url = 'http://x/b.pdf'
+    assert not ds.equals(other)
+    assert ds.diff_fields(other) == ['keywords', 'resources']
+    assert not compare_list([1, 2], [1, 3])
+
+
+def test_compare_state():
+    ds = _dataset()
+    other = _dataset()
+    other.state = 'deleted'
+    assert ds.compare(other, 'Harvested', 'Portal') == [u'State: \tHarvested [active], \tPortal [deleted]']
+
+
+def test_compare_labels():
+    ds = _dataset()
+    ds.geographic_region = ['ON']
+    ds.subject = ['nature']
+    other = _dataset()
+    other.keywords_fra[-1] = u'ruisseaux'
+    other.geographic_region = ['QC']
+    other.subject = ['science']
+    other.topic_category = []
+    assert [line.split(':')[0] for line in ds.compare(other)] == ['Keywords FR', 'geographic_region', 'Topics',
+                                                                  'subject']
+    other.keywords_fra.append(u'étangs')
+    other.subject = []
+    assert [line.split(':')[0] for line in ds.compare(other)] == ['Keywords (FR)', 'geographic_region', 'Topics',
+                                                                  'Subjects']
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+from profiling import HOT_FUNCTIONS
+
+BENCH_HARVEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'bench_harvest.py')
+
+
+def test_hot_functions_are_called():
+    # A small harvest of both sources, from the scans to the dumps, against the stub servers of the benchmark
+    bench = subprocess.Popen([sys.executable, BENCH_HARVEST, '-n', '5', '--profile-functions', 'hot'],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, report = bench.communicate()
+    assert bench.returncode == 0, report
+    timed = [line.split()[0] for line in report.splitlines()[1:] if line.strip()]
+    assert [spec for spec in HOT_FUNCTIONS if spec not in timed] == []
@@ -0,0 +1,80 @@
+__author__ = 'Statistics Canada'
+__license__ = 'MIT'
+
+import logging
+import re
+
+from collections import Counter
+from metadata_schema import schema_description
+from metrics import get_metrics
+
+_NOT_LETTERS = re.compile(u'[^a-z]+')
+
+
+def _fold(spelling):
+    """Lower case letters only, so that 'inlandWaters', 'Inlandwaters' and 'Inland Waters' are the same"""
+    return _NOT_LETTERS.sub(u'', spelling.lower())
+
+
+def _iso_code(eng):
+    """The ISO 19115 MD_TopicCategoryCode of a topic, e.g. 'Inland Waters' -> 'inlandWaters'"""
+    words = re.findall(u'[A-Za-z]+', eng)
+    return words[0].lower() + u''.join(w.title() for w in words[1:])
+
+
+class TopicResolver(object):
+    """Maps the topic categories of harvested records to Open Data topics and subjects.
+
+    The table of every known spelling of a topic is built once from schema.json: the English label, the
+    ISO topic category code as it appears in Geogratis and NAP records, the title-cased code that the EC
+    feed produces, and Geogratis' bilingual "code; french label" form. Each spelling resolves to the topic
+    key and the sorted keys of the topic's subjects. Other spellings are matched on their letters alone and
+    added to the table; spellings that match no topic are counted in `unknown` and in the unknown_topics_total
+    metric.
+
+    """
+
+    def __init__(self):
+        subjects = schema_description.dataset_field_by_id['subject']['choices_by_id']
+        self.table = {}
+        self._folded = {}
+        self.unknown = Counter()
+        for topic in schema_description.dataset_field_by_id['topic_category']['choices']:
+            if 'eng' not in topic:
+                continue
+            subject_keys = tuple(sorted(set(subjects[s]['key'] for s in topic['subject_ids'] if s in subjects)))
+            resolution = ((topic['key'],), subject_keys)
+            code = _iso_code(topic['eng'])
+            for spelling in (topic['eng'], code, code.title(), u'{0}; {1}'.format(code, topic['fra'].lower())):
+                self.table[spelling] = resolution
+            self._folded[_fold(topic['eng'])] = resolution
+
+    def resolve(self, raw):
+        """Return the (topic keys, subject keys) tuple of a raw topic spelling; both are empty if it is unknown"""
+        try:
+            return self.table[raw]
+        except KeyError:
+            pass
+        resolution = self._folded.get(_fold(raw))
+        if resolution is None:
+            if raw not in self.unknown:
+                logging.warning(u'Unknown topic category: {0}'.format(raw))
+            self.unknown[raw] += 1
+            get_metrics().increment('unknown_topics_total')
+            return (), ()
+        self.table[raw] = resolution
+        return resolution
+
+    def resolve_all(self, raws):
+        """Return the topic keys, in the order of the record, and the sorted unique subject keys of a record"""
+        topics = []
+        subjects = set()
+        for raw in raws:
+            if raw is None:
+                continue
+            topic_keys, subject_keys = self.resolve(raw)
+            for key in topic_keys:
+                if key not in topics:
+                    topics.append(key)
+            subjects.update(subject_keys)
+        return topics, sorted(subjects)